@@ -0,0 +1,33 @@
+"""测试脚本共用的合成语料: 由几个病历句子拼接成文本,并标注其中出现的实体
+
+在benchmarks目录下的脚本中通过from corpus import ...导入
+"""
+from typing import List, Optional
+import random
+
+
+TEXTS = ['患者于2020年3月在北京协和医院行胆囊切除术,',
+         '术后恢复良好,无发热、腹痛等不适。',
+         '既往有高血压病史十年,规律服用硝苯地平控释片。',
+         '今为进一步治疗来我院就诊,门诊以慢性胆囊炎收入院。']
+ENTS = [('北京协和医院', 'ORG'), ('胆囊切除术', 'OPERATION'), ('发热', 'SYMPTOM'), ('腹痛', 'SYMPTOM'),
+        ('高血压', 'DISEASE'), ('硝苯地平控释片', 'DRUG'), ('慢性胆囊炎', 'DISEASE')]
+
+
+def make_text(num_sentences: Optional[int] = None) -> str:
+    """num_sentences为None时将所有句子打乱后拼接,否则有放回地抽取num_sentences个句子拼接
+    """
+    if num_sentences is None:
+        return ''.join(random.sample(TEXTS, k=len(TEXTS)))
+    return ''.join(random.choices(TEXTS, k=num_sentences))
+
+
+def make_ents(text: str) -> List[dict]:
+    """文本中出现的实体,每个实体取第一次出现的位置,顺序与ENTS相同
+    """
+    ents = []
+    for ent_text, label in ENTS:
+        start = text.find(ent_text)
+        if start >= 0:
+            ents.append({'text': ent_text, 'indices': list(range(start, start + len(ent_text))), 'label': label})
+    return ents
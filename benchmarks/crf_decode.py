@@ -0,0 +1,78 @@
+"""CRF速度测试: 对比逐样本逐时间步回溯的viterbi解码与整个批次张量回溯的解码,以及顺序前向算法与并行扫描的归一化因子
+
+用法:
+    python benchmarks/crf_decode.py --batch_size 64 --seq_length 512 --num_tags 9
+    python benchmarks/crf_decode.py --device cuda
+
+序列长度在seq_length/2到seq_length之间随机,测试前先检查两种实现的结果一致,以及top-k解码第一条路径的分数与viterbi解码一致
+"""
+from nlhappy.layers import CRF
+import argparse
+import time
+import torch
+
+
+def benchmark(fn, repeat: int) -> float:
+    """每次调用的平均毫秒数"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def loop_score(crf: CRF, emissions: torch.Tensor, tags: torch.LongTensor, mask: torch.ByteTensor) -> torch.Tensor:
+    """原来的做法: 按时间步循环累加发射分数和转移分数"""
+    emissions, tags, mask = emissions.transpose(0, 1), tags.transpose(0, 1), mask.transpose(0, 1)
+    seq_length, batch_size = tags.shape
+    mask = mask.float()
+    score = crf.start_transitions[tags[0]] + emissions[0, torch.arange(batch_size), tags[0]]
+    for i in range(1, seq_length):
+        score = score + crf.transitions[tags[i - 1], tags[i]] * mask[i]
+        score = score + emissions[i, torch.arange(batch_size), tags[i]] * mask[i]
+    last_tags = tags[mask.long().sum(dim=0) - 1, torch.arange(batch_size)]
+    return score + crf.end_transitions[last_tags]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--seq_length', type=int, default=512)
+    parser.add_argument('--num_tags', type=int, default=9)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    crf = CRF(args.num_tags).to(device)
+    emissions = torch.randn(args.batch_size, args.seq_length, args.num_tags, device=device)
+    tags = torch.randint(args.num_tags, (args.batch_size, args.seq_length), device=device)
+    lengths = torch.randint(max(1, args.seq_length // 2), args.seq_length + 1, (args.batch_size,), device=device)
+    lengths[0] = args.seq_length
+    mask = (torch.arange(args.seq_length, device=device) < lengths.unsqueeze(1)).to(torch.uint8)
+    emissions_t, mask_t = emissions.transpose(0, 1), mask.transpose(0, 1)
+
+    with torch.no_grad():
+        assert crf._viterbi_decode(emissions_t, mask_t) == crf.decode(emissions, mask=mask), '两种解码结果不一致'
+        assert torch.allclose(loop_score(crf, emissions, tags, mask), crf._compute_score(emissions_t, tags.transpose(0, 1), mask_t), atol=1e-3), '两种路径分数不一致'
+        sequential = crf._compute_normalizer(emissions_t, mask_t)
+        parallel = crf._compute_normalizer_parallel(emissions_t, mask_t)
+        assert torch.allclose(sequential, parallel, rtol=1e-4), '两种归一化因子不一致'
+        # 长序列上存在分数只相差浮点误差的路径,因此比较分数而不是路径
+        best_score = crf._compute_score(emissions_t, crf.batch_decode(emissions, mask=mask).transpose(0, 1), mask_t)
+        assert torch.allclose(crf.decode_topk(emissions, mask=mask, k=5)[1][:, 0], best_score, rtol=1e-5), 'top-k的第一条路径与viterbi解码不一致'
+
+    print(f'batch_size: {args.batch_size}, seq_length: {args.seq_length}, num_tags: {args.num_tags}, device: {args.device}')
+    with torch.no_grad():
+        print(f'decode per-sample backtrace  : {benchmark(lambda: crf._viterbi_decode(emissions_t, mask_t), args.repeat):.1f} ms')
+        print(f'decode batched backtrace     : {benchmark(lambda: crf.decode(emissions, mask=mask), args.repeat):.1f} ms')
+        print(f'batch_decode (padded tensor) : {benchmark(lambda: crf.batch_decode(emissions, mask=mask), args.repeat):.1f} ms')
+        print(f'decode_topk (k=5)            : {benchmark(lambda: crf.decode_topk(emissions, mask=mask, k=5), args.repeat):.1f} ms')
+        print(f'score loop                   : {benchmark(lambda: loop_score(crf, emissions, tags, mask), args.repeat):.1f} ms')
+        print(f'score gather                 : {benchmark(lambda: crf._compute_score(emissions_t, tags.transpose(0, 1), mask_t), args.repeat):.1f} ms')
+        print(f'normalizer sequential        : {benchmark(lambda: crf._compute_normalizer(emissions_t, mask_t), args.repeat):.1f} ms')
+        print(f'normalizer parallel scan     : {benchmark(lambda: crf._compute_normalizer_parallel(emissions_t, mask_t), args.repeat):.1f} ms')
+    crf.parallel_scan = False
+    print(f'loss + backward sequential   : {benchmark(lambda: crf(emissions, tags, mask=mask).backward(), args.repeat):.1f} ms')
+    crf.parallel_scan = True
+    print(f'loss + backward parallel scan: {benchmark(lambda: crf(emissions, tags, mask=mask).backward(), args.repeat):.1f} ms')
@@ -0,0 +1,58 @@
+"""Doc构建速度测试: 对比pydantic校验构建与可信数据快速构建的速度(docs/sec)
+
+用法:
+    python benchmarks/doc_construction.py --num_docs 100000
+"""
+from nlhappy.data.doc import DocBin, Doc
+from corpus import make_text, make_ents
+from pathlib import Path
+import tempfile
+import argparse
+import random
+import time
+import srsly
+
+
+def make_doc_dict(i: int) -> dict:
+    text = make_text()
+    ents = make_ents(text)
+    rels = [{'s': ents[1], 'p': '地点', 'o': ents[0]}, {'s': ents[5], 'p': '治疗', 'o': ents[4]}]
+    return Doc(text=text, id=str(i), ents=ents, rels=rels).dict()
+
+
+def benchmark_jsonl(file_path: Path, validate: bool) -> float:
+    """包含jsonl解析的端到端速度"""
+    start = time.perf_counter()
+    docs = DocBin.from_jsonl(file_path=file_path, validate=validate)
+    seconds = time.perf_counter() - start
+    return len(docs) / seconds
+
+
+def benchmark_construction(datas: list, validate: bool) -> float:
+    """不包含jsonl解析,只统计doc构建速度"""
+    start = time.perf_counter()
+    if validate:
+        docs = [Doc(**d) for d in datas]
+    else:
+        docs = [Doc.from_trusted_dict(d) for d in datas]
+    seconds = time.perf_counter() - start
+    return len(docs) / seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_docs', type=int, default=100000)
+    args = parser.parse_args()
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = Path(tmp_dir, 'corpus.jsonl')
+        srsly.write_jsonl(path=file_path, lines=(make_doc_dict(i) for i in range(args.num_docs)))
+        validated = DocBin.from_jsonl(file_path=file_path, validate=True)
+        trusted = DocBin.from_jsonl(file_path=file_path, validate=False)
+        assert all(a.dict() == b.dict() for a, b in zip(validated[:1000], trusted[:1000])), '两种方式构建的doc不一致'
+        datas = list(srsly.read_jsonl(file_path))
+        print(f'num_docs: {args.num_docs}')
+        print(f'construction validate=True : {benchmark_construction(datas, validate=True):.0f} docs/sec')
+        print(f'construction validate=False: {benchmark_construction(datas, validate=False):.0f} docs/sec')
+        print(f'from_jsonl   validate=True : {benchmark_jsonl(file_path, validate=True):.0f} docs/sec')
+        print(f'from_jsonl   validate=False: {benchmark_jsonl(file_path, validate=False):.0f} docs/sec')
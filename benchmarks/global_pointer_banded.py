@@ -0,0 +1,76 @@
+"""EfficientGlobalPointer速度测试: 对比完整的[B, C, L, L]分数与带状的[B, C, L, W]分数的前向+反向时间和分数张量大小
+
+用法:
+    python benchmarks/global_pointer_banded.py --batch_size 4 --seq_length 2048 --max_span_width 64
+    python benchmarks/global_pointer_banded.py --device cuda
+
+测试前先检查带状分数与完整分数对应位置的值一致,并且解码结果一致
+"""
+from nlhappy.layers import EfficientGlobalPointer, MultiLabelCategoricalCrossEntropy, extract_spans, dense_to_banded
+import argparse
+import time
+import torch
+
+
+def benchmark(fn, repeat: int) -> float:
+    """每次调用的平均毫秒数"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def step(gp: EfficientGlobalPointer, inputs: torch.Tensor, mask: torch.Tensor, span_ids: torch.Tensor) -> torch.Tensor:
+    """前向,损失和反向"""
+    logits = gp(inputs, mask=mask)
+    if gp.max_span_width is not None:
+        span_ids = dense_to_banded(span_ids, logits.shape[-1])
+    loss = MultiLabelCategoricalCrossEntropy()(logits.reshape(-1, logits.shape[-2] * logits.shape[-1]), span_ids.reshape(-1, span_ids.shape[-2] * span_ids.shape[-1]))
+    loss.backward()
+    return logits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--seq_length', type=int, default=2048)
+    parser.add_argument('--num_labels', type=int, default=8)
+    parser.add_argument('--max_span_width', type=int, default=64)
+    parser.add_argument('--input_size', type=int, default=256)
+    parser.add_argument('--hidden_size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    dense = EfficientGlobalPointer(args.input_size, args.hidden_size, args.num_labels, max_length=args.seq_length).to(device)
+    banded = EfficientGlobalPointer(args.input_size, args.hidden_size, args.num_labels, max_length=args.seq_length, max_span_width=args.max_span_width).to(device)
+    banded.load_state_dict(dense.state_dict())
+    inputs = torch.randn(args.batch_size, args.seq_length, args.input_size, device=device)
+    lengths = torch.randint(args.seq_length // 2, args.seq_length + 1, (args.batch_size,), device=device)
+    mask = (torch.arange(args.seq_length, device=device) < lengths.unsqueeze(1)).float()
+    # 随机的短实体
+    span_ids = torch.zeros(args.batch_size, args.num_labels, args.seq_length, args.seq_length, device=device)
+    starts = torch.randint(args.seq_length // 2, (args.batch_size, args.num_labels, 10), device=device)
+    ends = starts + torch.randint(args.max_span_width, starts.shape, device=device)
+    batch = torch.arange(args.batch_size, device=device)[:, None, None]
+    label = torch.arange(args.num_labels, device=device)[None, :, None]
+    span_ids[batch, label, starts, ends] = 1
+
+    with torch.no_grad():
+        dense_logits = dense(inputs, mask=mask)
+        banded_logits = banded(inputs, mask=mask)
+        assert torch.equal(extract_spans(dense_logits, max_span_width=args.max_span_width)[0], extract_spans(banded_logits, banded=True)[0]), '两种分数的解码结果不一致'
+        expected = dense_to_banded(dense_logits, banded_logits.shape[-1])
+        valid = banded_logits > -1e11
+        assert torch.allclose(banded_logits[valid], expected[valid], atol=1e-4), '带状分数与完整分数不一致'
+
+    print(f'batch_size: {args.batch_size}, seq_length: {args.seq_length}, num_labels: {args.num_labels}, max_span_width: {args.max_span_width}, device: {args.device}')
+    print(f'logits dense : {tuple(dense_logits.shape)}, {dense_logits.numel() * 4 / 2 ** 20:.0f} MB')
+    print(f'logits banded: {tuple(banded_logits.shape)}, {banded_logits.numel() * 4 / 2 ** 20:.0f} MB')
+    print(f'forward + loss + backward dense : {benchmark(lambda: step(dense, inputs, mask, span_ids), args.repeat):.1f} ms')
+    print(f'forward + loss + backward banded: {benchmark(lambda: step(banded, inputs, mask, span_ids), args.repeat):.1f} ms')
+    with torch.no_grad():
+        print(f'decode dense : {benchmark(lambda: extract_spans(dense(inputs, mask=mask)), args.repeat):.1f} ms')
+        print(f'decode banded: {benchmark(lambda: extract_spans(banded(inputs, mask=mask), banded=True), args.repeat):.1f} ms')
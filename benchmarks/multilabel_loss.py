@@ -0,0 +1,92 @@
+"""MultiLabelCategoricalCrossEntropy测试: 对比原实现与按行分块计算的实现的损失,梯度,速度,为反向保存的张量大小和cuda上的显存峰值
+
+用法:
+    python benchmarks/multilabel_loss.py --batch_size 4 --num_labels 8 --seq_length 512
+    python benchmarks/multilabel_loss.py --device cuda
+
+输入为GlobalPointer形式的[batch_size * num_labels, seq_len * seq_len],测试前先检查两种实现的损失和梯度一致,
+包括没有正类的行,全部为正类的行以及三维的输入
+"""
+from nlhappy.layers import MultiLabelCategoricalCrossEntropy
+import argparse
+import time
+import torch
+
+
+def benchmark(fn, repeat: int, device: torch.device) -> tuple:
+    """每次调用的平均毫秒数以及cuda上的显存峰值(MB)"""
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        return (time.perf_counter() - start) / repeat * 1000, torch.cuda.max_memory_allocated() / 2 ** 20
+    return (time.perf_counter() - start) / repeat * 1000, float('nan')
+
+
+def saved_memory(criterion: MultiLabelCategoricalCrossEntropy, y_pred: torch.Tensor, y_true: torch.Tensor) -> float:
+    """前向为反向保存的张量大小(MB),不包括输入本身"""
+    y_pred = y_pred.detach().requires_grad_()
+    saved = {}
+
+    def pack(tensor):
+        if tensor.data_ptr() not in [y_pred.data_ptr(), y_true.data_ptr()]:
+            saved[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        criterion(y_pred, y_true)
+    return sum(saved.values()) / 2 ** 20
+
+
+def loss_and_grad(criterion: MultiLabelCategoricalCrossEntropy, y_pred: torch.Tensor, y_true: torch.Tensor) -> tuple:
+    y_pred = y_pred.detach().requires_grad_()
+    loss = criterion(y_pred, y_true)
+    loss.backward()
+    return loss.detach(), y_pred.grad
+
+
+def check_parity(y_pred: torch.Tensor, y_true: torch.Tensor, chunk_size: int) -> None:
+    unfused = MultiLabelCategoricalCrossEntropy(fused=False)
+    fused = MultiLabelCategoricalCrossEntropy(fused=True, chunk_size=chunk_size)
+    loss_a, grad_a = loss_and_grad(unfused, y_pred, y_true)
+    loss_b, grad_b = loss_and_grad(fused, y_pred, y_true)
+    assert torch.allclose(loss_a, loss_b, rtol=1e-5, atol=1e-5), f'损失不一致: {loss_a} {loss_b}'
+    assert torch.allclose(grad_a, grad_b, rtol=1e-4, atol=1e-7), f'梯度不一致: {(grad_a - grad_b).abs().max()}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_labels', type=int, default=8)
+    parser.add_argument('--seq_length', type=int, default=512)
+    parser.add_argument('--chunk_size', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    num_rows, num_classes = args.batch_size * args.num_labels, args.seq_length ** 2
+    y_pred = torch.randn(num_rows, num_classes, device=device) * 5
+    # globalpointer的下三角和padding为-1e12
+    y_pred[:, :num_classes // 4] = -1e12
+    y_true = torch.zeros(num_rows, num_classes, device=device)
+    y_true.scatter_(-1, torch.randint(num_classes // 4, num_classes, (num_rows, 5), device=device), 1.0)
+    y_true[0] = 0
+    y_true[1, num_classes // 4:] = 1
+
+    small_pred, small_true = y_pred[:, :1000], y_true[:, :1000]
+    check_parity(small_pred, small_true, chunk_size=3)
+    check_parity(small_pred.reshape(args.batch_size, args.num_labels, -1), small_true.reshape(args.batch_size, args.num_labels, -1), chunk_size=5)
+    check_parity(y_pred, y_true, chunk_size=args.chunk_size or 7)
+
+    unfused = MultiLabelCategoricalCrossEntropy(fused=False)
+    fused = MultiLabelCategoricalCrossEntropy(fused=True, chunk_size=args.chunk_size)
+    print(f'rows: {num_rows}, classes: {num_classes}, input: {y_pred.numel() * 4 / 2 ** 20:.0f} MB, device: {args.device}')
+    for name, criterion in [('unfused', unfused), ('fused  ', fused)]:
+        ms, peak = benchmark(lambda: loss_and_grad(criterion, y_pred, y_true), args.repeat, device)
+        print(f'{name} loss + backward: {ms:.1f} ms, saved for backward: {saved_memory(criterion, y_pred, y_true):.0f} MB, cuda peak memory: {peak:.0f} MB')
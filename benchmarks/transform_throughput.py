@@ -0,0 +1,87 @@
+"""transform吞吐量测试: 对比每个批次分词两次(逐条encode获取最大长度+批量分词)与批量分词一次的速度(examples/sec)
+
+用法:
+    python benchmarks/transform_throughput.py --num_examples 20000 --batch_size 32
+    python benchmarks/transform_throughput.py --plm_dir plms --plm hfl/chinese-roberta-wwm-ext
+
+不指定plm时根据合成语料构建一个字级别的BertTokenizerFast
+"""
+from nlhappy.datamodules import EntityExtractionDataModule
+from corpus import TEXTS, make_text, make_ents
+from datasets import Dataset, DatasetDict
+from transformers import BertTokenizerFast
+from pathlib import Path
+import tempfile
+import argparse
+import random
+import time
+
+
+def make_example() -> dict:
+    # 文本长度在1到8个句子之间变化
+    text = make_text(num_sentences=random.randint(1, 8))
+    return {'text': text, 'ents': make_ents(text)}
+
+
+def build_char_tokenizer(plm_path: Path) -> None:
+    chars = sorted(set(''.join(TEXTS)))
+    plm_path.mkdir(parents=True, exist_ok=True)
+    with open(plm_path / 'vocab.txt', 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + chars) + '\n')
+    BertTokenizerFast(str(plm_path / 'vocab.txt')).save_pretrained(str(plm_path))
+
+
+def two_pass_tokenize(dm: EntityExtractionDataModule, batch_text: list):
+    """原来的做法: 逐条encode获取批次最大长度,再批量分词一次"""
+    max_length = max([len(dm.tokenizer.encode(t)) for t in batch_text])
+    max_length = min([dm.hparams.plm_max_length, max_length])
+    return dm.tokenizer(batch_text,
+                        max_length=max_length,
+                        padding='max_length',
+                        truncation=True,
+                        return_token_type_ids=False,
+                        return_tensors='pt')
+
+
+def single_pass_tokenize(dm: EntityExtractionDataModule, batch_text: list):
+    return dm.tokenize_batch(batch_text, return_token_type_ids=False)
+
+
+def benchmark(fn, batches: list) -> float:
+    start = time.perf_counter()
+    num_examples = 0
+    for batch in batches:
+        fn(batch)
+        num_examples += len(batch['input_ids'] if 'input_ids' in batch else batch['text'])
+    seconds = time.perf_counter() - start
+    return num_examples / seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_examples', type=int, default=20000)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--plm_dir', type=str, default=None)
+    parser.add_argument('--plm', type=str, default='char_tokenizer')
+    args = parser.parse_args()
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plm_dir = args.plm_dir or tmp_dir
+        if args.plm_dir is None:
+            build_char_tokenizer(Path(tmp_dir, args.plm))
+        ds = Dataset.from_list([make_example() for _ in range(args.num_examples)])
+        DatasetDict({'train': ds, 'validation': ds.select(range(10)), 'test': ds.select(range(10))}).save_to_disk(str(Path(tmp_dir, 'corpus')))
+        dm = EntityExtractionDataModule(dataset='corpus', plm=args.plm, batch_size=args.batch_size, plm_dir=plm_dir, dataset_dir=tmp_dir)
+        dm.setup('fit')
+        train = dm.dataset['train']
+        batches = [train[i: i + args.batch_size] for i in range(0, len(train), args.batch_size)]
+        a = two_pass_tokenize(dm, batches[0]['text'])
+        b = single_pass_tokenize(dm, batches[0]['text'])
+        assert (a['input_ids'] == b['input_ids']).all(), '两种分词方式结果不一致'
+        print(f'num_examples: {args.num_examples}, batch_size: {args.batch_size}')
+        print(f'tokenize two pass   : {benchmark(lambda batch: two_pass_tokenize(dm, batch["text"]), batches):.0f} examples/sec')
+        print(f'tokenize single pass: {benchmark(lambda batch: single_pass_tokenize(dm, batch["text"]), batches):.0f} examples/sec')
+        print(f'tp_transform        : {benchmark(dm.tp_transform, batches):.0f} examples/sec')
+        encoded = dm.encode_dataset(split='train', encode=dm.tp_encode)
+        encoded_batches = [encoded[i: i + args.batch_size] for i in range(0, len(encoded), args.batch_size)]
+        print(f'tp_collate (encoded): {benchmark(dm.tp_collate, encoded_batches):.0f} examples/sec')
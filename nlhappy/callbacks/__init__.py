@@ -1,9 +1,11 @@
 from .ckpt_callbacks import LoadPLMStateDict, LoadModelStateDict
+from .sampler_callbacks import PaddingEfficiencyMonitor
 from pytorch_lightning.callbacks import ModelCheckpoint, ModelPruning, ModelSummary, RichModelSummary, EarlyStopping
 
 
 __all__ = ["LoadPLMStateDict", 
            "LoadModelStateDict", 
+           "PaddingEfficiencyMonitor", 
            "ModelCheckpoint", 
            "ModelPruning", 
            "ModelSummary", 
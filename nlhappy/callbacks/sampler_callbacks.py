@@ -0,0 +1,14 @@
+from lightning.pytorch import Callback
+
+
+class PaddingEfficiencyMonitor(Callback):
+    """每个训练epoch结束时记录批次采样器的补齐效率train/padding_efficiency
+    
+    - 只有BucketBatchSampler这类提供padding_efficiency的采样器才会记录
+    """
+    
+    def on_train_epoch_end(self, trainer, pl_module) -> None:
+        sampler = getattr(trainer.train_dataloader, 'sampler', None)
+        padding_efficiency = getattr(sampler, 'padding_efficiency', None)
+        if padding_efficiency is not None:
+            pl_module.log('train/padding_efficiency', padding_efficiency)
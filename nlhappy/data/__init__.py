@@ -1,7 +1,11 @@
-from .doc import Doc, DocBin, Entity, Relation, Event
+from .doc import Doc, DocBin, StreamingDocBin, ArrowDocBin, Entity, Relation, Event
+from .doc_store import DocStore, DocStoreSnapshot
 from .dataset import Dataset, DatasetDict
 from .couplet import Couplet, CoupletBin
+from .sampler import BucketBatchSampler, TokenBudgetBatchSampler
+from .label import get_unique_labels, get_unique_label_pairs
+from .stream import StreamingDataset, StreamingDataLoader
 
 
 
-__all__ = ["Doc", "DocBin", "Entity", "Relation", "Event", "Dataset", "DatasetDict", "Couplet", "CoupletBin"]
\ No newline at end of file
+__all__ = ["Doc", "DocBin", "StreamingDocBin", "ArrowDocBin", "DocStore", "DocStoreSnapshot", "Entity", "Relation", "Event", "Dataset", "DatasetDict", "Couplet", "CoupletBin", "BucketBatchSampler", "TokenBudgetBatchSampler", "get_unique_labels", "get_unique_label_pairs", "StreamingDataset", "StreamingDataLoader"]
\ No newline at end of file
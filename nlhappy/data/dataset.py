@@ -1,64 +1,239 @@
 from datasets import Dataset as Ds
 from datasets import DatasetDict as DsD
+from datasets import IterableDataset, IterableDatasetDict
 from datasets import load_from_disk
-from typing import Union, Tuple
+from typing import Union, Tuple, Optional, List, Sequence, Hashable, Any, Dict
+from collections import defaultdict
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import hashlib
+from .label import iter_arrow_batches
+
+
+def get_stratify_key(value: Any) -> Hashable:
+    """获取分层抽样的分组键
+    - 实体/关系等列表(每个元素为含有label字段的字典): 出现的标签集合,例如NER中的实体类型
+    - 多标签列表: 标签集合
+    - 其他: 原值
+    """
+    if isinstance(value, (list, tuple)):
+        labels = set()
+        for v in value:
+            if isinstance(v, dict):
+                labels.add(v.get('label', v.get('p')))
+            else:
+                labels.add(v)
+        return tuple(sorted(labels, key=str))
+    return value
+
+
+def split_indices(num_rows: int,
+                  fracs: Sequence[float],
+                  seed: Optional[int] = None,
+                  stratify_keys: Optional[List[Hashable]] = None) -> List[List[int]]:
+    """将[0, num_rows)的下标随机切分为len(fracs)+1份,第一份为剩余部分
+
+    Args:
+        num_rows (int): 样本数量
+        fracs (Sequence[float]): 除第一份以外每一份的比例,例如[val_frac, test_frac]
+        seed (Optional[int], optional): 随机种子,相同的种子得到相同的切分. Defaults to None.
+        stratify_keys (Optional[List[Hashable]], optional): 每个样本的分组键,每个分组内分别按照比例切分. Defaults to None.
+
+    Returns:
+        List[List[int]]: 升序排列的每一份下标
+    """
+    rng = np.random.default_rng(seed)
+    if stratify_keys is None:
+        groups = [np.arange(num_rows)]
+    else:
+        assert len(stratify_keys) == num_rows, '分组键数量与样本数量不一致'
+        group_dict = defaultdict(list)
+        for i, key in enumerate(stratify_keys):
+            group_dict[key].append(i)
+        groups = [np.array(v) for v in group_dict.values()]
+    group_sizes = np.array([len(group) for group in groups])
+    sizes = allocate_split_sizes(group_sizes, fracs, rng)
+    splits = [[] for _ in range(len(fracs) + 1)]
+    for group, group_split_sizes in zip(groups, sizes):
+        group = rng.permutation(group)
+        start = 0
+        for i, size in enumerate(group_split_sizes):
+            splits[i + 1].append(group[start: start + size])
+            start += size
+        splits[0].append(group[start:])
+    splits = [np.sort(np.concatenate(s)).tolist() if len(s) > 0 else [] for s in splits]
+    for frac, split in zip(fracs, splits[1:]):
+        assert abs(len(split) - num_rows * frac) <= len(groups), f'split size {len(split)} is far from {num_rows} * {frac}'
+    return splits
+
+
+def allocate_split_sizes(group_sizes: np.ndarray, fracs: Sequence[float], rng: np.random.Generator) -> np.ndarray:
+    """用最大余数法将每一份的总数量round(num_rows * frac)分配到各个分组
+
+    每个分组先得到len(group) * frac向下取整的数量,剩余的数量按照余数从大到小(余数相同时随机)每个分组再分配一个,
+    这样每一份的总数量与比例一致,只有1到几个样本的分组也有机会被分到验证集和测试集
+
+    Args:
+        group_sizes (np.ndarray): 每个分组的样本数量
+        fracs (Sequence[float]): 除第一份以外每一份的比例
+        rng (np.random.Generator): 随机数生成器
+
+    Returns:
+        np.ndarray: [num_groups, len(fracs)],每个分组在每一份中的数量
+    """
+    num_rows = int(group_sizes.sum())
+    sizes = np.zeros((len(group_sizes), len(fracs)), dtype='int64')
+    for i, frac in enumerate(fracs):
+        capacity = group_sizes - sizes.sum(axis=1)
+        quota = group_sizes * frac
+        sizes[:, i] = np.minimum(np.floor(quota).astype('int64'), capacity)
+        remaining = min(int(round(num_rows * frac)), int(capacity.sum())) - int(sizes[:, i].sum())
+        # 随机打乱后按照余数稳定排序,余数相同的分组随机排列
+        order = rng.permutation(len(group_sizes))
+        order = order[np.argsort(-(quota - np.floor(quota))[order], kind='stable')]
+        while remaining > 0:
+            for g in order:
+                if remaining == 0:
+                    break
+                if sizes[g, i] < capacity[g]:
+                    sizes[g, i] += 1
+                    remaining -= 1
+    return sizes
+
+
+def assign_split_by_hash(key: Any, val_frac: float = 0.1, test_frac: float = 0.0, seed: int = 0) -> str:
+    """根据样本键的哈希值确定样本所属的数据集,与样本顺序和数量无关,适用于流式数据集
+
+    Args:
+        key (Any): 样本键,例如文本或者id
+        val_frac (float, optional): 验证集比例. Defaults to 0.1.
+        test_frac (float, optional): 测试集比例. Defaults to 0.0.
+        seed (int, optional): 随机种子. Defaults to 0.
+
+    Returns:
+        str: train, validation或者test
+    """
+    digest = hashlib.md5(f'{seed}:{key}'.encode('utf-8')).digest()
+    position = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    if position < val_frac:
+        return 'validation'
+    elif position < val_frac + test_frac:
+        return 'test'
+    else:
+        return 'train'
+
+
+def hash_split(dataset: Union[Ds, IterableDataset],
+               key_column: str = 'text',
+               val_frac: float = 0.1,
+               test_frac: float = 0.0,
+               seed: int = 0) -> Union["DatasetDict", IterableDatasetDict]:
+    """按照样本键的哈希值切分数据集,支持流式数据集
+
+    Args:
+        dataset (Union[Dataset, IterableDataset]): 需要切分的数据集
+        key_column (str, optional): 用于计算哈希值的字段. Defaults to 'text'.
+        val_frac (float, optional): 验证集比例. Defaults to 0.1.
+        test_frac (float, optional): 测试集比例,为0时不切分测试集. Defaults to 0.0.
+        seed (int, optional): 随机种子. Defaults to 0.
+    """
+    split_names = ['train', 'validation', 'test'] if test_frac > 0 else ['train', 'validation']
+    def in_split(example: Dict, split: str) -> bool:
+        return assign_split_by_hash(example[key_column], val_frac=val_frac, test_frac=test_frac, seed=seed) == split
+    splits = {split: dataset.filter(in_split, fn_kwargs={'split': split}) for split in split_names}
+    if isinstance(dataset, IterableDataset):
+        return IterableDatasetDict(splits)
+    return DatasetDict(splits)
+
+
+def _get_stratify_keys(dataset: Ds, stratify_by: Optional[str], batch_size: int = 10000) -> Optional[List[Hashable]]:
+    """按批次从arrow数据中计算每个样本的分组键,与get_stratify_key一致,不会把整个嵌套字段转换为python对象"""
+    if stratify_by is None:
+        return None
+    keys = []
+    for batch in iter_arrow_batches(dataset, columns=[stratify_by], batch_size=batch_size):
+        column = batch.column(stratify_by).combine_chunks()
+        if not (pa.types.is_list(column.type) or pa.types.is_large_list(column.type)):
+            keys.extend(column.to_pylist())
+            continue
+        values = pc.list_flatten(column)
+        if pa.types.is_struct(values.type):
+            field = 'label' if values.type.get_field_index('label') >= 0 else 'p'
+            values = pc.struct_field(values, field)
+        # 每个元素所属的样本
+        rows = pc.list_parent_indices(column).to_numpy()
+        labels = [set() for _ in range(len(column))]
+        for row, label in zip(rows.tolist(), values.to_pylist()):
+            labels[row].add(label)
+        valid = column.is_valid().to_pylist()
+        keys.extend(tuple(sorted(label_set, key=str)) if is_valid else None for label_set, is_valid in zip(labels, valid))
+    return keys
 
 
 class Dataset(Ds):
-    def train_val_split(self, 
+    def train_val_split(self,
                         val_frac: float =0.1,
-                        return_dataset_dict: bool =True) -> Union[Tuple["Dataset", "Dataset"], "DatasetDict"]:
+                        return_dataset_dict: bool =True,
+                        seed: Optional[int] = None,
+                        stratify_by: Optional[str] = None) -> Union[Tuple["Dataset", "Dataset"], "DatasetDict"]:
         """split dataset into tarin and validation datasets
         Args:
             dataset (Dataset): dataset to split
             val_frac (float, optional): validation radio of all dataset. Defaults to 0.1.
             return_dataset_dict (bool, optional): if return_dataset_dict is True, return a DatasetDict,
                 otherwise return a tuple of train, val datasets. Defaults to True.
+            seed (int, optional): random seed, the same seed gives the same split. Defaults to None.
+            stratify_by (str, optional): column to stratify by, e.g. 'label', or 'ents' to stratify by entity types. Defaults to None.
 
         Returns:
             Union[Tuple[Dataset, Dataset], DatasetDict]: if return_dataset_dict is True, return a DatasetDict, otherwise return a tuple of train, val datasets
         """
-        df = self.to_pandas()
-        train_df = df.sample(frac=1-val_frac)
-        val_df = df.drop(train_df.index)
-        train_ds = self.from_pandas(train_df, preserve_index=False)
-        val_ds = self.from_pandas(val_df, preserve_index=False)
+        train_idx, val_idx = split_indices(num_rows=len(self),
+                                           fracs=[val_frac],
+                                           seed=seed,
+                                           stratify_keys=_get_stratify_keys(self, stratify_by))
+        train_ds = self.select(train_idx)
+        val_ds = self.select(val_idx)
         if not return_dataset_dict:
             return train_ds, val_ds
         else:
             return DatasetDict({'train': train_ds, 'validation': val_ds})
-        
-    
+
+
     def train_val_test_split(self,
                              val_frac: float =0.1,
                              test_frac: float =0.1,
-                             return_dataset_dict: bool =True) -> Union[Tuple["Dataset", "Dataset", "Dataset"], "DatasetDict"]:
+                             return_dataset_dict: bool =True,
+                             seed: Optional[int] = None,
+                             stratify_by: Optional[str] = None) -> Union[Tuple["Dataset", "Dataset", "Dataset"], "DatasetDict"]:
         """split dataset into tarin vlidation and test datasets
 
         Args:
             dataset (Dataset): dataset to split
             val_frac (float, optional): validation radio of all dataset. Defaults to 0.1.
             test_frac (float, optional): test radio of all dataset. Defaults to 0.1.
+            seed (int, optional): random seed, the same seed gives the same split. Defaults to None.
+            stratify_by (str, optional): column to stratify by, e.g. 'label', or 'ents' to stratify by entity types. Defaults to None.
 
         Returns:
-            Union[Tuple[Dataset, Dataset, Dataset], DatasetDict]: if return_dataset_dict is True, return a DatasetDict, 
+            Union[Tuple[Dataset, Dataset, Dataset], DatasetDict]: if return_dataset_dict is True, return a DatasetDict,
                 otherwise return a tuple of train, val, test datasets
-            
+
         """
-        df = self.to_pandas()
-        train_df = df.sample(frac=1-val_frac-test_frac)
-        other_df = df.drop(train_df.index)
-        val_df = other_df.sample(frac=1-(test_frac/(val_frac+test_frac)))
-        test_df = other_df.drop(val_df.index)
-        train_ds = self.from_pandas(train_df, preserve_index=False)
-        val_ds = self.from_pandas(val_df, preserve_index=False)
-        test_ds = self.from_pandas(test_df, preserve_index=False)
+        train_idx, val_idx, test_idx = split_indices(num_rows=len(self),
+                                                     fracs=[val_frac, test_frac],
+                                                     seed=seed,
+                                                     stratify_keys=_get_stratify_keys(self, stratify_by))
+        train_ds = self.select(train_idx)
+        val_ds = self.select(val_idx)
+        test_ds = self.select(test_idx)
         if not return_dataset_dict:
             return train_ds, val_ds, test_ds
         else:
             return DatasetDict({'train': train_ds, 'validation': val_ds, 'test': test_ds})
-        
+
 class DatasetDict(DsD):
     @staticmethod
     def load_from_disk(dataset_path: str) -> "DatasetDict":
-        return load_from_disk(dataset_path=dataset_path)
\ No newline at end of file
+        return load_from_disk(dataset_path=dataset_path)
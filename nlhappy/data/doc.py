@@ -1,19 +1,202 @@
-from pydantic import BaseModel, conint, conint, constr, validator, conlist, validate_arguments, conset
-from typing import List, Optional, Union, Tuple, DefaultDict, Dict, Any, Set, Generator
+from pydantic import BaseModel, conint, conint, constr, validator, conlist, validate_arguments, conset, PrivateAttr
+from typing import List, Optional, Union, Tuple, DefaultDict, Dict, Any, Set, Generator, Iterable, Sequence, Callable
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from operator import add
+from bisect import bisect_right, bisect_left
 import srsly
 from pathlib import Path
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import math
+from datasets import Features, Value
+from datasets import Sequence as SequenceFeature
+from datasets.table import InMemoryTable
 from .dataset import Dataset
-from ..utils.text import split_sentence
+from ..utils.text import split_sentence_offsets
 from tqdm import tqdm
-from functools import reduce
+from functools import reduce, lru_cache, partial
 
 
 Label = constr(strip_whitespace=True, min_length=1)
 Index = conint(ge=0, strict=True)
 
 
-def assert_span_text_in_doc(doc_text: str, span_text: str, span_indices: List[Index]) -> None:
+class SpanIndices(Sequence):
+    """span在文档中的下标,内部以升序且不重叠的(start, end)区间存储,end不包含在内
+    
+    说明:
+    - 连续的下标只需要一个区间,例如[3,4,5,6]存储为((3, 7),)
+    - 对外表现为升序的整数序列,支持len, 下标, 切片(返回list), 迭代和与list比较
+    """
+    __slots__ = ('runs', '_positions')
+    
+    def __init__(self, runs: Tuple[Tuple[int, int], ...] = ()) -> None:
+        self.runs = tuple(runs)
+        positions = []
+        length = 0
+        for start, end in self.runs:
+            positions.append(length)
+            length += end - start
+        positions.append(length)
+        # positions[i]为第i个区间的第一个下标在序列中的位置, 最后一个为序列长度
+        self._positions = tuple(positions)
+    
+    @classmethod
+    def from_indices(cls, indices: Iterable[int]) -> "SpanIndices":
+        """从任意顺序的下标构建,会自动去重并排序"""
+        if isinstance(indices, SpanIndices):
+            return indices
+        if isinstance(indices, range) and indices.step == 1:
+            return cls.from_range(indices.start, indices.stop)
+        runs = []
+        for i in sorted(set(indices)):
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        return cls(runs=tuple((start, end) for start, end in runs))
+    
+    @classmethod
+    def from_range(cls, start: int, end: int) -> "SpanIndices":
+        """连续下标[start, end)"""
+        if end <= start:
+            return cls()
+        return cls(runs=((start, end),))
+    
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+        
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type='array', items={'type': 'integer'}, uniqueItems=True)
+        
+    @classmethod
+    def validate(cls, v: Any) -> "SpanIndices":
+        if isinstance(v, SpanIndices):
+            return v
+        if isinstance(v, range):
+            assert v.step == 1 and v.start >= 0, f'下标: <{v}>必须为步长为1的非负区间'
+            return cls.from_range(v.start, v.stop)
+        assert isinstance(v, Iterable) and not isinstance(v, (str, bytes)), f'下标: <{v}>必须为整数列表'
+        v = list(v)
+        for i in v:
+            assert isinstance(i, int) and not isinstance(i, bool) and i >= 0, f'下标: <{i}>必须为非负整数'
+        return cls.from_indices(v)
+    
+    @property
+    def start(self) -> Optional[int]:
+        """第一个下标"""
+        return self.runs[0][0] if self.runs else None
+    
+    @property
+    def end(self) -> Optional[int]:
+        """最后一个下标加一"""
+        return self.runs[-1][1] if self.runs else None
+    
+    @property
+    def is_continuous(self) -> bool:
+        return len(self.runs) <= 1
+    
+    def _run_of_position(self, position: int) -> int:
+        return bisect_right(self._positions, position) - 1
+    
+    def __len__(self) -> int:
+        return self._positions[-1]
+    
+    def __getitem__(self, i: Union[int, slice]) -> Union[int, List[int]]:
+        if isinstance(i, slice):
+            return list(self)[i]
+        length = len(self)
+        if i < 0:
+            i += length
+        if i < 0 or i >= length:
+            raise IndexError('SpanIndices index out of range')
+        run = self._run_of_position(i)
+        return self.runs[run][0] + i - self._positions[run]
+    
+    def __iter__(self):
+        for start, end in self.runs:
+            yield from range(start, end)
+            
+    def __reversed__(self):
+        for start, end in reversed(self.runs):
+            yield from range(end - 1, start - 1, -1)
+    
+    def __contains__(self, idx: int) -> bool:
+        run = bisect_right(self.runs, (idx, float('inf'))) - 1
+        return run >= 0 and self.runs[run][0] <= idx < self.runs[run][1]
+    
+    def index(self, idx: int) -> int:
+        """下标idx在序列中的位置"""
+        run = bisect_right(self.runs, (idx, float('inf'))) - 1
+        if run < 0 or not self.runs[run][0] <= idx < self.runs[run][1]:
+            raise ValueError(f'{idx} is not in SpanIndices')
+        return self._positions[run] + idx - self.runs[run][0]
+    
+    def select(self, start: int, end: int) -> "SpanIndices":
+        """按照序列位置截取[start, end), 等价于list(self)[start:end]但不展开为列表"""
+        start, end, _ = slice(start, end).indices(len(self))
+        runs = []
+        for (run_start, run_end), position in zip(self.runs, self._positions):
+            lo = max(start - position, 0)
+            hi = min(end - position, run_end - run_start)
+            if lo < hi:
+                runs.append((run_start + lo, run_start + hi))
+        return SpanIndices(runs=runs)
+    
+    def shift(self, offset: int) -> "SpanIndices":
+        """所有下标加上offset"""
+        return SpanIndices(runs=tuple((start + offset, end + offset) for start, end in self.runs))
+    
+    def intersection(self, other: "SpanIndices") -> "SpanIndices":
+        """两组下标的交集,在区间上双指针合并"""
+        runs = []
+        i, j = 0, 0
+        while i < len(self.runs) and j < len(other.runs):
+            start = max(self.runs[i][0], other.runs[j][0])
+            end = min(self.runs[i][1], other.runs[j][1])
+            if start < end:
+                runs.append((start, end))
+            if self.runs[i][1] < other.runs[j][1]:
+                i += 1
+            else:
+                j += 1
+        return SpanIndices(runs=runs)
+    
+    def get_text(self, text: str) -> str:
+        """取出下标在text中对应的文本"""
+        return ''.join([text[start: end] for start, end in self.runs])
+    
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, SpanIndices):
+            return self.runs == other.runs
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+    
+    def __hash__(self) -> int:
+        return hash(self.runs)
+    
+    def __add__(self, other: Iterable[int]) -> List[int]:
+        return list(self) + list(other)
+    
+    def __radd__(self, other: Iterable[int]) -> List[int]:
+        return list(other) + list(self)
+    
+    def __repr__(self) -> str:
+        return repr(list(self))
+    
+    def __getstate__(self):
+        return self.runs
+    
+    def __setstate__(self, runs):
+        self.__init__(runs=runs)
+
+
+def assert_span_text_in_doc(doc_text: str, span_text: str, span_indices: Union[List[Index], SpanIndices]) -> None:
     """检查span的文本与标注的下标对应doc文本一致
 
     Args:
@@ -22,7 +205,11 @@ def assert_span_text_in_doc(doc_text: str, span_text: str, span_indices: List[In
         span_indices (List[Index]): 在文档中的下标
     """
     try:
-        text = ''.join([doc_text[i] for i in span_indices])
+        if not isinstance(span_indices, SpanIndices):
+            span_indices = SpanIndices.from_indices(span_indices)
+        if len(span_indices) > 0 and span_indices.end > len(doc_text):
+            raise IndexError(f'下标: <{span_indices.end - 1}> 超出文本长度: <{len(doc_text)}>')
+        text = span_indices.get_text(doc_text)
     except Exception as e:
         print(span_indices)
         print(len(span_indices))
@@ -57,19 +244,26 @@ class Span(BaseModel):
     
     说明:
     - 初始化时如果文本不为空,则会自动去除首尾的空格,
-    - 下标会自动按照升序排列
+    - 下标会自动按照升序排列, 内部以SpanIndices区间的形式存储, 连续span只占用一个区间
     - 当文本去除首尾空格后,下标会自动修正,例如当text=' 中国'变为'中国', 下标[0,1,2]会变为[1,2]
     """
     text: Optional[constr(min_length=1)] = None
-    indices: conset(item_type=int)
+    indices: SpanIndices
     score: Optional[float] = None
     
     @property
     def is_continuous(self) -> bool:
-        diff = []
-        for i in range(1, len(self.indices)):
-            diff.append((self.indices[i] - self.indices[i-1]) != 1)
-        return not sum(diff) > 0
+        return self.indices.is_continuous
+    
+    @property
+    def start(self) -> int:
+        """span的第一个下标"""
+        return self.indices.start
+    
+    @property
+    def end(self) -> int:
+        """span的最后一个下标加一"""
+        return self.indices.end
             
     @validator('text')
     def validate_text(cls, v: str, values: dict):
@@ -80,28 +274,41 @@ class Span(BaseModel):
             return v
     
     @validator('indices')
-    def validate_indices(cls, v: List[Index], values):
-        v = sorted(v)
+    def validate_indices(cls, v: SpanIndices, values):
         if 'text' in values:
             if values['text']:
                 assert len(values['ori_text']) == len(v), f'下标: <{v}>与原始文本: <{values["ori_text"]}>长度不符'
                 start = values['ori_text'].index(values['text'])
-                indices = v[start: start+len(values['text'])]
+                indices = v.select(start, start+len(values['text']))
                 del values['ori_text']
                 return indices
             else:
                 return v
         else:
             return v
+        
+    def __setattr__(self, name, value):
+        if name == 'indices':
+            value = SpanIndices.validate(value)
+        super().__setattr__(name, value)
+        
+    def dict(self, *args, **kwargs) -> Dict[str, Any]:
+        data = super().dict(*args, **kwargs)
+        if isinstance(data.get('indices'), SpanIndices):
+            data['indices'] = list(data['indices'])
+        return data
+    
+    class Config:
+        json_encoders = {SpanIndices: list}
     
     def __hash__(self):
         return hash(self.text)
     
     def __gt__(self, other: "Span") -> bool:
-        return self.indices[-1] > other.indices[0] 
+        return self.end - 1 > other.start
     
     def __lt__(self, other: "Span") -> bool:
-        return self.indices[-1] < other.indices[0]
+        return self.end - 1 < other.start
     
     def __len__(self):
         return len(self.indices)
@@ -115,28 +322,24 @@ class Span(BaseModel):
         return Span(text=text, indices=indices)
     
     def __and__(self, other: "Span") -> "Span":
-        indices = set(self.indices) & set(other.indices)
+        indices = self.indices.intersection(other.indices)
         if len(indices) == 0:
             return None
         else:
-            indices = sorted(list(indices))
+            if self.text is None:
+                return Span(indices=indices)
             chars = []
-            for idx in indices:
-                chars.append(self.text[self.indices.index(idx)])
+            for start, end in indices.runs:
+                position = self.indices.index(start)
+                chars.append(self.text[position: position + end - start])
             text = ''.join(chars)
             return Span(indices=indices, text=text)
         
     def __eq__(self, other: "Span") -> bool:
-        if self.is_continuous and other.is_continuous:
-            return self.indices[0] == other.indices[0] and self.indices[-1] == other.indices[-1]
-        else:
-            return self.indices == other.indices
+        return self.indices == other.indices
     
     def __contains__(self, item: "Span") -> bool:
-        if self.is_continuous and item.is_continuous:
-            return self.indices[0] <= item.indices[0] and self.indices[-1] >= item.indices[-1]
-        else:
-            return sorted(self.indices)[0] <= sorted(item.indices)[0] and sorted(self.indices)[-1] >= sorted(item.indices)[-1]
+        return self.start <= item.start and self.end >= item.end
 
         
 class Entity(Span):
@@ -152,10 +355,7 @@ class Entity(Span):
         return hash(self.label)
     
     def __eq__(self, other: "Entity") -> bool:
-        if self.is_continuous and other.is_continuous:
-            return self.indices[0] == other.indices[0] and self.indices[-1] == other.indices[-1] and self.label == other.label
-        else:
-            return self.indices == other.indices and self.label == other.label
+        return self.indices == other.indices and self.label == other.label
     
     
 class Relation(BaseModel):
@@ -229,6 +429,82 @@ class Answer(BaseModel):
         self.spans = sorted(self.spans)
 
 
+class SpanIndex():
+    """按照起始下标排序的span区间索引,用于快速查找某个片段内的span
+    参数:
+    - spans (Iterable[Span]): 需要索引的span,例如doc.ents
+    
+    说明:
+    - 查询复杂度为O(log n + k), k为起始下标落在查询范围内的span数量
+    - 查询结果保持spans的原始顺序
+    """
+    def __init__(self, spans: Iterable[Span]) -> None:
+        super().__init__()
+        self.spans = list(spans)
+        order = sorted(range(len(self.spans)), key=lambda i: (self.spans[i].start, self.spans[i].end))
+        self._order = order
+        self._starts = [self.spans[i].start for i in order]
+        self._max_length = max([span.end - span.start for span in self.spans], default=0)
+        
+    def __len__(self):
+        return len(self.spans)
+    
+    def _query(self, lo: int, hi: int, keep) -> List[Span]:
+        left = bisect_left(self._starts, lo)
+        right = bisect_left(self._starts, hi)
+        positions = sorted([i for i in self._order[left: right] if keep(self.spans[i])])
+        return [self.spans[i] for i in positions]
+    
+    def contained_in(self, span: Span) -> List[Span]:
+        """在span范围内的所有span,与`item in span`的判断一致"""
+        return self._query(span.start, span.end, keep=lambda item: item.end <= span.end)
+    
+    def overlapping(self, span: Span) -> List[Span]:
+        """与span范围有重叠的所有span"""
+        return self._query(span.start - self._max_length + 1, span.end, keep=lambda item: item.end > span.start)
+    
+    
+def _construct(model: type, values: Dict[str, Any]) -> BaseModel:
+    """不经过校验直接构建pydantic模型,比BaseModel.construct更轻量,只适用于本模块中默认值为None的字段
+    """
+    obj = model.__new__(model)
+    object.__setattr__(obj, '__dict__', {name: values.get(name, default) for name, default in _get_default_values(model)})
+    object.__setattr__(obj, '__fields_set__', set(values))
+    return obj
+
+
+@lru_cache(maxsize=None)
+def _get_default_values(model: type) -> Tuple[Tuple[str, Any], ...]:
+    return tuple((name, field.default) for name, field in model.__fields__.items())
+
+
+def _construct_span(data: Dict[str, Any]) -> Span:
+    if isinstance(data, Span):
+        return data
+    return _construct(Span, {**data, 'indices': SpanIndices.from_indices(data['indices'])})
+
+
+def _construct_entity(data: Dict[str, Any]) -> Entity:
+    if isinstance(data, Entity):
+        return data
+    return _construct(Entity, {**data, 'indices': SpanIndices.from_indices(data['indices'])})
+
+
+def _construct_relation(data: Dict[str, Any]) -> Relation:
+    if isinstance(data, Relation):
+        return data
+    return _construct(Relation, {'s': _construct_entity(data['s']), 'p': data['p'], 'o': _construct_entity(data['o'])})
+
+
+def _construct_event(data: Dict[str, Any]) -> Event:
+    if isinstance(data, Event):
+        return data
+    trigger = data.get('trigger')
+    if trigger is not None:
+        trigger = _construct_span(trigger)
+    return _construct(Event, {'args': [_construct_entity(arg) for arg in data['args']], 'label': data['label'], 'trigger': trigger})
+
+
 class Doc(BaseModel):
     """存放所有标注数据,由模型或者原始数据构建
     参数:
@@ -256,13 +532,25 @@ class Doc(BaseModel):
     title: Optional[str] = None
     questions : Optional[Dict[str, Answer]] = None
     
+    _sent_offsets_cache: Optional[Tuple[str, List[Tuple[int, int]]]] = PrivateAttr(default=None)
+    
+    @property
+    def sent_offsets(self) -> List[Tuple[int, int]]:
+        """所有句子的(start, end)下标,第一次访问时计算并缓存,文本改变后重新计算"""
+        cache = getattr(self, '_sent_offsets_cache', None)
+        if cache is None or cache[0] is not self.text:
+            cache = (self.text, split_sentence_offsets(self.text))
+            object.__setattr__(self, '_sent_offsets_cache', cache)
+        return cache[1]
+    
     @property
     def sents(self) -> Generator:
-        start = 0
-        for s in split_sentence(self.text, best=False):
-            end = start + len(s)
-            yield Span(text=s, indices=[i for i in range(start, end)])
-            start = end
+        for start, end in self.sent_offsets:
+            yield self._make_contiguous_span(start, end)
+            
+    def _make_contiguous_span(self, start: int, end: int) -> Span:
+        # 句子下标已经去除首尾空白,与文本一定对应,不需要再校验
+        return _construct(Span, {'text': self.text[start: end], 'indices': SpanIndices.from_range(start, end)})
     
     @validator('text')
     def validate_text(cls, v: str):
@@ -271,6 +559,8 @@ class Doc(BaseModel):
     
     @validator('questions')
     def validate_questions(cls, v: Dict, values):
+        if v is None:
+            return v
         for q, a in v.items():
             a: Answer
             for span in a.spans:
@@ -307,7 +597,9 @@ class Doc(BaseModel):
                 assert_span_text_in_doc(doc_text=text, span_indices=trigger.indices, span_text=trigger.text)
         return v
     
-    def _get_indices_text(self, indices: List[Index]) -> str:
+    def _get_indices_text(self, indices: Union[List[Index], SpanIndices]) -> str:
+        if isinstance(indices, SpanIndices):
+            return indices.get_text(self.text)
         return ''.join([self.text[i] for i in indices])
     
     @validate_arguments
@@ -413,40 +705,40 @@ class Doc(BaseModel):
         if len(spans) == 0:
             return None
         else:
-            start = spans[0].indices[0]
-            end = spans[-1].indices[-1] + 1
-            indices = [i for i in range(start, end)]
-            text = self._get_indices_text(indices=indices)
-            return Span(text=text, indices=indices)
+            start = spans[0].start
+            end = spans[-1].end
+            return Span(text=self.text[start: end], indices=range(start, end))
 
     def split_by_sents(self, max_length: int) -> List[Span]:
         """将文本按照句子切分为不超过固定长度的片段
+        - 片段长度为第一个句子开始到最后一个句子结束的字符数,第一个句子也只计算自身长度
+        - 超过max_length的句子会被丢弃,并且结束当前片段
 
         Args:
-            max_piece_length (int): 最大片段长度
+            max_length (int): 最大片段长度
 
         Returns:
             List[span]: 切分后的片段列表
         """
         pieces = []
-        piece: List[Span] = []
-        for sent in self.sents:
-            sent: Span
-            if len(piece)>0:
-                cur_length = sent.indices[-1] + 1 - piece[0].indices[0]
+        piece_start, piece_end = None, None
+        for start, end in self.sent_offsets:
+            if piece_start is not None:
+                cur_length = end - piece_start
             else:
-                cur_length = sent.indices[-1] + 1
+                cur_length = end - start
             if cur_length < max_length:
-                piece.append(sent)
+                piece_start = start if piece_start is None else piece_start
+                piece_end = end
             else:
-                if len(piece) > 0:
-                    pieces.append(self.combine_spans_to_contiguous(spans=piece))
-                if len(sent) > max_length:
-                    continue
+                if piece_start is not None:
+                    pieces.append(self._make_contiguous_span(piece_start, piece_end))
+                if end - start > max_length:
+                    piece_start, piece_end = None, None
                 else:
-                    piece = [sent]
-        if len(piece) > 0:
-            pieces.append(self.combine_spans_to_contiguous(spans=piece))
+                    piece_start, piece_end = start, end
+        if piece_start is not None:
+            pieces.append(self._make_contiguous_span(piece_start, piece_end))
         return pieces
     
     def get_answer(self, question: str) -> Answer:
@@ -465,6 +757,25 @@ class Doc(BaseModel):
         ans.add_span(span=span)
         
         
+    @classmethod
+    def from_trusted_dict(cls, data: Dict[str, Any]) -> "Doc":
+        """从已经校验过的数据(例如save_to_disk保存的数据)直接构建doc,跳过所有pydantic校验
+        
+        说明:
+        - 不会检查下标与文本是否一致,也不会排序下标或者去除span首尾空格
+        - 仅适用于可信数据,非可信数据请使用Doc(**data)
+        """
+        data = dict(data)
+        if data.get('ents') is not None:
+            data['ents'] = [_construct_entity(ent) for ent in data['ents']]
+        if data.get('rels') is not None:
+            data['rels'] = [_construct_relation(rel) for rel in data['rels']]
+        if data.get('events') is not None:
+            data['events'] = [_construct_event(event) for event in data['events']]
+        if data.get('questions') is not None:
+            data['questions'] = {q: _construct(Answer, {'spans': [_construct_span(span) for span in a['spans']]}) for q, a in data['questions'].items()}
+        return _construct(cls, data)
+    
     class Config:
         extra = 'forbid'
         allow_mutation = True
@@ -485,10 +796,58 @@ class Doc(BaseModel):
                    self.summary == other.summary 
                 
                    
+def get_doc_content_key(doc: Doc) -> Tuple:
+    """doc的文本和所有标注组成的键,与Doc.__eq__中没有id时比较的字段一致
+    """
+    ents = tuple((ent.indices.runs, ent.label) for ent in doc.ents) if doc.ents is not None else None
+    rels = tuple((rel.s.indices.runs, rel.s.label, rel.p, rel.o.indices.runs, rel.o.label) for rel in doc.rels) if doc.rels is not None else None
+    if doc.events is not None:
+        events = tuple((tuple((arg.indices.runs, arg.label) for arg in event.args), 
+                        event.label, 
+                        event.trigger.indices.runs if event.trigger is not None else None) for event in doc.events)
+    else:
+        events = None
+    labels = tuple(doc.labels) if doc.labels is not None else None
+    return (doc.text, doc.label, labels, ents, rels, events, doc.summary)
+
+
+class DocKeyIndex():
+    """doc的哈希索引,判断是否已经存在与doc相等(Doc.__eq__)的doc
+    
+    说明:
+    - 两个doc都有id时比较id,否则比较文本和所有标注,与Doc.__eq__相同
+    - 因此有id的doc与已有的同id的doc,或者已有的内容相同但是没有id的doc重复
+    - 没有id的doc与已有的任意内容相同的doc(不论有没有id)重复
+    """
+    def __init__(self, docs: Iterable[Doc] = ()) -> None:
+        self.ids: Set[str] = set()
+        self.contents: Set[Tuple] = set()
+        self.contents_without_id: Set[Tuple] = set()
+        for doc in docs:
+            self.add(doc)
+    
+    def add(self, doc: Doc) -> None:
+        content = get_doc_content_key(doc)
+        self.contents.add(content)
+        if doc.id:
+            self.ids.add(doc.id)
+        else:
+            self.contents_without_id.add(content)
+            
+    def __contains__(self, doc: Doc) -> bool:
+        if doc.id:
+            return doc.id in self.ids or get_doc_content_key(doc) in self.contents_without_id
+        return get_doc_content_key(doc) in self.contents
+                   
+                   
 class DocBin():
     """存放所有doc
     参数:
     - docs (Union[List[Doc], Path]): 所有Doc文档示例或者jsonl格式地址
+    
+    说明:
+    - add, merge, dedup和+操作通过哈希索引去重,与Doc.__eq__的判断一致,见DocKeyIndex
+    - 哈希索引在第一次去重时构建,doc加入后再修改其标注不会更新索引
     """
     def __init__(self, docs : Union[List[Doc], Path] = None) -> None:
         super().__init__()
@@ -498,6 +857,12 @@ class DocBin():
             self._docs = []
         else:
             self._docs = docs
+        self._keys: Optional[DocKeyIndex] = None
+        
+    def _get_keys(self) -> DocKeyIndex:
+        if self._keys is None:
+            self._keys = DocKeyIndex(self._docs)
+        return self._keys
             
     def __getitem__(self, i):
         return self._docs[i]
@@ -512,10 +877,46 @@ class DocBin():
         return f"{len(self._docs)} docs"
     
     def __add__(self, other: Union["DocBin", List[Doc]]) -> "DocBin":
-        if isinstance(other, list):
-            return DocBin(self._docs + other)
-        if isinstance(other, DocBin):
-            return DocBin(self._docs + other._docs)
+        if isinstance(other, (list, DocBin)):
+            docs = DocBin(list(self._docs))
+            docs.merge(other)
+            return docs
+        return NotImplemented
+    
+    def merge(self, other: Union["DocBin", Iterable[Doc]]) -> int:
+        """将其他doc合并进来,重复的doc会被丢弃
+        参数:
+        - other (Union[DocBin, Iterable[Doc]]): 需要合并的doc
+        
+        返回:
+        - int: 丢弃的重复doc数量
+        """
+        keys = self._get_keys()
+        num_dropped = 0
+        for doc in other:
+            if doc in keys:
+                num_dropped += 1
+            else:
+                keys.add(doc)
+                self._docs.append(doc)
+        return num_dropped
+    
+    def dedup(self) -> int:
+        """去除重复的doc,保留第一次出现的doc
+        
+        返回:
+        - int: 去除的重复doc数量
+        """
+        keys = DocKeyIndex()
+        docs = []
+        for doc in self._docs:
+            if doc not in keys:
+                keys.add(doc)
+                docs.append(doc)
+        num_dropped = len(self._docs) - len(docs)
+        self._docs = docs
+        self._keys = keys
+        return num_dropped
         
     def save_to_disk(self, file_path: Path):
         """将数据以jsonl的格式保存到硬盘
@@ -525,30 +926,65 @@ class DocBin():
         path = Path(file_path)
         srsly.write_jsonl(path=path, lines=[doc.dict() for doc in self._docs])
     
-    def _get_docs_from_jsonl(self, file_path: Path) -> List[Doc]:
-        path = Path(file_path)
-        datas = srsly.read_jsonl(path=path)
-        docs = []     
-        for d in datas:
-            docs.append(Doc(**d))
+    def _get_docs_from_jsonl(self, file_path: Path, validate: bool = True) -> List[Doc]:
+        return list(iter_docs_from_jsonl(file_path=file_path, validate=validate))
+    
+    def save_to_arrow(self, file_path: Path, chunk_size: int = 1000):
+        """将数据以arrow列式格式保存到硬盘,可以通过ArrowDocBin以内存映射的方式读取
+        参数:
+        - file_path (Path): 数据保存地址,例如./test.arrow
+        - chunk_size (int): 每个record batch的doc数量. 默认1000
+        """
+        write_docs_to_arrow(docs=self._docs, file_path=file_path, chunk_size=chunk_size)
+        
+    @classmethod
+    def from_arrow(cls, file_path: Path, validate: bool = False) -> "DocBin":
+        """从save_to_arrow保存的文件加载所有doc
+        参数:
+        - file_path (Path): arrow格式地址
+        - validate (bool): 是否校验数据. 默认False
+        """
+        return cls(docs=list(ArrowDocBin(file_path=file_path, validate=validate)))
+    
+    @classmethod
+    def from_jsonl(cls, file_path: Path, validate: bool = True) -> "DocBin":
+        """从jsonl文件加载所有doc
+        参数:
+        - file_path (Path): jsonl格式地址
+        - validate (bool): 是否校验数据,已经校验过的可信数据(例如save_to_disk保存的数据)可以设置为False以加快加载速度. 默认True
+        """
+        docs = cls()
+        docs._docs = docs._get_docs_from_jsonl(file_path=file_path, validate=validate)
         return docs
         
-    def to_dataset(self, include: Optional[List] = None) -> Dataset:
-        """转换数据集,None的数据自动去除
+    def to_dataset(self, include: Optional[List] = None, num_proc: Optional[int] = None) -> Dataset:
+        """转换数据集,全部为None的字段自动去除
         参数:
         - include (List): 包含的字段名称,默认None
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
+        
+        说明:
+        - 字段类型固定为DOC_FEATURES,questions字段为[{'question': str, 'spans': List}]的列表,
+          旧版本通过pandas推断得到的是以问题为键的字典{question: {'spans': List}}
+        - 读取时(from_pandas, ArrowDocBin, record_to_doc)两种格式都可以转换为Doc.questions
         """
+        ds = convert_docs_to_dataset(docs=self._docs, task='doc', num_proc=num_proc)
         if include:
-            datas = [doc.dict(include=set(include), exclude_none=True) for doc in self._docs]
-        else:
-            datas = [doc.dict(exclude_none=True) for doc in self._docs]
-        return Dataset.from_pandas(pd.DataFrame.from_dict(datas))
+            ds = ds.select_columns([c for c in ds.column_names if c in include])
+        null_columns = [c for c in ds.column_names if ds.data.column(c).null_count == len(ds)]
+        if len(ds) > 0 and len(null_columns) > 0:
+            ds = ds.remove_columns(null_columns)
+        return ds
     
-    def to_dataframe(self, include: Optional[List] = None, dropna: bool = False) -> pd.DataFrame:
+    def to_dataframe(self, include: Optional[List] = None, dropna: bool = False, num_proc: Optional[int] = None) -> pd.DataFrame:
         """转换为dataframe格式
+        参数:
+        - include (List): 包含的字段名称,默认None
+        - dropna (bool): 是否去除全部为None的字段
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
         """
-        data = [doc.dict() for doc in self._docs]
-        df = pd.DataFrame.from_records(data)
+        data = map_doc_shards(func=docs_to_dicts, docs=self._docs, num_proc=num_proc)
+        df = pd.DataFrame.from_records([d for shard in data for d in shard])
         if include:
             df = df.loc[:, include]
             if dropna:
@@ -563,104 +999,494 @@ class DocBin():
             
     @classmethod
     def from_pandas(cls, df: pd.DataFrame) -> "DocBin":
+        """从dataframe构建,例如to_dataframe或者dataset.to_pandas()的结果,questions字段兼容to_dataset的新旧两种格式"""
         records = df.to_dict(orient='records')
+        for r in records:
+            if isinstance(r.get('questions'), (list, dict, np.ndarray)):
+                r['questions'] = records_to_questions(r['questions'])
         docs = [Doc(**r) for r in records]
         return DocBin(docs=docs)
     
-    def to_ner_dataset(self, piece_max_length: int = 500, only_have_ent: bool = True) -> Dataset:
+    def to_ner_dataset(self, piece_max_length: int = 500, only_have_ent: bool = True, num_proc: Optional[int] = None) -> Dataset:
         """转换为实体抽取数据集
         - piece_max_length (int): 长文本切分的每个片段长度
         - only_have_ent (bool): 是否仅保存含有实体的数据
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
         """
-        data = {'text': [], 'ents': []}
-        for doc in self._docs:
-            doc: Doc
-            for piece in doc.split_by_sents(max_length=piece_max_length):
-                ents = []
-                for ent in doc.ents:
-                    if ent in piece:
-                        ents.append(ent.dict())
-                if len(ents)>0:
-                    data['text'].append(piece.text)
-                    data['ents'].append(ents)
-        return Dataset.from_dict(data)
-    
-    def to_tc_dataset(self) -> Dataset:
+        return convert_docs_to_dataset(docs=self._docs, 
+                                       task='ner', 
+                                       num_proc=num_proc, 
+                                       piece_max_length=piece_max_length, 
+                                       only_have_ent=only_have_ent)
+    
+    def to_tc_dataset(self, num_proc: Optional[int] = None) -> Dataset:
         """转换为单目标文本分类数据集
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
         """
-        df = self.to_dataframe(include=['text', 'label'])
-        df = df[df['label'].notna()]
-        assert len(df)>0, '数据集为空'
-        return Dataset.from_pandas(df, preserve_index=False)
+        ds = convert_docs_to_dataset(docs=self._docs, task='tc', num_proc=num_proc)
+        assert len(ds)>0, '数据集为空'
+        return ds
     
-    def to_re_dataset(self) -> Dataset:
+    def to_re_dataset(self, num_proc: Optional[int] = None) -> Dataset:
         """转换为实体关系抽取数据集
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
         """
-        df = self.to_dataframe(include=['text', 'rels'])
-        df = df[df['rels'].notna()]
-        assert len(df)>0, '数据集为空'
-        return Dataset.from_pandas(df, preserve_index=False)
+        ds = convert_docs_to_dataset(docs=self._docs, task='re', num_proc=num_proc)
+        assert len(ds)>0, '数据集为空'
+        return ds
     
-    def to_ee_dataset(self) -> Dataset:
+    def to_ee_dataset(self, num_proc: Optional[int] = None) -> Dataset:
         """转换为事件抽取数据集
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
         """
-        df = self.to_dataframe(include=['text', 'events'])
-        df = df[df['events'].notna()]
-        assert len(df)>0, '数据集为空'
-        return Dataset.from_pandas(df, preserve_index=False)
+        ds = convert_docs_to_dataset(docs=self._docs, task='ee', num_proc=num_proc)
+        assert len(ds)>0, '数据集为空'
+        return ds
     
-    def to_summary_dataset(self) -> Dataset:
+    def to_summary_dataset(self, num_proc: Optional[int] = None) -> Dataset:
         """转换为文本摘要数据集
+        - num_proc (int): 转换时使用的进程数,默认None即单进程
         """
-        df = self.to_dataframe(include=['text', 'summary'])
-        df = df[df['summary'].notna()]
-        assert len(df)>0, '数据集为空'
-        return Dataset.from_pandas(df, preserve_index=False)
+        ds = convert_docs_to_dataset(docs=self._docs, task='summary', num_proc=num_proc)
+        assert len(ds)>0, '数据集为空'
+        return ds
     
-    def to_qa_dataset(self, max_length: int = 450, only_have_answer: bool = False) -> Dataset:
+    def to_qa_dataset(self, max_length: int = 450, only_have_answer: bool = False, num_proc: Optional[int] = None) -> Dataset:
         """转换为问答数据集
 
         Args:
             max_length (int, optional): 按照句子级别切分的最大文本长度. Defaults to 450.
             only_have_answer (bool): 仅选取有答案的数据. Defaults to False.
+            num_proc (int, optional): 转换时使用的进程数. Defaults to None.
 
         Returns:
             Dataset : 按照句子切分后的问答数据集
         """
-        data = {'text': [], 'question': [], 'answer': [], 'spans': []}
-        for doc in tqdm(self._docs):
-            doc: Doc
-            pieces = doc.split_by_sents(max_length=max_length)
-            for p in pieces:
-                p: Span
-                for q, a in doc.questions.items():
-                    a: Answer
-                    new_a = Answer()
-                    for span in a.spans:
-                        _span = span & p
-                        if _span:
-                            indices = [i - p.indices[0] for i in _span.indices]
-                            p_span = Span(text=_span.text, indices=indices)
-                            assert_span_text_in_doc(doc_text=p.text, span_text=p_span.text, span_indices=p_span.indices)
-                            new_a.add_span(span=p_span)
-                    if only_have_answer:
-                        if len(new_a.spans) > 0:
-                            data['text'].append(p.text)
-                            data['question'].append(q)
-                            data['answer'].append(new_a.text)
-                            data['spans'].append(new_a.dict()['spans'])  
-                    else:
-                        data['text'].append(p.text)
-                        data['question'].append(q)
-                        data['answer'].append(new_a.text)
-                        data['spans'].append(new_a.dict()['spans'])
-        return Dataset.from_dict(data)
+        docs = self._docs if num_proc else tqdm(self._docs)
+        return convert_docs_to_dataset(docs=docs, 
+                                       task='qa', 
+                                       num_proc=num_proc, 
+                                       max_length=max_length, 
+                                       only_have_answer=only_have_answer)
     
     @validate_arguments
     def append(self, doc: Doc):
         self._docs.append(doc)
+        if self._keys is not None:
+            self._keys.add(doc)
     
     @validate_arguments
     def add(self, doc: Doc):
-        if doc not in self._docs:
-            self._docs.append(doc)
\ No newline at end of file
+        keys = self._get_keys()
+        if doc not in keys:
+            keys.add(doc)
+            self._docs.append(doc)
+            
+            
+SPAN_FEATURES = {'text': Value('string'), 'indices': SequenceFeature(Value('int64')), 'score': Value('float64')}
+ENTITY_FEATURES = {**SPAN_FEATURES, 'label': Value('string')}
+RELATION_FEATURES = {'s': ENTITY_FEATURES, 'p': Value('string'), 'o': ENTITY_FEATURES}
+EVENT_FEATURES = {'args': [ENTITY_FEATURES], 'label': Value('string'), 'trigger': SPAN_FEATURES}
+QUESTION_FEATURES = {'question': Value('string'), 'spans': [SPAN_FEATURES]}
+DOC_FEATURES = Features({'text': Value('string'), 
+                         'id': Value('string'), 
+                         'label': Value('string'), 
+                         'labels': SequenceFeature(Value('string')), 
+                         'ents': [ENTITY_FEATURES], 
+                         'rels': [RELATION_FEATURES], 
+                         'events': [EVENT_FEATURES], 
+                         'summary': Value('string'), 
+                         'title': Value('string'), 
+                         'questions': [QUESTION_FEATURES]})
+NER_FEATURES = Features({'text': Value('string'), 'ents': [ENTITY_FEATURES]})
+RE_FEATURES = Features({'text': Value('string'), 'rels': [RELATION_FEATURES]})
+TC_FEATURES = Features({'text': Value('string'), 'label': Value('string')})
+EE_FEATURES = Features({'text': Value('string'), 'events': [EVENT_FEATURES]})
+SUMMARY_FEATURES = Features({'text': Value('string'), 'summary': Value('string')})
+QA_FEATURES = Features({'text': Value('string'), 'question': Value('string'), 'answer': Value('string'), 'spans': [SPAN_FEATURES]})
+
+
+def iter_docs_from_jsonl(file_path: Path, validate: bool = True) -> Generator[Doc, None, None]:
+    """逐行读取jsonl文件并构建doc,不会一次性将所有数据读入内存
+
+    Args:
+        file_path (Path): jsonl格式文件地址
+        validate (bool): 是否校验数据,为False时使用Doc.from_trusted_dict构建. Defaults to True.
+    """
+    for d in srsly.read_jsonl(path=Path(file_path)):
+        if validate:
+            yield Doc(**d)
+        else:
+            yield Doc.from_trusted_dict(d)
+
+
+def iter_ner_examples(docs: Iterable[Doc], piece_max_length: int = 500, only_have_ent: bool = True) -> Generator[Dict, None, None]:
+    """将doc按照句子切分并逐条生成实体抽取样本
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+        piece_max_length (int): 长文本切分的每个片段长度
+        only_have_ent (bool): 是否仅保存含有实体的数据
+    """
+    for doc in docs:
+        doc: Doc
+        ent_index = SpanIndex(doc.ents or [])
+        for piece in doc.split_by_sents(max_length=piece_max_length):
+            ents = [ent.dict() for ent in ent_index.contained_in(piece)]
+            if len(ents)>0:
+                yield {'text': piece.text, 'ents': ents}
+                
+                
+def iter_re_examples(docs: Iterable[Doc]) -> Generator[Dict, None, None]:
+    """逐条生成关系抽取样本,没有关系的doc自动跳过
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+    """
+    for doc in docs:
+        doc: Doc
+        if doc.rels is not None:
+            yield {'text': doc.text, 'rels': [rel.dict() for rel in doc.rels]}
+            
+            
+def iter_qa_examples(docs: Iterable[Doc], max_length: int = 450, only_have_answer: bool = False) -> Generator[Dict, None, None]:
+    """将doc按照句子切分并逐条生成问答样本
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+        max_length (int, optional): 按照句子级别切分的最大文本长度. Defaults to 450.
+        only_have_answer (bool): 仅选取有答案的数据. Defaults to False.
+    """
+    for doc in docs:
+        doc: Doc
+        pieces = doc.split_by_sents(max_length=max_length)
+        span_indexes = {q: SpanIndex(a.spans) for q, a in doc.questions.items()}
+        for p in pieces:
+            p: Span
+            for q, span_index in span_indexes.items():
+                new_a = Answer()
+                for span in span_index.overlapping(p):
+                    _span = span & p
+                    if _span:
+                        p_span = Span(text=_span.text, indices=_span.indices.shift(-p.start))
+                        assert_span_text_in_doc(doc_text=p.text, span_text=p_span.text, span_indices=p_span.indices)
+                        new_a.add_span(span=p_span)
+                if only_have_answer and len(new_a.spans) == 0:
+                    continue
+                yield {'text': p.text, 'question': q, 'answer': new_a.text, 'spans': new_a.dict()['spans']}
+                
+                
+def iter_tc_examples(docs: Iterable[Doc]) -> Generator[Dict, None, None]:
+    """逐条生成单标签文本分类样本,没有标签的doc自动跳过"""
+    for doc in docs:
+        if doc.label is not None:
+            yield {'text': doc.text, 'label': doc.label}
+            
+            
+def iter_ee_examples(docs: Iterable[Doc]) -> Generator[Dict, None, None]:
+    """逐条生成事件抽取样本,没有事件的doc自动跳过"""
+    for doc in docs:
+        if doc.events is not None:
+            yield {'text': doc.text, 'events': [event.dict() for event in doc.events]}
+            
+            
+def iter_summary_examples(docs: Iterable[Doc]) -> Generator[Dict, None, None]:
+    """逐条生成文本摘要样本,没有摘要的doc自动跳过"""
+    for doc in docs:
+        if doc.summary is not None:
+            yield {'text': doc.text, 'summary': doc.summary}
+            
+            
+def iter_doc_records(docs: Iterable[Doc]) -> Generator[Dict, None, None]:
+    """逐条生成DOC_FEATURES格式的doc数据"""
+    for doc in docs:
+        yield doc_to_record(doc)
+        
+        
+TASK_EXAMPLE_ITERATORS = {'doc': iter_doc_records,
+                          'ner': iter_ner_examples,
+                          're': iter_re_examples,
+                          'qa': iter_qa_examples,
+                          'tc': iter_tc_examples,
+                          'ee': iter_ee_examples,
+                          'summary': iter_summary_examples}
+TASK_FEATURES = {'doc': DOC_FEATURES,
+                 'ner': NER_FEATURES,
+                 're': RE_FEATURES,
+                 'qa': QA_FEATURES,
+                 'tc': TC_FEATURES,
+                 'ee': EE_FEATURES,
+                 'summary': SUMMARY_FEATURES}
+
+
+def iter_examples(docs: Iterable[Doc], task: str, **kwargs) -> Generator[Dict, None, None]:
+    """按照任务类型逐条生成样本
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+        task (str): 任务类型,TASK_EXAMPLE_ITERATORS中的一种
+    """
+    if task not in TASK_EXAMPLE_ITERATORS:
+        raise ValueError(f'不支持的任务类型: {task}')
+    return TASK_EXAMPLE_ITERATORS[task](docs=docs, **kwargs)
+
+
+def convert_docs_to_table(docs: Iterable[Doc], task: str, chunk_size: int = 1000, **kwargs) -> pa.Table:
+    """按照任务类型将doc转换为arrow表,每chunk_size条样本构建一个record batch
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+        task (str): 任务类型,TASK_EXAMPLE_ITERATORS中的一种
+        chunk_size (int, optional): record batch的样本数量. Defaults to 1000.
+    """
+    schema = TASK_FEATURES[task].arrow_schema
+    batches = []
+    records = []
+    for example in iter_examples(docs=docs, task=task, **kwargs):
+        records.append(example)
+        if len(records) == chunk_size:
+            batches.append(pa.RecordBatch.from_pylist(records, schema=schema))
+            records = []
+    if len(records) > 0:
+        batches.append(pa.RecordBatch.from_pylist(records, schema=schema))
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+def docs_to_dicts(docs: Iterable[Doc]) -> List[Dict]:
+    return [doc.dict() for doc in docs]
+
+
+_SHARED_DOCS: Optional[List[Doc]] = None
+
+
+def _run_on_shared_shard(bounds: Tuple[int, int], func: Callable, **kwargs):
+    # fork出的子进程直接读取父进程中的_SHARED_DOCS,不需要pickle传递doc
+    start, end = bounds
+    return func(_SHARED_DOCS[start: end], **kwargs)
+
+
+def map_doc_shards(func: Callable, docs: Iterable[Doc], num_proc: Optional[int] = None, **kwargs) -> List:
+    """将doc按照顺序切分为num_proc份,在多个进程中分别执行func,返回每份的结果
+
+    Args:
+        func (Callable): 处理一份doc的函数,必须可以被pickle
+        docs (Iterable[Doc]): doc列表
+        num_proc (int, optional): 进程数,None或者1时在当前进程执行. Defaults to None.
+        
+    说明:
+    - 支持fork的系统上子进程通过fork共享doc,只有结果需要pickle传回,否则每份doc会被pickle传给子进程
+    """
+    global _SHARED_DOCS
+    if num_proc is None or num_proc <= 1:
+        return [func(docs, **kwargs)]
+    docs = list(docs)
+    shard_size = max(math.ceil(len(docs) / num_proc), 1)
+    bounds = [(i, min(i + shard_size, len(docs))) for i in range(0, len(docs), shard_size)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _SHARED_DOCS = docs
+        try:
+            with ProcessPoolExecutor(max_workers=num_proc, mp_context=multiprocessing.get_context('fork')) as executor:
+                return list(executor.map(partial(_run_on_shared_shard, func=func, **kwargs), bounds))
+        finally:
+            _SHARED_DOCS = None
+    shards = [docs[start: end] for start, end in bounds]
+    with ProcessPoolExecutor(max_workers=num_proc) as executor:
+        return list(executor.map(partial(func, **kwargs), shards))
+
+
+def convert_docs_to_dataset(docs: Iterable[Doc], task: str, num_proc: Optional[int] = None, **kwargs) -> Dataset:
+    """按照任务类型将doc转换为数据集,多进程时每个进程转换一份doc为arrow表,最后直接拼接,不经过pandas
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+        task (str): 任务类型,TASK_EXAMPLE_ITERATORS中的一种
+        num_proc (int, optional): 进程数. Defaults to None.
+    """
+    tables = map_doc_shards(func=convert_docs_to_table, docs=docs, num_proc=num_proc, task=task, **kwargs)
+    return Dataset(InMemoryTable(pa.concat_tables(tables)))
+
+
+def _generate_from_jsonl(file_path: str, file_stat: Tuple[int, float], task: str, validate: bool = True, **kwargs) -> Generator[Dict, None, None]:
+    # file_stat只用于datasets的缓存指纹,文件被修改后会重新生成数据集
+    docs = iter_docs_from_jsonl(file_path=file_path, validate=validate)
+    yield from iter_examples(docs=docs, task=task, **kwargs)
+        
+        
+class StreamingDocBin():
+    """流式读取jsonl格式的doc,不会将所有doc载入内存,适用于超大语料
+    参数:
+    - file_path (Path): jsonl格式地址
+    - chunk_size (int): 转换数据集时每次写入硬盘的样本数量,内存占用只与其有关. 默认1000
+    - validate (bool): 是否校验数据,可信数据可以设置为False以加快速度. 默认True
+    
+    说明:
+    - doc只在迭代时才会构建和校验
+    - 转换后的数据集以arrow格式分块写入datasets缓存目录,并以内存映射的方式加载
+    """
+    def __init__(self, file_path: Path, chunk_size: int = 1000, validate: bool = True) -> None:
+        super().__init__()
+        self.file_path = Path(file_path)
+        assert self.file_path.exists(), f'文件不存在: {self.file_path}'
+        self.chunk_size = chunk_size
+        self.validate = validate
+        
+    def __iter__(self) -> Generator[Doc, None, None]:
+        return iter_docs_from_jsonl(file_path=self.file_path, validate=self.validate)
+    
+    def __repr__(self) -> str:
+        return f"streaming docs from {self.file_path}"
+    
+    def __str__(self) -> str:
+        return f"streaming docs from {self.file_path}"
+    
+    def _build_dataset(self, task: str, features: Features, **kwargs) -> Dataset:
+        stat = self.file_path.stat()
+        gen_kwargs = {'file_path': str(self.file_path.resolve()), 
+                      'file_stat': (stat.st_size, stat.st_mtime), 
+                      'task': task, 
+                      'validate': self.validate,
+                      **kwargs}
+        ds = Dataset.from_generator(_generate_from_jsonl, 
+                                    features=features, 
+                                    gen_kwargs=gen_kwargs, 
+                                    writer_batch_size=self.chunk_size)
+        return Dataset(ds.data, info=ds.info, split=ds.split, fingerprint=ds._fingerprint)
+    
+    def to_docbin(self) -> DocBin:
+        """将所有doc载入内存转换为DocBin
+        """
+        return DocBin(docs=list(self))
+    
+    def to_ner_dataset(self, piece_max_length: int = 500, only_have_ent: bool = True) -> Dataset:
+        """转换为实体抽取数据集
+        - piece_max_length (int): 长文本切分的每个片段长度
+        - only_have_ent (bool): 是否仅保存含有实体的数据
+        """
+        return self._build_dataset(task='ner', features=NER_FEATURES, piece_max_length=piece_max_length, only_have_ent=only_have_ent)
+    
+    def to_re_dataset(self) -> Dataset:
+        """转换为实体关系抽取数据集
+        """
+        return self._build_dataset(task='re', features=RE_FEATURES)
+    
+    def to_qa_dataset(self, max_length: int = 450, only_have_answer: bool = False) -> Dataset:
+        """转换为问答数据集
+
+        Args:
+            max_length (int, optional): 按照句子级别切分的最大文本长度. Defaults to 450.
+            only_have_answer (bool): 仅选取有答案的数据. Defaults to False.
+        """
+        return self._build_dataset(task='qa', features=QA_FEATURES, max_length=max_length, only_have_answer=only_have_answer)
+
+    
+    
+def doc_to_record(doc: Doc) -> Dict[str, Any]:
+    """将doc转换为DOC_FEATURES格式的一行数据,questions由字典转换为[{'question': str, 'spans': List}]"""
+    record = doc.dict()
+    if record['questions'] is not None:
+        record['questions'] = [{'question': q, 'spans': a['spans']} for q, a in record['questions'].items()]
+    return record
+
+
+def records_to_questions(questions: Union[List[Dict], Dict[str, Optional[Dict]]]) -> Dict[str, Dict]:
+    """将数据集中的questions字段转换为Doc.questions的字典形式,兼容两种格式
+    - 当前格式: [{'question': str, 'spans': List}]
+    - 旧版本to_dataset(通过pandas推断)保存的格式: {question: {'spans': List}},没有该问题的样本值为None
+    """
+    if isinstance(questions, dict):
+        return {q: {'spans': list(a['spans'])} for q, a in questions.items() if a is not None}
+    return {q['question']: {'spans': list(q['spans'])} for q in questions}
+
+
+def record_to_doc(record: Dict[str, Any], validate: bool = False) -> Doc:
+    """将DOC_FEATURES格式的一行数据转换为doc,未读取的列默认为None,questions也可以是旧版本的字典格式"""
+    record = dict(record)
+    if record.get('questions') is not None:
+        record['questions'] = records_to_questions(record['questions'])
+    if validate:
+        return Doc(**record)
+    else:
+        return Doc.from_trusted_dict(record)
+
+
+def write_docs_to_arrow(docs: Iterable[Doc], file_path: Path, chunk_size: int = 1000) -> None:
+    """将doc分块写入arrow stream格式文件,内存占用只与chunk_size有关
+
+    Args:
+        docs (Iterable[Doc]): doc列表或者生成器
+        file_path (Path): 保存地址
+        chunk_size (int, optional): 每个record batch的doc数量. Defaults to 1000.
+    """
+    schema = DOC_FEATURES.arrow_schema
+    path = Path(file_path)
+    with pa.OSFile(str(path), 'wb') as sink:
+        with pa.ipc.new_stream(sink, schema) as writer:
+            records = []
+            for doc in docs:
+                records.append(doc_to_record(doc))
+                if len(records) == chunk_size:
+                    writer.write_batch(pa.RecordBatch.from_pylist(records, schema=schema))
+                    records = []
+            if len(records) > 0:
+                writer.write_batch(pa.RecordBatch.from_pylist(records, schema=schema))
+                
+                
+class ArrowDocBin():
+    """以内存映射的方式读取DocBin.save_to_arrow保存的列式数据,不会将数据载入内存
+    参数:
+    - file_path (Path): arrow格式地址
+    - columns (List[str]): 只读取的列,例如['text', 'ents'],默认读取所有列
+    - validate (bool): 读取doc时是否校验数据. 默认False
+    
+    说明:
+    - 按照下标读取doc的复杂度为O(1)
+    - dataset属性为零拷贝的Dataset,可以直接用于构建数据集
+    """
+    def __init__(self, file_path: Path, columns: Optional[List[str]] = None, validate: bool = False) -> None:
+        super().__init__()
+        self.file_path = Path(file_path)
+        assert self.file_path.exists(), f'文件不存在: {self.file_path}'
+        self.validate = validate
+        dataset = Dataset.from_file(str(self.file_path))
+        if columns is not None:
+            assert 'text' in columns, 'columns必须包含text'
+            dataset = dataset.select_columns(columns)
+        self._dataset: Dataset = dataset
+        
+    @property
+    def dataset(self) -> Dataset:
+        return self._dataset
+    
+    @property
+    def columns(self) -> List[str]:
+        return self._dataset.column_names
+        
+    def __getitem__(self, i: int) -> Doc:
+        return record_to_doc(self._dataset[i], validate=self.validate)
+    
+    def __len__(self):
+        return len(self._dataset)
+    
+    def __iter__(self) -> Generator[Doc, None, None]:
+        for record in self._dataset:
+            yield record_to_doc(record, validate=self.validate)
+    
+    def __repr__(self) -> str:
+        return f"{len(self)} docs"
+    
+    def __str__(self) -> str:
+        return f"{len(self)} docs"
+    
+    def to_dataset(self, include: Optional[List] = None) -> Dataset:
+        """零拷贝转换为数据集
+        参数:
+        - include (List): 包含的字段名称,默认None
+        """
+        if include:
+            return self._dataset.select_columns(include)
+        return self._dataset
+    
+    def to_docbin(self) -> DocBin:
+        """将所有doc载入内存转换为DocBin
+        """
+        return DocBin(docs=list(self))
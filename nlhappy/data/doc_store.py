@@ -0,0 +1,248 @@
+from typing import List, Optional, Union, Iterable, Generator, Dict, Tuple
+from pathlib import Path
+from bisect import bisect_right
+import numpy as np
+import srsly
+import os
+from .doc import Doc, DocBin
+
+
+OFFSET_DTYPE = np.dtype('<u8')
+MANIFEST_NAME = 'manifest.json'
+
+
+class DocStoreSnapshot():
+    """DocStore某一时刻的只读快照,之后追加的doc不可见
+    参数:
+    - segments (List[Tuple[Path, np.ndarray]]): 每个segment的数据文件地址和每个doc的结束偏移
+    - validate (bool): 读取doc时是否校验数据. 默认False
+
+    说明:
+    - 创建快照时会打开所有segment的数据文件,即使之后被合并删除也能继续读取
+    """
+    def __init__(self, segments: List[Tuple[Path, np.ndarray]], validate: bool = False) -> None:
+        super().__init__()
+        self.validate = validate
+        self._files = [open(path, 'rb') for path, _ in segments]
+        self._ends = [ends for _, ends in segments]
+        self._cum_sizes = [0]
+        for ends in self._ends:
+            self._cum_sizes.append(self._cum_sizes[-1] + len(ends))
+
+    def __len__(self):
+        return self._cum_sizes[-1]
+
+    def __repr__(self) -> str:
+        return f"{len(self)} docs"
+
+    def __str__(self) -> str:
+        return f"{len(self)} docs"
+
+    def _read(self, segment: int, i: int) -> bytes:
+        ends = self._ends[segment]
+        start = int(ends[i-1]) if i > 0 else 0
+        f = self._files[segment]
+        f.seek(start)
+        return f.read(int(ends[i]) - start)
+
+    def _to_doc(self, line: bytes) -> Doc:
+        data = srsly.json_loads(line)
+        if self.validate:
+            return Doc(**data)
+        else:
+            return Doc.from_trusted_dict(data)
+
+    def __getitem__(self, i: int) -> Doc:
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('DocStoreSnapshot index out of range')
+        segment = bisect_right(self._cum_sizes, i) - 1
+        return self._to_doc(self._read(segment, i - self._cum_sizes[segment]))
+
+    def __iter__(self) -> Generator[Doc, None, None]:
+        for segment, ends in enumerate(self._ends):
+            for i in range(len(ends)):
+                yield self._to_doc(self._read(segment, i))
+
+    def to_docbin(self) -> DocBin:
+        """将快照中所有doc载入内存转换为DocBin
+        """
+        return DocBin(docs=list(self))
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        self._files = []
+
+    def __enter__(self) -> "DocStoreSnapshot":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DocStore():
+    """只追加写入的doc硬盘存储,适用于持续增加标注数据的场景
+    参数:
+    - path (Path): 存储目录,不存在则自动创建
+    - max_segment_docs (int): 每个segment的最大doc数量,超过后写入新的segment. 默认100000
+
+    说明:
+    - 每个segment由jsonl格式的数据文件(.jsonl)和记录每个doc结束偏移的索引文件(.idx)组成
+    - 追加写入时先写数据再写索引,读取时只读取索引中已经记录的doc,因此读取不会看到写了一半的doc
+    - len和按照下标读取只需要读取索引文件,不需要解析数据
+    - compact会将所有segment合并为一个,合并期间已经打开的快照不受影响
+    - 写入和合并只能在一个进程中进行,读取可以在任意多个进程中进行
+    """
+    def __init__(self, path: Path, max_segment_docs: int = 100000) -> None:
+        super().__init__()
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_segment_docs = max_segment_docs
+        if not (self.path / MANIFEST_NAME).exists():
+            self._write_manifest({'segments': [], 'next_segment_id': 0})
+
+    def _read_manifest(self) -> Dict:
+        return srsly.read_json(self.path / MANIFEST_NAME)
+
+    def _write_manifest(self, manifest: Dict) -> None:
+        # 先写临时文件再替换,保证读取到的manifest总是完整的
+        tmp_path = self.path / (MANIFEST_NAME + '.tmp')
+        srsly.write_json(tmp_path, manifest)
+        os.replace(tmp_path, self.path / MANIFEST_NAME)
+
+    def _data_path(self, segment: str) -> Path:
+        return self.path / f'{segment}.jsonl'
+
+    def _index_path(self, segment: str) -> Path:
+        return self.path / f'{segment}.idx'
+
+    def _read_ends(self, segment: str) -> np.ndarray:
+        index_path = self._index_path(segment)
+        if not index_path.exists():
+            return np.zeros(0, dtype=OFFSET_DTYPE)
+        # 索引可能正在被写入,只读取完整的偏移
+        count = index_path.stat().st_size // OFFSET_DTYPE.itemsize
+        return np.fromfile(index_path, dtype=OFFSET_DTYPE, count=count)
+
+    def _new_segment(self, manifest: Dict) -> str:
+        segment = f"segment-{manifest['next_segment_id']:06d}"
+        manifest['next_segment_id'] += 1
+        # 清空上次compact中断时可能遗留的同名文件
+        for path in [self._data_path(segment), self._index_path(segment)]:
+            with open(path, 'wb'):
+                pass
+        manifest['segments'].append(segment)
+        self._write_manifest(manifest)
+        return segment
+
+    def __len__(self):
+        return sum([self._index_path(s).stat().st_size // OFFSET_DTYPE.itemsize for s in self._read_manifest()['segments']])
+
+    def __repr__(self) -> str:
+        return f"{len(self)} docs in {self.path}"
+
+    def __str__(self) -> str:
+        return f"{len(self)} docs in {self.path}"
+
+    def append(self, docs: Union[Doc, Iterable[Doc]]) -> int:
+        """追加doc,复杂度只与新增doc数量有关
+        参数:
+        - docs (Union[Doc, Iterable[Doc]]): 需要追加的doc
+
+        返回:
+        - int: 追加的doc数量
+        """
+        if isinstance(docs, Doc):
+            docs = [docs]
+        manifest = self._read_manifest()
+        num_docs = 0
+        lines = []
+        segment = manifest['segments'][-1] if len(manifest['segments']) > 0 else self._new_segment(manifest)
+        ends = self._read_ends(segment)
+        for doc in docs:
+            if len(ends) + len(lines) >= self.max_segment_docs:
+                self._write_lines(segment, ends, lines)
+                num_docs += len(lines)
+                lines = []
+                segment = self._new_segment(manifest)
+                ends = self._read_ends(segment)
+            lines.append((srsly.json_dumps(doc.dict()) + '\n').encode('utf-8'))
+        self._write_lines(segment, ends, lines)
+        num_docs += len(lines)
+        return num_docs
+
+    def _write_lines(self, segment: str, ends: np.ndarray, lines: List[bytes]) -> None:
+        if len(lines) == 0:
+            return
+        end = int(ends[-1]) if len(ends) > 0 else 0
+        new_ends = end + np.cumsum([len(line) for line in lines], dtype=OFFSET_DTYPE)
+        with open(self._data_path(segment), 'r+b') as f:
+            # 丢弃上次写入失败时未被索引记录的数据
+            f.truncate(end)
+            f.seek(end)
+            f.write(b''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._index_path(segment), 'r+b') as f:
+            f.truncate(len(ends) * OFFSET_DTYPE.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(new_ends.astype(OFFSET_DTYPE).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def snapshot(self, validate: bool = False) -> DocStoreSnapshot:
+        """获取当前所有doc的只读快照
+        参数:
+        - validate (bool): 读取doc时是否校验数据. 默认False
+        """
+        segment_names = self._read_manifest()['segments']
+        while True:
+            try:
+                segments = [(self._data_path(s), self._read_ends(s)) for s in segment_names]
+                return DocStoreSnapshot(segments=segments, validate=validate)
+            except FileNotFoundError:
+                # 读取manifest之后segment被合并删除时重新读取manifest,manifest没有变化说明文件确实缺失
+                last_segment_names, segment_names = segment_names, self._read_manifest()['segments']
+                if segment_names == last_segment_names:
+                    raise
+
+    def __iter__(self) -> Generator[Doc, None, None]:
+        with self.snapshot() as snapshot:
+            yield from snapshot
+
+    def compact(self) -> int:
+        """将所有segment合并为一个segment,直接拷贝原始数据,不需要解析doc
+
+        返回:
+        - int: 合并的segment数量
+        """
+        manifest = self._read_manifest()
+        old_segments = list(manifest['segments'])
+        if len(old_segments) <= 1:
+            return len(old_segments)
+        segment = f"segment-{manifest['next_segment_id']:06d}"
+        manifest['next_segment_id'] += 1
+        # 先保存新的next_segment_id,合并中断时遗留的文件不会被之后新建的segment复用
+        self._write_manifest(manifest)
+        with self.snapshot() as snapshot:
+            offset = 0
+            with open(self._data_path(segment), 'wb') as data_file, open(self._index_path(segment), 'wb') as index_file:
+                for f, ends in zip(snapshot._files, snapshot._ends):
+                    if len(ends) == 0:
+                        continue
+                    f.seek(0)
+                    data_file.write(f.read(int(ends[-1])))
+                    index_file.write((ends + np.uint64(offset)).astype(OFFSET_DTYPE).tobytes())
+                    offset += int(ends[-1])
+                data_file.flush()
+                os.fsync(data_file.fileno())
+                index_file.flush()
+                os.fsync(index_file.fileno())
+        manifest['segments'] = [segment]
+        self._write_manifest(manifest)
+        for s in old_segments:
+            self._data_path(s).unlink()
+            self._index_path(s).unlink()
+        return len(old_segments)
@@ -0,0 +1,91 @@
+from typing import List, Iterator, Hashable, Union
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def iter_arrow_batches(dataset, columns: List[str], batch_size: int = 10000) -> Iterator[pa.Table]:
+    """按批次流式读取数据集的arrow数据,只读取需要的字段,不会把整个数据集转换为python对象或者pandas
+
+    Args:
+        dataset (Dataset): 数据集
+        columns (List[str]): 需要读取的字段
+        batch_size (int, optional): 每个批次的样本数量. Defaults to 10000.
+    """
+    dataset = dataset.select_columns(columns).with_format('arrow')
+    for batch in dataset.iter(batch_size=batch_size):
+        yield batch
+
+
+def flatten_field(table: Union[pa.Table, pa.Array], path: str) -> pa.Array:
+    """按照路径取出嵌套字段的所有值,路径中的列表会被展开
+
+    例如:
+    - 'ents.label': 所有实体的标签
+    - 'rels.s.label': 所有三元组主体的标签
+    - 'events.args.label': 所有事件论元的标签
+    """
+    fields = path.split('.')
+    if isinstance(table, pa.Table):
+        values = table.column(fields[0]).combine_chunks()
+        fields = fields[1:]
+    else:
+        values = table
+    for field in fields + [None]:
+        while pa.types.is_list(values.type) or pa.types.is_large_list(values.type):
+            values = pc.list_flatten(values)
+        if field is not None:
+            values = pc.struct_field(values, field)
+    return values
+
+
+def unique_in_order(values: Union[pa.Array, List[pa.Array]], seen: dict) -> None:
+    """将values中没有出现过的值按照第一次出现的顺序加入seen,多个数组时按照元组去重"""
+    if isinstance(values, list):
+        if len(values[0]) == 0:
+            return
+        table = pa.table({str(i): v for i, v in enumerate(values)})
+        # group_by在单线程时保持第一次出现的顺序
+        uniques = table.group_by(list(table.column_names), use_threads=False).aggregate([])
+        for row in zip(*[uniques.column(name).to_pylist() for name in table.column_names]):
+            seen.setdefault(row, None)
+    else:
+        for value in pc.unique(values).to_pylist():
+            seen.setdefault(value, None)
+
+
+def get_unique_labels(dataset, path: str, batch_size: int = 10000) -> List[Hashable]:
+    """流式统计嵌套字段的所有不同取值,按照第一次出现的顺序返回
+
+    Args:
+        dataset (Dataset): 数据集
+        path (str): 字段路径,例如'label', 'ents.label', 'rels.p'
+        batch_size (int, optional): 每个批次的样本数量. Defaults to 10000.
+    """
+    seen = {}
+    for batch in iter_arrow_batches(dataset, columns=[path.split('.')[0]], batch_size=batch_size):
+        unique_in_order(flatten_field(batch, path), seen)
+    return [v for v in seen if v is not None]
+
+
+def get_unique_label_pairs(dataset, path: str, parent_field: str, child_path: str, batch_size: int = 10000) -> List[tuple]:
+    """流式统计嵌套列表中父节点字段与子节点字段组成的所有不同标签对,按照第一次出现的顺序返回
+
+    例如path='events', parent_field='label', child_path='args.label'得到所有的(事件类型, 论元角色)
+
+    Args:
+        dataset (Dataset): 数据集
+        path (str): 父节点所在的列表路径
+        parent_field (str): 父节点的字段
+        child_path (str): 子节点列表和字段的路径,第一部分必须为父节点的列表字段
+        batch_size (int, optional): 每个批次的样本数量. Defaults to 10000.
+    """
+    seen = {}
+    child_list, child_field = child_path.split('.', 1)
+    for batch in iter_arrow_batches(dataset, columns=[path.split('.')[0]], batch_size=batch_size):
+        parents = flatten_field(batch, path)
+        children = pc.struct_field(parents, child_list)
+        # 每个子节点对应的父节点下标
+        parent_indices = pc.list_parent_indices(children)
+        parent_labels = pc.take(pc.struct_field(parents, parent_field), parent_indices)
+        unique_in_order([parent_labels, flatten_field(children, child_field)], seen)
+    return list(seen)
@@ -0,0 +1,286 @@
+from torch.utils.data import Sampler, BatchSampler, RandomSampler
+from typing import List, Sequence, Optional, Iterator, Callable, Dict, Union
+import numpy as np
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def get_padding_efficiency(batches: Sequence[Sequence[int]], lengths: Sequence[int]) -> float:
+    """补齐效率: 所有批次真实token数量 / 补齐到批次最大长度后的token数量,越接近1浪费越少
+    """
+    lengths = np.asarray(lengths)
+    num_tokens = 0
+    num_padded_tokens = 0
+    for batch in batches:
+        batch_lengths = lengths[np.asarray(batch, dtype='int64')]
+        num_tokens += int(batch_lengths.sum())
+        num_padded_tokens += int(batch_lengths.max()) * len(batch_lengths)
+    return num_tokens / num_padded_tokens if num_padded_tokens > 0 else 1.0
+
+
+def get_token_lengths(dataset, tokenizer: Callable, text_column: Union[str, List[str]] = 'text', max_length: Optional[int] = None, batch_size: int = 1000) -> np.ndarray:
+    """用fast tokenizer批量计算数据集每个样本的token数量(含特殊token),数据集有length字段时直接读取
+
+    Args:
+        dataset (Dataset): 数据集
+        tokenizer (Callable): 分词器
+        text_column (Union[str, List[str]], optional): 输入模型的文本字段,多个字段(例如问题和文本)时为各字段token数量之和. Defaults to 'text'.
+        max_length (Optional[int], optional): 超过最大长度的按最大长度计算. Defaults to None.
+        batch_size (int, optional): 每次分词的文本数量. Defaults to 1000.
+    """
+    if 'length' in dataset.column_names:
+        lengths = np.asarray(dataset.with_format(None)['length'], dtype='int64')
+    elif 'input_ids' in dataset.column_names:
+        lengths = np.asarray([len(ids) for ids in dataset.with_format(None)['input_ids']], dtype='int64')
+    else:
+        text_columns = [text_column] if isinstance(text_column, str) else list(text_column)
+        for column in text_columns:
+            assert column in dataset.column_names, f'dataset has no {column} or length column'
+        dataset = dataset.with_format(None).select_columns(text_columns)
+        lengths = []
+        for i in range(0, len(dataset), batch_size):
+            batch = dataset[i: i + batch_size]
+            lengths.extend(count_tokens(*[batch[column] for column in text_columns], tokenizer=tokenizer)['length'])
+        lengths = np.asarray(lengths, dtype='int64') + tokenizer.num_special_tokens_to_add(pair=len(text_columns) > 1)
+    if max_length is not None:
+        lengths = np.minimum(lengths, max_length)
+    return lengths
+
+
+def count_tokens(*batch_texts: List[str], tokenizer: Callable) -> Dict[str, List[int]]:
+    """批量计算一个批次文本的token数量(不含特殊token,不截断),用于dataset.map生成length字段,
+    传入多个文本字段(例如问题和文本)时为每个样本各字段token数量之和
+    """
+    lengths = np.zeros(len(batch_texts[0]), dtype='int64')
+    for batch_text in batch_texts:
+        batch_input_ids = tokenizer(batch_text, add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False)['input_ids']
+        lengths += np.asarray([len(ids) for ids in batch_input_ids], dtype='int64')
+    return {'length': lengths.tolist()}
+
+
+def get_length_stats(lengths: Sequence[int], percentiles: Sequence[int] = (50, 90, 95, 99)) -> Dict[str, float]:
+    """token长度的统计信息: 样本数量num_examples,最大值max,平均值mean,以及每个百分位数p50,p90...
+    """
+    lengths = np.asarray(lengths, dtype='int64')
+    if len(lengths) == 0:
+        return {'num_examples': 0}
+    stats = {'num_examples': len(lengths), 'max': int(lengths.max()), 'mean': float(lengths.mean())}
+    for p, value in zip(percentiles, np.percentile(lengths, percentiles)):
+        stats[f'p{p}'] = float(value)
+    return stats
+
+
+def token_cost(batch_size: int, max_length: int) -> int:
+    """token分类等线性模型一个批次的计算代价: 补齐后的token数量
+    """
+    return batch_size * max_length
+
+
+def pair_cost(batch_size: int, max_length: int, num_labels: int = 1, max_span_width: Optional[int] = None) -> int:
+    """GlobalPointer,Biaffine,W2NER等对所有token对打分的模型一个批次的计算代价: batch_size * num_labels * L^2,
+    带状的GlobalPointer只对宽度小于max_span_width的token对打分,代价为batch_size * num_labels * L * min(L, max_span_width)
+    """
+    if max_span_width is not None:
+        return batch_size * num_labels * max_length * min(max_length, max_span_width)
+    return batch_size * num_labels * max_length ** 2
+
+
+class LengthBatchSampler(Sampler[List[int]]):
+    """根据样本token长度组织批次的采样器基类,子类实现get_batches
+
+    参数:
+    - lengths (Sequence[int]): 每个样本的token数量
+    - shuffle (bool): 是否打乱
+    - seed (int): 随机种子,每个epoch的随机种子为seed+epoch
+
+    说明:
+    - 每个epoch开始时计算并打印这个epoch的补齐效率padding_efficiency
+    """
+    def __init__(self, lengths: Sequence[int], shuffle: bool = True, seed: int = 0) -> None:
+        super().__init__()
+        self.lengths = np.asarray(lengths, dtype='int64')
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.padding_efficiency = None
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def get_rng(self) -> np.random.Generator:
+        return np.random.default_rng(self.seed + self.epoch)
+
+    def get_sorted_pools(self, rng: np.random.Generator, pool_size: int) -> Iterator[np.ndarray]:
+        """shuffle为True时先打乱所有样本,再每pool_size个样本按照长度排序"""
+        if self.shuffle:
+            indices = rng.permutation(len(self.lengths))
+        else:
+            indices = np.arange(len(self.lengths))
+        for start in range(0, len(indices), pool_size):
+            pool = indices[start: start + pool_size]
+            # 稳定排序,相同长度的样本保持打乱后的顺序
+            yield pool[np.argsort(self.lengths[pool], kind='stable')]
+
+    def get_batches(self) -> List[List[int]]:
+        raise NotImplementedError
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.get_batches()
+        self.padding_efficiency = get_padding_efficiency(batches, self.lengths)
+        log.info(f'epoch {self.epoch} padding efficiency: {self.padding_efficiency:.4f}')
+        yield from batches
+        if self.shuffle:
+            self.epoch += 1
+
+
+class BucketBatchSampler(LengthBatchSampler):
+    """按照token长度分桶的批次采样器,同一个批次的样本长度相近,减少补齐的token
+
+    采样过程:
+    - shuffle为True时先打乱所有样本,每bucket_size个批次的样本组成一个桶
+    - 桶内按照长度排序后切分为批次,因此桶内的样本长度相近
+    - shuffle为True时再打乱所有批次的顺序,不同长度的批次交替出现
+
+    参数:
+    - lengths (Sequence[int]): 每个样本的token数量
+    - batch_size (int): 批次大小
+    - bucket_size (int): 每个桶包含的批次数量,越大批次内长度越接近,随机性越小. 默认100
+    - shuffle (bool): 是否打乱,验证和测试时一般为False,此时整体按照长度排序. 默认True
+    - drop_last (bool): 是否丢弃最后一个不完整的批次. 默认False
+    - seed (int): 随机种子,每个epoch的随机种子为seed+epoch. 默认0
+
+    说明:
+    - 每个epoch开始时计算并打印这个epoch的补齐效率padding_efficiency
+    """
+    def __init__(self,
+                 lengths: Sequence[int],
+                 batch_size: int,
+                 bucket_size: int = 100,
+                 shuffle: bool = True,
+                 drop_last: bool = False,
+                 seed: int = 0) -> None:
+        super().__init__(lengths=lengths, shuffle=shuffle, seed=seed)
+        assert batch_size > 0 and bucket_size > 0, 'batch_size and bucket_size must > 0'
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.drop_last = drop_last
+
+    def get_batches(self) -> List[List[int]]:
+        rng = self.get_rng()
+        batches = []
+        for bucket in self.get_sorted_pools(rng, pool_size=self.batch_size * self.bucket_size):
+            batches.extend([bucket[i: i + self.batch_size].tolist() for i in range(0, len(bucket), self.batch_size)])
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __len__(self) -> int:
+        num_full_buckets = len(self.lengths) // (self.batch_size * self.bucket_size)
+        rest = len(self.lengths) - num_full_buckets * self.batch_size * self.bucket_size
+        if self.drop_last:
+            # 每个桶最后一个不完整的批次会被丢弃
+            return num_full_buckets * self.bucket_size + rest // self.batch_size
+        return num_full_buckets * self.bucket_size + (rest + self.batch_size - 1) // self.batch_size
+
+
+class TokenBudgetBatchSampler(LengthBatchSampler):
+    """按照计算代价动态组织批次的采样器,每个批次的代价不超过max_cost,短文本的批次更大,长文本的批次更小,
+    显存峰值基本保持不变
+
+    采样过程:
+    - shuffle为True时先打乱所有样本,每pool_size个样本按照长度排序
+    - 按照长度从小到大依次加入批次,加入后代价cost_fn(批次大小, 批次最大长度)超过max_cost时开始新的批次
+    - shuffle为True时再打乱所有批次的顺序
+
+    参数:
+    - lengths (Sequence[int]): 每个样本的token数量
+    - max_cost (int): 每个批次的最大代价
+    - cost_fn (Callable[[int, int], int]): 根据批次大小和批次最大长度计算代价,token分类等线性模型为token_cost,
+      对token对打分的模型为pair_cost,一般由模型的get_batch_cost提供. 默认token_cost
+    - pool_size (int): 每次排序的样本数量. 默认10000
+    - shuffle (bool): 是否打乱. 默认True
+    - seed (int): 随机种子,每个epoch的随机种子为seed+epoch. 默认0
+
+    说明:
+    - 单个样本的代价已经超过max_cost时单独作为一个批次
+    - 批次数量随每个epoch的打乱结果变化,len为当前epoch的批次数量
+    """
+    def __init__(self,
+                 lengths: Sequence[int],
+                 max_cost: int,
+                 cost_fn: Callable[[int, int], int] = token_cost,
+                 pool_size: int = 10000,
+                 shuffle: bool = True,
+                 seed: int = 0) -> None:
+        super().__init__(lengths=lengths, shuffle=shuffle, seed=seed)
+        assert max_cost > 0 and pool_size > 0, 'max_cost and pool_size must > 0'
+        self.max_cost = max_cost
+        self.cost_fn = cost_fn
+        self.pool_size = pool_size
+        self._batches = None
+
+    def get_batches(self) -> List[List[int]]:
+        if self._batches is not None and self._batches[0] == self.epoch:
+            return self._batches[1]
+        rng = self.get_rng()
+        batches = []
+        num_oversize = 0
+        for pool in self.get_sorted_pools(rng, pool_size=self.pool_size):
+            batch = []
+            for idx, length in zip(pool.tolist(), self.lengths[pool].tolist()):
+                # 池内按照长度升序排列,加入的样本就是批次内最长的样本
+                if len(batch) > 0 and self.cost_fn(len(batch) + 1, length) > self.max_cost:
+                    batches.append(batch)
+                    batch = []
+                if len(batch) == 0 and self.cost_fn(1, length) > self.max_cost:
+                    num_oversize += 1
+                batch.append(idx)
+            if len(batch) > 0:
+                batches.append(batch)
+        if num_oversize > 0:
+            log.warning(f'{num_oversize} examples exceed max_cost {self.max_cost} on their own')
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self._batches = (self.epoch, batches)
+        return batches
+
+    def __len__(self) -> int:
+        return len(self.get_batches())
+
+
+def get_batch_sampler(data_source,
+                      batch_size: int,
+                      sampler: str = 'random',
+                      lengths: Optional[Sequence[int]] = None,
+                      shuffle: bool = True,
+                      drop_last: bool = False,
+                      bucket_size: int = 100,
+                      max_cost: Optional[int] = None,
+                      cost_fn: Callable[[int, int], int] = token_cost) -> Sampler[List[int]]:
+    """根据名称构建dataloader使用的批次采样器
+
+    Args:
+        data_source (Dataset): 数据集
+        batch_size (int): 批次大小
+        sampler (str, optional): 'random'为随机批次, 'bucket'为按照token长度分桶, 'token_budget'为按照计算代价动态组织批次. Defaults to 'random'.
+        lengths (Optional[Sequence[int]], optional): 每个样本的token数量,sampler为bucket和token_budget时需要. Defaults to None.
+        shuffle (bool, optional): 是否打乱,只对bucket和token_budget生效,random总是随机. Defaults to True.
+        drop_last (bool, optional): 是否丢弃最后一个不完整的批次,对token_budget无效. Defaults to False.
+        bucket_size (int, optional): 每个桶包含的批次数量. Defaults to 100.
+        max_cost (Optional[int], optional): token_budget每个批次的最大代价. Defaults to None.
+        cost_fn (Callable[[int, int], int], optional): token_budget根据批次大小和最大长度计算代价的函数. Defaults to token_cost.
+    """
+    assert sampler in ['random', 'bucket', 'token_budget'], f'sampler must be one of random, bucket, token_budget, but found {sampler}'
+    if sampler == 'bucket':
+        assert lengths is not None, 'bucket sampler needs lengths of each example'
+        return BucketBatchSampler(lengths=lengths, batch_size=batch_size, bucket_size=bucket_size, shuffle=shuffle, drop_last=drop_last)
+    if sampler == 'token_budget':
+        assert lengths is not None, 'token_budget sampler needs lengths of each example'
+        assert max_cost is not None, 'token_budget sampler needs max_cost'
+        # 每个池包含的样本数量与bucket保持一致
+        return TokenBudgetBatchSampler(lengths=lengths, max_cost=max_cost, cost_fn=cost_fn, pool_size=batch_size * bucket_size, shuffle=shuffle)
+    return BatchSampler(RandomSampler(data_source), batch_size=batch_size, drop_last=drop_last)
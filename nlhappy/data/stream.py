@@ -0,0 +1,238 @@
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
+from typing import List, Dict, Optional, Iterator, Callable, Union
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+import numpy as np
+import srsly
+import torch
+import logging
+from .sampler import BucketBatchSampler, TokenBudgetBatchSampler, token_cost, count_tokens
+
+
+log = logging.getLogger(__name__)
+
+
+SHARD_SUFFIXES = {'.arrow': 'arrow', '.parquet': 'parquet', '.jsonl': 'json', '.json': 'json'}
+
+
+def get_shard_files(path: Union[str, Path]) -> List[str]:
+    """获取目录下(包含子目录)所有的数据分片文件,按照路径排序,支持arrow(save_to_disk的结果),parquet和jsonl
+
+    Args:
+        path (Union[str, Path]): 数据集切分的目录,例如datasets/my_dataset/train
+    """
+    path = Path(path)
+    if path.is_file():
+        return [str(path)]
+    files = sorted(str(p) for p in path.rglob('*') if p.suffix in SHARD_SUFFIXES and p.name not in ['dataset_info.json', 'state.json'])
+    assert len(files) > 0, f'no arrow, parquet or jsonl shards found in {path}'
+    suffixes = set(Path(f).suffix for f in files)
+    assert len(set(SHARD_SUFFIXES[s] for s in suffixes)) == 1, f'shards in {path} must have the same format, but found {suffixes}'
+    return files
+
+
+def iter_shard(file: str, batch_size: int = 1000) -> Iterator[Dict]:
+    """按顺序逐条读取一个分片的样本,arrow和parquet每次只读取一个record batch
+    """
+    suffix = Path(file).suffix
+    if suffix in ['.jsonl', '.json']:
+        yield from srsly.read_jsonl(file)
+    elif suffix == '.parquet':
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+    else:
+        with pa.memory_map(file) as source:
+            try:
+                reader = pa.ipc.open_stream(source)
+            except pa.ArrowInvalid:
+                source.seek(0)
+                reader = pa.ipc.open_file(source)
+                reader = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            for batch in reader:
+                yield from batch.to_pylist()
+
+
+def get_distributed_info() -> tuple:
+    """当前进程的rank和world_size,没有初始化分布式环境时为(0, 1)"""
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
+class StreamingDataset(IterableDataset):
+    """按顺序读取数据分片的流式数据集,数据集不需要全部放到本地磁盘的arrow缓存或者内存中,每次迭代产出一个经过transform的批次
+
+    分片与打乱:
+    - shuffle为True时每个epoch用seed+epoch打乱分片顺序,所有rank和worker的分片顺序相同
+    - 全局worker编号为rank * num_workers + worker_id,分片数量不少于全局worker数量时每个worker读取不同的分片,
+      否则每个worker读取所有分片,只保留样本序号对全局worker数量取余等于自己编号的样本
+    - shuffle为True时用大小为shuffle_buffer_size的缓冲区打乱样本,内存占用与数据集大小无关
+
+    组织批次:
+    - sampler为'random'时按照打乱后的顺序每batch_size个样本组成一个批次
+    - sampler为'bucket'或者'token_budget'时每batch_size * bucket_size个样本组成一个池,池内用BucketBatchSampler
+      或者TokenBudgetBatchSampler组织批次,需要tokenizer计算token数量
+
+    参数:
+    - files (List[str]): 数据分片文件,见get_shard_files
+    - transform (Callable): 批次的转换函数,输入为字段到列表的字典,与dataset.set_transform相同
+    - batch_size (int): 批次大小
+    - sampler (str): 'random', 'bucket'或者'token_budget'. 默认'random'
+    - shuffle (bool): 是否打乱. 默认True
+    - shuffle_buffer_size (int): 打乱缓冲区的样本数量. 默认10000
+    - bucket_size (int): 每个池包含的批次数量. 默认100
+    - max_cost (Optional[int]): token_budget每个批次的最大代价. 默认None
+    - cost_fn (Callable[[int, int], int]): token_budget的代价函数,多进程读取时需要可以序列化. 默认token_cost
+    - tokenizer (Optional[Callable]): 计算token数量的分词器,sampler为bucket和token_budget时需要. 默认None
+    - text_column (Union[str, List[str]]): 计算token数量的文本字段,多个字段(例如问题和文本)时为各字段token数量之和. 默认'text'
+    - max_length (Optional[int]): token数量的上限,一般为预训练模型的最大长度. 默认None
+    - rank (Optional[int]): 当前进程的rank,为None时从torch.distributed获取. 默认None
+    - world_size (Optional[int]): 进程数量,为None时从torch.distributed获取. 默认None
+    - seed (int): 随机种子. 默认0
+
+    说明:
+    - 多卡训练时不同rank得到的批次数量可能不同,需要通过trainer的limit_train_batches或者max_steps限制每个epoch的步数
+    - epoch通过set_epoch设置,StreamingDataLoader每次迭代时自动设置
+    """
+    def __init__(self,
+                 files: List[str],
+                 transform: Callable,
+                 batch_size: int,
+                 sampler: str = 'random',
+                 shuffle: bool = True,
+                 shuffle_buffer_size: int = 10000,
+                 bucket_size: int = 100,
+                 max_cost: Optional[int] = None,
+                 cost_fn: Callable[[int, int], int] = token_cost,
+                 tokenizer: Optional[Callable] = None,
+                 text_column: Union[str, List[str]] = 'text',
+                 max_length: Optional[int] = None,
+                 rank: Optional[int] = None,
+                 world_size: Optional[int] = None,
+                 seed: int = 0) -> None:
+        super().__init__()
+        assert sampler in ['random', 'bucket', 'token_budget'], f'sampler must be one of random, bucket, token_budget, but found {sampler}'
+        assert batch_size > 0 and shuffle_buffer_size > 0 and bucket_size > 0, 'batch_size, shuffle_buffer_size and bucket_size must > 0'
+        if sampler != 'random':
+            assert tokenizer is not None, f'{sampler} sampler needs tokenizer to count tokens'
+        if sampler == 'token_budget':
+            assert max_cost is not None, 'token_budget sampler needs max_cost'
+        self.files = list(files)
+        self.transform = transform
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.bucket_size = bucket_size
+        self.max_cost = max_cost
+        self.cost_fn = cost_fn
+        self.tokenizer = tokenizer
+        self.text_columns = [text_column] if isinstance(text_column, str) else list(text_column)
+        self.max_length = max_length
+        if rank is None or world_size is None:
+            rank, world_size = get_distributed_info()
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def get_worker(self) -> tuple:
+        """全局worker编号和全局worker数量"""
+        worker_info = get_worker_info()
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        worker_id = worker_info.id if worker_info is not None else 0
+        return self.rank * num_workers + worker_id, self.world_size * num_workers
+
+    def get_epoch_files(self) -> List[str]:
+        if not self.shuffle:
+            return self.files
+        rng = np.random.default_rng([self.seed, self.epoch])
+        return [self.files[i] for i in rng.permutation(len(self.files))]
+
+    def iter_examples(self) -> Iterator[Dict]:
+        """当前worker负责的样本,不同rank和worker之间没有重复"""
+        worker_id, num_workers = self.get_worker()
+        files = self.get_epoch_files()
+        if len(files) >= num_workers:
+            for file in files[worker_id::num_workers]:
+                yield from iter_shard(file)
+        else:
+            if worker_id == 0:
+                log.warning(f'{len(files)} shards are fewer than {num_workers} workers, every worker reads all shards and keeps 1/{num_workers} of the examples')
+            i = 0
+            for file in files:
+                for example in iter_shard(file):
+                    if i % num_workers == worker_id:
+                        yield example
+                    i += 1
+
+    def iter_shuffled(self, rng: np.random.Generator) -> Iterator[Dict]:
+        """用固定大小的缓冲区打乱样本: 缓冲区满后每读取一个样本就随机取出一个样本"""
+        buffer = []
+        for example in self.iter_examples():
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(example)
+                continue
+            i = rng.integers(len(buffer))
+            yield buffer[i]
+            buffer[i] = example
+        for i in rng.permutation(len(buffer)):
+            yield buffer[i]
+
+    def iter_pools(self, examples: Iterator[Dict], pool_size: int) -> Iterator[List[Dict]]:
+        pool = []
+        for example in examples:
+            pool.append(example)
+            if len(pool) == pool_size:
+                yield pool
+                pool = []
+        if len(pool) > 0:
+            yield pool
+
+    def get_lengths(self, pool: List[Dict]) -> np.ndarray:
+        lengths = count_tokens(*[[e[column] for e in pool] for column in self.text_columns], tokenizer=self.tokenizer)['length']
+        lengths = np.asarray(lengths, dtype='int64') + self.tokenizer.num_special_tokens_to_add(pair=len(self.text_columns) > 1)
+        if self.max_length is not None:
+            lengths = np.minimum(lengths, self.max_length)
+        return lengths
+
+    def get_pool_batches(self, pool: List[Dict], seed: int) -> List[List[int]]:
+        lengths = self.get_lengths(pool)
+        if self.sampler == 'bucket':
+            batch_sampler = BucketBatchSampler(lengths=lengths, batch_size=self.batch_size, bucket_size=self.bucket_size, shuffle=self.shuffle, seed=seed)
+        else:
+            batch_sampler = TokenBudgetBatchSampler(lengths=lengths, max_cost=self.max_cost, cost_fn=self.cost_fn, pool_size=len(pool), shuffle=self.shuffle, seed=seed)
+        return batch_sampler.get_batches()
+
+    def collate(self, examples: List[Dict]):
+        batch = {k: [e[k] for e in examples] for k in examples[0]}
+        return self.transform(batch)
+
+    def __iter__(self):
+        worker_id, _ = self.get_worker()
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+        examples = self.iter_shuffled(rng) if self.shuffle else self.iter_examples()
+        if self.sampler == 'random':
+            for batch in self.iter_pools(examples, pool_size=self.batch_size):
+                yield self.collate(batch)
+        else:
+            for pool in self.iter_pools(examples, pool_size=self.batch_size * self.bucket_size):
+                for batch in self.get_pool_batches(pool, seed=int(rng.integers(2 ** 31))):
+                    yield self.collate([pool[i] for i in batch])
+
+
+class StreamingDataLoader(DataLoader):
+    """StreamingDataset的dataloader,每次迭代(每个epoch)前调用dataset.set_epoch,保证每个epoch的打乱顺序不同并且可以复现
+    """
+    def __init__(self, dataset: StreamingDataset, **kwargs) -> None:
+        super().__init__(dataset=dataset, batch_size=None, **kwargs)
+        self.epoch = 0
+
+    def __iter__(self):
+        self.dataset.set_epoch(self.epoch)
+        self.epoch += 1
+        return super().__iter__()
@@ -1,10 +1,10 @@
 from functools import lru_cache
-from ..utils.make_datamodule import PLMBaseDataModule, char_idx_to_token
+from ..utils.make_datamodule import PLMBaseDataModule, sequence_padding, sparse_span_padding
 from ..utils.utils import get_logger
-import pandas as pd
+from ..data.label import get_unique_labels
 import numpy as np
 import torch
-from typing import List
+from typing import List, Dict
 
 
 log = get_logger()
@@ -24,17 +24,20 @@ class EntityExtractionDataModule(PLMBaseDataModule):
                  plm: str = 'hfl/chinese-roberta-wwm-ext',
                  **kwargs):
         super().__init__()
+        self.register_encoded_transform(self.tp_transform, encode=self.tp_encode, collate=self.tp_collate)
+        self.register_encoded_transform(self.sparse_tp_transform, encode=self.tp_encode, collate=self.sparse_tp_collate)
+        self.register_encoded_transform(self.bio_transform, encode=self.bio_encode, collate=self.bio_collate)
         
     def setup(self, stage: str) -> None:
         self.hparams.id2ent = self.id2ent
         self.hparams.id2bio = self.id2bio
+        self.hparams.label2id = self.w2ner2id
          
     
     @property
     @lru_cache()
     def ent_labels(self) -> List:
-        labels = sorted(pd.Series(np.concatenate(self.train_df['ents'])).apply(lambda x: x['label']).drop_duplicates().values)
-        return labels
+        return self.get_label_vocab('ent_labels', lambda dataset: sorted(get_unique_labels(dataset, 'ents.label')))
     
     @property
     def ent2id(self):
@@ -59,6 +62,16 @@ class EntityExtractionDataModule(PLMBaseDataModule):
     def id2bio(self):
         return {i:l for l,i in self.bio2id.items()}
 
+    @property
+    def w2ner_labels(self) -> List:
+        """w2ner的标签: 0为无关系, 1为NNW(next-neighboring-word), 之后为每个实体类型的THW(tail-head-word)"""
+        return ['<none>', '<suc>'] + self.ent_labels
+    
+    @property
+    def w2ner2id(self) -> Dict:
+        return {l:i for i,l in enumerate(self.w2ner_labels)}
+
+
     @lru_cache()
     def get_dis2idx(self):
         dis2idx = np.zeros((1000), dtype='int64')
@@ -72,12 +85,21 @@ class EntityExtractionDataModule(PLMBaseDataModule):
         dis2idx[128:] = 8
         dis2idx[256:] = 9
         return dis2idx
-
-
-    def fill(self, data, new_data):
-        for j, x in enumerate(data):
-            new_data[j, :x.shape[0], :x.shape[1]] = np.array(x, dtype=np.int32)
-        return new_data
+    
+    
+    @lru_cache()
+    def get_dist_grid(self, length: int) -> np.ndarray:
+        """相对距离分桶矩阵,第i行第j列为i-j的分桶id: 正距离为1-9,负距离为10-18,对角线为19
+        
+        只与i-j有关,因此较短文本的矩阵就是较长文本矩阵的左上角,批次内的样本直接切片
+        """
+        dis2idx = self.get_dis2idx()
+        positions = np.arange(length)
+        dist = positions[:, None] - positions[None, :]
+        dist = np.minimum(np.abs(dist), len(dis2idx) - 1) * np.sign(dist)
+        dist_grid = np.where(dist < 0, dis2idx[-dist] + 9, dis2idx[np.maximum(dist, 0)])
+        dist_grid[dist_grid == 0] = 19
+        return dist_grid
 
 
     def w2ner_transform(self, examples):
@@ -91,101 +113,108 @@ class EntityExtractionDataModule(PLMBaseDataModule):
                                       return_offsets_mapping=True,
                                       add_special_tokens=False,
                                       return_tensors='pt')
-        batch_mappings = batch_inputs.pop('offset_mapping').tolist()
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
         batch_lengths = batch_inputs['attention_mask'].sum(dim=-1).tolist()
         batch_size = len(batch_text)
-        batch_dist_ids = np.zeros((batch_size, max_length, max_length), dtype=np.int)
-        batch_dist = []
-        batch_label_ids = []
-        dis2idx = self.get_dis2idx()
+        batch_label_ids = np.zeros((batch_size, max_length, max_length), dtype='int64')
+        batch_dist_ids = np.zeros((batch_size, max_length, max_length), dtype='int64')
+        dist_grid = self.get_dist_grid(max_length)
         for i, text in enumerate(batch_text):
-            mapping = batch_mappings[i]
-            ents = batch_ents[i]
             length = batch_lengths[i]
-            label_ids = np.zeros((max_length, max_length), dtype=np.int)
-            for ent in ents:
-                idx_ls = ent['indices']
-                for i in range(len(idx_ls)):
-                    if i +1 >= len(idx_ls):
-                        break
-                    label_ids[char_idx_to_token(idx_ls[i], mapping), char_idx_to_token(idx_ls[i+1], mapping)] = 1
-                label_ids[char_idx_to_token(idx_ls[-1], mapping), char_idx_to_token(idx_ls[0], mapping)] = self.ent2id[ent['label']]
-            batch_label_ids.append(label_ids)
-
-            _dist_inputs = np.zeros((length, length), dtype=np.int)
-            for k in range(length):
-                _dist_inputs[k, :] += k
-                _dist_inputs[:, k] -= k
-
-            for i in range(length):
-                for j in range(length):
-                    if _dist_inputs[i, j] < 0:
-                        _dist_inputs[i, j] = dis2idx[-_dist_inputs[i, j]] + 9
-                    else:
-                        _dist_inputs[i, j] = dis2idx[_dist_inputs[i, j]]
-            _dist_inputs[_dist_inputs == 0] = 19
-            batch_dist.append(_dist_inputs)
-
-        batch_label_ids = np.stack(batch_label_ids)
+            batch_dist_ids[i, :length, :length] = dist_grid[:length, :length]
+            for ent in batch_ents[i]:
+                # 空实体的字符下标为-1,对齐失败
+                tokens, aligned = table.align('entity', i, [ent['indices'] or [-1]])
+                if not aligned[0]:
+                    continue
+                tokens = tokens[0]
+                # 同一个token内的字符只保留一个
+                tokens = tokens[np.r_[True, tokens[1:] != tokens[:-1]]]
+                # NNW: 相邻的两个token, THW: 尾token指向头token
+                batch_label_ids[i, tokens[:-1], tokens[1:]] = self.w2ner2id['<suc>']
+                batch_label_ids[i, tokens[-1], tokens[0]] = self.w2ner2id[ent['label']]
         batch_inputs['label_ids'] = torch.from_numpy(batch_label_ids)
-        _batch_dist_ids = self.fill(batch_dist, batch_dist_ids)
-        batch_dist_ids = np.stack(_batch_dist_ids)
         batch_inputs['distance_ids'] = torch.from_numpy(batch_dist_ids)
         return batch_inputs
 
 
-    def tp_transform(self, examples):
+    def tp_encode(self, examples) -> Dict:
+        """编码文本并将实体对齐为稀疏的(标签, 开始, 结束)坐标
+        """
         batch_text = examples['text']
         batch_ents = examples['ents']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      max_length=max_length,
-                                      padding='max_length',
-                                      truncation=True,
-                                      return_token_type_ids=False,
-                                      return_tensors='pt')
+        batch_inputs = self.encode_text(batch_text)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_tag_spans = []
+        for i, ents in enumerate(batch_ents):
+            # 所有实体的开始和结束字符一次对齐,空实体的字符下标为-1,对齐失败
+            char_spans = [[ent['indices'][0], ent['indices'][-1]] if len(ent['indices']) > 0 else [-1, -1] for ent in ents]
+            token_spans, aligned = table.align('entity', i, np.reshape(char_spans, (-1, 2)))
+            tag_spans = [[self.ent2id[ent['label']], int(span[0]), int(span[1])] for ent, span, ok in zip(ents, token_spans, aligned) if ok]
+            batch_tag_spans.append(tag_spans)
+        return {'input_ids': batch_inputs['input_ids'],
+                'offset_mapping': batch_inputs['offset_mapping'],
+                'tag_spans': batch_tag_spans}
+        
+        
+    def tp_collate(self, examples) -> Dict:
+        batch_inputs = self.pad_inputs(examples['input_ids'])
+        batch_size, max_length = batch_inputs['input_ids'].shape
+        batch_tag_ids = torch.zeros(batch_size, len(self.ent_labels), max_length, max_length)
+        for i, tag_spans in enumerate(examples['tag_spans']):
+            if len(tag_spans) > 0:
+                tag_spans = torch.tensor(tag_spans, dtype=torch.long)
+                batch_tag_ids[i, tag_spans[:, 0], tag_spans[:, 1], tag_spans[:, 2]] = 1
+        batch_inputs['tag_ids'] = batch_tag_ids
+        return batch_inputs
+
+
+    def tp_transform(self, examples):
+        return self.tp_collate(self.tp_encode(examples))
+
+
+    def sparse_tp_collate(self, examples) -> Dict:
+        """tag_ids为稀疏的(开始, 结束)坐标: [batch_size, num_labels, max_spans, 2],不足的部分用(0, 0)补齐,
+        配合SparseMultiLabelCrossEntropy使用,不需要构建[batch_size, num_labels, L, L]的稠密标签
+        """
+        batch_inputs = self.pad_inputs(examples['input_ids'])
+        batch_inputs['tag_ids'] = torch.tensor(sparse_span_padding(examples['tag_spans'], num_labels=len(self.ent_labels)), dtype=torch.long)
+        return batch_inputs
+
+
+    def sparse_tp_transform(self, examples):
+        return self.sparse_tp_collate(self.tp_encode(examples))
+    
+    
+    def bio_encode(self, examples) -> Dict:
+        """编码文本并生成每个token的bio标签id
+        """
+        batch_text = examples['text']
+        batch_inputs = self.encode_text(batch_text)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
         batch_tag_ids = []
-        for i, text in enumerate(batch_text):
-            ents = batch_ents[i]
-            tag_ids = torch.zeros(len(self.ent_labels), max_length, max_length)
-            for ent in ents :
-                if len(ent['indices']) == 0:
-                    log.warn(f'found empty entity indexes in {text}')
+        for i, ents in enumerate(examples['ents']):
+            tag_ids = np.full(len(batch_inputs['input_ids'][i]), self.bio2id['O'], dtype='int64')
+            char_spans = [[ent['indices'][0], ent['indices'][-1]] if len(ent['indices']) > 0 else [-1, -1] for ent in ents]
+            token_spans, aligned = table.align('entity', i, np.reshape(char_spans, (-1, 2)))
+            for ent, (start_token, end_token), ok in zip(ents, token_spans, aligned):
+                if not ok:
                     continue
-                start_char = ent['indices'][0]
-                start = batch_inputs.char_to_token(i, start_char)
-                end_char = ent['indices'][-1] 
-                end = batch_inputs.char_to_token(i, end_char)
-                label_id = self.ent2id[ent['label']]
-                tag_ids[label_id,  start, end] = 1
-            batch_tag_ids.append(tag_ids)
-        batch_tag_ids = torch.stack(batch_tag_ids, dim=0)
-        batch_inputs['tag_ids'] = batch_tag_ids
+                tag_ids[start_token] = self.bio2id['B' + '-' + ent['label']]
+                tag_ids[start_token + 1: end_token + 1] = self.bio2id['I' + '-' + ent['label']]
+            batch_tag_ids.append(tag_ids.tolist())
+        return {'input_ids': batch_inputs['input_ids'],
+                'offset_mapping': batch_inputs['offset_mapping'],
+                'tag_ids': batch_tag_ids}
+        
+        
+    def bio_collate(self, examples) -> Dict:
+        batch_inputs = self.pad_inputs(examples['input_ids'])
+        batch_tag_ids = sequence_padding([np.array(tag_ids, dtype='int64') for tag_ids in examples['tag_ids']], value=-100) # 将pad的部分改为-100
+        batch_inputs['tag_ids'] = torch.from_numpy(batch_tag_ids)
         return batch_inputs
     
     
     def bio_transform(self, examples):
-        batch_text = examples['text']  
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        inputs = self.tokenizer(batch_text,
-                                padding='max_length',
-                                max_length=max_length,
-                                truncation=True,
-                                return_token_type_ids=False,
-                                return_tensors='pt')
-        batch_mask = inputs['attention_mask']
-        batch_tags = torch.zeros_like(batch_mask, dtype=torch.long)
-        batch_tags = batch_tags + (batch_mask - 1) * 100 # 将pad的部分改为-100
-        for i, text in enumerate(batch_text):
-            ents = examples['ents'][i]
-            for ent in ents:
-                indices = ent['indices']
-                start_char = indices[0]
-                start_token = inputs.char_to_token(i, start_char)
-                batch_tags[i][start_token] = self.bio2id['B' + '-' + ent['label']]
-                if len(indices) > 1:
-                    end_char = indices[-1]
-                    end_token = inputs.char_to_token(i, end_char)
-                    batch_tags[i][start_token: end_token+1] = self.bio2id['I' + '-' + ent['label']]
-        inputs['tag_ids'] = batch_tags
-        return inputs
\ No newline at end of file
+        return self.bio_collate(self.bio_encode(examples))
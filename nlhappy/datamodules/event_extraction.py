@@ -1,9 +1,9 @@
-from ..utils.make_datamodule import PLMBaseDataModule, get_logger, char_idx_to_token, sequence_padding
+from ..utils.make_datamodule import PLMBaseDataModule, CharToTokenTable, get_logger, sequence_padding
 from functools import lru_cache
 import torch
-import pandas as pd
+from ..data.label import get_unique_labels, get_unique_label_pairs
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 
 log = get_logger()
@@ -34,8 +34,7 @@ class EventExtractionDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def event_labels(self):
-        labels = pd.Series(np.concatenate(self.train_df.events.values)).apply(lambda x: x['label']).drop_duplicates().values
-        return labels.tolist()
+        return self.get_label_vocab('event_labels', lambda dataset: get_unique_labels(dataset, 'events.label'))
     
     
     @property
@@ -55,8 +54,7 @@ class EventExtractionDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def arg_labels(self) -> Dict:
-        labels = pd.Series(np.concatenate(pd.Series(np.concatenate(self.train_df.events.values)).apply(lambda x: x['args']).values)).apply(lambda x: x['label']).drop_duplicates().values
-        return labels.tolist()
+        return self.get_label_vocab('arg_labels', lambda dataset: get_unique_labels(dataset, 'events.args.label'))
     
     
     @property
@@ -87,18 +85,12 @@ class EventExtractionDataModule(PLMBaseDataModule):
         """将事件类型跟所有事件角色(包括触发词)拼接为一个标签
         - 例如: 裁员事件-触发词, 裁员事件-裁员方
         """
-        def get_labels(e):
-            labels = []
-            label = e['label']
-            labels.append((label, '触发词')) #触发词同样添加进去
-            for arg in e['args']:
-                pair_label = (label,arg['label'])
-                if pair_label not in labels:
-                    labels.append(pair_label)
-            return labels
-        df = pd.DataFrame(np.concatenate(pd.Series(np.concatenate(self.train_df.events.values)).apply(get_labels).values).tolist()).drop_duplicates()
-        labels = sorted([tuple(v) for v in df.values])
-        return labels
+        def get_labels(dataset):
+            # 触发词同样添加进去
+            labels = [(label, '触发词') for label in get_unique_labels(dataset, 'events.label')]
+            labels += get_unique_label_pairs(dataset, path='events', parent_field='label', child_path='args.label')
+            return sorted(set(labels))
+        return self.get_label_vocab('combined_labels', get_labels)
 
 
     @property
@@ -110,62 +102,49 @@ class EventExtractionDataModule(PLMBaseDataModule):
         return {i:l for i,l in enumerate(self.combined_labels)}
 
 
+    def get_event_args(self, event: Dict) -> List[Dict]:
+        """事件的所有论元,将触发词当做事件角色之一"""
+        trigger = event['trigger']
+        return event['args'] + [{'label':'触发词', 'indices': trigger['indices'], 'text': trigger['text']}]
+    
+    
+    def align_args(self, table: CharToTokenTable, i: int, args: List[Dict]) -> Tuple[List[List[int]], np.ndarray]:
+        """一次对齐一个事件所有论元的开始和结束字符
+
+        Returns:
+            Tuple[List[List[int]], np.ndarray]: [num_args, 2]的token下标和每个论元是否对齐成功
+        """
+        char_index = np.reshape([[arg['indices'][0], arg['indices'][-1]] if len(arg['indices']) > 0 else [-1, -1] for arg in args], (-1, 2))
+        token_index, aligned = table.align('argument', i, char_index)
+        return token_index.tolist(), aligned
+
+
     def combined_transform(self, examples):
         batch_text = examples['text']
         batch_events = examples['events']
         batch_role_tags = []
         batch_head_tags = []
         batch_tail_tags = []
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      max_length=max_length,
-                                      padding='max_length',
-                                      truncation=True,
-                                      return_offsets_mapping=True,
-                                      return_tensors='pt',
-                                      return_token_type_ids=False)
-        batch_mappings = batch_inputs.pop('offset_mapping').tolist()
+        batch_inputs = self.tokenize_batch(batch_text, return_offsets_mapping=True, return_token_type_ids=False)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
+        max_length = batch_inputs['input_ids'].shape[1]
         for i, text in enumerate(batch_text):
-            offset_mapping = batch_mappings[i]
             events = batch_events[i]
             role_ids = torch.zeros(len(self.combined2id), max_length, max_length, dtype=torch.long)
             head_ids = torch.zeros(1, max_length, max_length, dtype=torch.long)
             tail_ids = torch.zeros(1, max_length, max_length, dtype=torch.long)
             for event in events:
                 e_label = event['label']
-                args = event['args']
-                # 将触发词当做事件角色之一
-                trigger = event['trigger']
-                trigger_indices = trigger['indices']
-                args.append({'label':'触发词', 'indices': trigger_indices, 'text': trigger})
-                for i, arg1 in enumerate(args):
-                    label = (e_label, arg1['label'])
-                    arg1_head = arg1['indices'][0]
-                    arg1_tail = arg1['indices'][-1]
-                    try:
-                        _arg1_head = char_idx_to_token(arg1_head, offset_mapping=offset_mapping)
-                        _arg1_tail = char_idx_to_token(arg1_tail, offset_mapping=offset_mapping)
-                        assert _arg1_head > 0
-                        assert _arg1_tail > 0
-                        role_ids[self.combined2id[label]][_arg1_head][_arg1_tail] = 1
-                    except:
-                        log.warning(f'batch max length: {max_length}, role {arg1["text"]} offset {(arg1_head, arg1_tail)} align to token offset failed in \n\t {text}')
-                        continue
-                        # 这个role 跟 其他的每个role 头头 尾尾 联系起来
-                    for j, arg2 in enumerate(args):
-                        if j>i:
-                            arg2_head = arg2['indices'][0]
-                            arg2_tail = arg2['indices'][-1]
-                            try:
-                                _arg2_head = char_idx_to_token(arg2_head, offset_mapping=offset_mapping)
-                                _arg2_tail = char_idx_to_token(arg2_tail, offset_mapping=offset_mapping)
-                                assert _arg2_head > 0
-                                assert _arg2_tail > 0
-                                head_ids[0][min(_arg1_head, _arg2_head)][max(_arg1_head, _arg2_head)] = 1
-                                tail_ids[0][min(_arg1_tail, _arg2_tail)][max(_arg1_tail, _arg2_tail)] = 1
-                            except:
-                                log.warning(f'batch max length: {max_length}, role {arg2["text"]} offset {(arg2_head, arg2_tail)} align to token offset failed in \n\t {text}')
-                                continue
+                args = self.get_event_args(event)
+                token_index, aligned = self.align_args(table, i, args)
+                spans = [(arg, span) for arg, span, ok in zip(args, token_index, aligned) if ok]
+                for j, (arg1, (_arg1_head, _arg1_tail)) in enumerate(spans):
+                    role_ids[self.combined2id[(e_label, arg1['label'])]][_arg1_head][_arg1_tail] = 1
+                    # 这个role 跟 其他的每个role 头头 尾尾 联系起来
+                    for _, (_arg2_head, _arg2_tail) in spans[j+1:]:
+                        head_ids[0][min(_arg1_head, _arg2_head)][max(_arg1_head, _arg2_head)] = 1
+                        tail_ids[0][min(_arg1_tail, _arg2_tail)][max(_arg1_tail, _arg2_tail)] = 1
             batch_role_tags.append(role_ids)
             batch_head_tags.append(head_ids)
             batch_tail_tags.append(tail_ids)
@@ -180,57 +159,25 @@ class EventExtractionDataModule(PLMBaseDataModule):
         batch_role_tags = []
         batch_head_tags = []
         batch_tail_tags = []
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      max_length=max_length,
-                                      padding='max_length',
-                                      truncation=True,
-                                      return_offsets_mapping=True,
-                                      return_tensors='pt',
-                                      return_token_type_ids=False)
-        batch_mappings = batch_inputs.pop('offset_mapping').tolist()
+        batch_inputs = self.tokenize_batch(batch_text, return_offsets_mapping=True, return_token_type_ids=False)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
         for i, text in enumerate(batch_text):
-            offset_mapping = batch_mappings[i]
             events = batch_events[i]
             role_tags = [set() for _ in range(len(self.combined2id))]
             head_tags = [set()]
             tail_tags = [set()]
             for event in events:
                 e_label = event['label']
-                args = event['args']
-                # 将触发词当做事件角色之一
-                trigger = event['trigger']
-                trigger_indices = trigger['indices']
-                args.append({'label':'触发词', 'indices': trigger_indices, 'text': trigger['text']})
-                for i, arg1 in enumerate(args):
-                    label = (e_label, arg1['label'])
-                    arg1_head = arg1['indices'][0]
-                    arg1_tail = arg1['indices'][-1]
-                    assert arg1_tail >= arg1_head
-                    try:
-                        _arg1_head = char_idx_to_token(arg1_head, offset_mapping=offset_mapping)
-                        _arg1_tail = char_idx_to_token(arg1_tail, offset_mapping=offset_mapping)
-                        assert _arg1_head > 0
-                        assert _arg1_tail > 0
-                        role_tags[self.combined2id[label]].add((_arg1_head, _arg1_tail))
-                    except:
-                        log.warning(f'batch max length: {max_length}, arg1 {arg1["text"]} offset {(arg1_head, arg1_tail)} align to token offset failed in \n\t {text}')
-                        continue
-                        # 这个role 跟 其他的每个role 头头 尾尾 联系起来
-                    for j, arg2 in enumerate(args):
-                        if j>i:
-                            arg2_head = arg2['indices'][0]
-                            arg2_tail = arg2['indices'][-1]
-                            try:
-                                _arg2_head = char_idx_to_token(arg2_head, offset_mapping=offset_mapping)
-                                _arg2_tail = char_idx_to_token(arg2_tail, offset_mapping=offset_mapping)
-                                assert _arg2_head > 0
-                                assert _arg2_tail > 0
-                                head_tags[0].add((min(_arg1_head, _arg2_head), max(_arg1_head, _arg2_head)))
-                                tail_tags[0].add((min(_arg1_tail, _arg2_tail), max(_arg1_tail, _arg2_tail)))
-                            except:
-                                log.warning(f'batch max length: {max_length}, arg2 {arg2["text"]} offset {(arg2_head, arg2_tail)} align to token offset failed in \n\t {text}')
-                                continue
+                args = self.get_event_args(event)
+                token_index, aligned = self.align_args(table, i, args)
+                spans = [(arg, span) for arg, span, ok in zip(args, token_index, aligned) if ok]
+                for j, (arg1, (_arg1_head, _arg1_tail)) in enumerate(spans):
+                    role_tags[self.combined2id[(e_label, arg1['label'])]].add((_arg1_head, _arg1_tail))
+                    # 这个role 跟 其他的每个role 头头 尾尾 联系起来
+                    for _, (_arg2_head, _arg2_tail) in spans[j+1:]:
+                        head_tags[0].add((min(_arg1_head, _arg2_head), max(_arg1_head, _arg2_head)))
+                        tail_tags[0].add((min(_arg1_tail, _arg2_tail), max(_arg1_tail, _arg2_tail)))
             for tag in role_tags + head_tags + tail_tags:
                 if not tag:
                     tag.add((0,0))
@@ -261,43 +208,28 @@ class EventExtractionDataModule(PLMBaseDataModule):
                                       return_offsets_mapping=True,
                                       return_tensors='pt',
                                       return_token_type_ids=False)
-        batch_mappings = batch_inputs.pop('offset_mapping').tolist()
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
         for i, text in enumerate(batch_text):
-            offset_mapping = batch_mappings[i]
             events = batch_events[i]
             role_tags = torch.zeros(len(self.event_labels), max_length, max_length, dtype=torch.long) # +1, 加上触发词
             head_tags = torch.zeros(len(self.event_labels), max_length, max_length, dtype=torch.long)
             tail_tags = torch.zeros(len(self.event_labels), max_length, max_length, dtype=torch.long)
             for event in events:
-                args: List = event['args']
                 e_label = event['label']
                 trigger = event['trigger']
-                trigger_head = trigger['offset'][0]
-                trigger_tail = trigger['offset'][1]
-                args.append({'label':e_label + '-' + '触发词', 'offset': (trigger_head, trigger_tail)})
-                for i, role1 in enumerate(args):
-                    role1_head = role1['offset'][0]
-                    role1_tail = role1['offset'][1]-1
-                    try:
-                        _role1_head = char_idx_to_token(role1_head, offset_mapping=offset_mapping)
-                        _role1_tail = char_idx_to_token(role1_tail, offset_mapping=offset_mapping)
-                        role_tags[self.event2id[e_label]][_role1_head][_role1_tail] = 1
-                    except:
-                        log.warning(f'role: {role1["text"]} offset {(role1_head, role1_tail)} align failed in \n\t text: {text}')
-                        continue
-                        # 这个role 跟 其他的每个role 头头 尾尾 联系起来
-                    for j, role2 in enumerate(args):
-                        if j>i:
-                            role2_head = role2['offset'][0]
-                            role2_tail = role2['offset'][1]-1
-                            try:
-                                _role2_head = char_idx_to_token(role2_head, offset_mapping=offset_mapping)
-                                _role2_tail = char_idx_to_token(role2_tail, offset_mapping=offset_mapping)
-                                head_tags[self.event2id[e_label]][min(_role1_head, _role2_head)][max(_role1_head, _role2_head)] = 1
-                                tail_tags[self.event2id[e_label]][min(_role1_tail, _role2_tail)][max(_role1_tail, _role2_tail)] = 1
-                            except:
-                                log.warning(f'role: {role2["text"]} offset {(role2_head, role2_tail)} align failed \n\t text: {text}')
-                                continue
+                args: List = event['args'] + [{'label':e_label + '-' + '触发词', 'offset': (trigger['offset'][0], trigger['offset'][1])}]
+                # offset为左闭右开的字符下标
+                char_index = np.reshape([[arg['offset'][0], arg['offset'][1]-1] for arg in args], (-1, 2))
+                token_index, aligned = table.align('argument', i, char_index)
+                spans = [span for span, ok in zip(token_index.tolist(), aligned) if ok]
+                e_id = self.event2id[e_label]
+                for j, (_role1_head, _role1_tail) in enumerate(spans):
+                    role_tags[e_id][_role1_head][_role1_tail] = 1
+                    # 这个role 跟 其他的每个role 头头 尾尾 联系起来
+                    for _role2_head, _role2_tail in spans[j+1:]:
+                        head_tags[e_id][min(_role1_head, _role2_head)][max(_role1_head, _role2_head)] = 1
+                        tail_tags[e_id][min(_role1_tail, _role2_tail)][max(_role1_tail, _role2_tail)] = 1
             batch_role_tags.append(role_tags)
             batch_head_tags.append(head_tags)
             batch_tail_tags.append(tail_tags)
@@ -1,5 +1,6 @@
-from ..utils.make_datamodule import align_char_span_text_b, PLMBaseDataModule
+from ..utils.make_datamodule import PLMBaseDataModule
 import torch
+import numpy as np
 from typing import Dict, Union
 import logging
 
@@ -7,6 +8,8 @@ log = logging.getLogger()
 
 
 class PromptRelationExtractionDataModule(PLMBaseDataModule):
+    text_columns = ['prompts', 'text']
+    
     def __init__(self,
                 dataset: str,
                 plm: str,
@@ -44,40 +47,33 @@ class PromptRelationExtractionDataModule(PLMBaseDataModule):
         batch_triples = example['triples']
         batch_prompts = example['prompts']
         batch_inputs = {'input_ids': [], 'attention_mask': [], 'token_type_ids': [], 'so_ids': [], 'head_ids': [], 'tail_ids': []}
+        batch_encodings = self.tokenizer(
+            batch_prompts,
+            batch_text, 
+            padding='max_length',  
+            max_length=self.hparams.max_length,
+            truncation=True,
+            return_offsets_mapping=True)
+        # 文本为第二个句子,直接对齐文本内的字符下标
+        table = self.get_char_to_token_table(batch_encodings, batch_text, sequence_index=1)
         for i, text in enumerate(batch_text):
-            prompt = batch_prompts[i]
-            inputs = self.tokenizer(
-                prompt,
-                text, 
-                padding='max_length',  
-                max_length=self.hparams.max_length,
-                truncation=True,
-                return_offsets_mapping=True)
-            batch_inputs['input_ids'].append(inputs['input_ids'])
-            batch_inputs['attention_mask'].append(inputs['attention_mask'])
-            batch_inputs['token_type_ids'].append(inputs['token_type_ids'])
-            offset_mapping = inputs['offset_mapping']
+            batch_inputs['input_ids'].append(batch_encodings['input_ids'][i])
+            batch_inputs['attention_mask'].append(batch_encodings['attention_mask'][i])
+            batch_inputs['token_type_ids'].append(batch_encodings['token_type_ids'][i])
             so_ids = torch.zeros(2, self.hparams.max_length, self.hparams.max_length)
             head_ids = torch.zeros(1, self.hparams.max_length, self.hparams.max_length)
             tail_ids = torch.zeros(1, self.hparams.max_length, self.hparams.max_length)
             triples = batch_triples[i]
-            for triple in triples:
-                #加1是因为有cls
-                sub_start = triple['subject']['offset'][0] 
-                sub_end = triple['subject']['offset'][1]
-                obj_start = triple['object']['offset'][0] 
-                obj_end = triple['object']['offset'][1]
-                try:
-                    sub_start_, sub_end_ = align_char_span_text_b((sub_start, sub_end), offset_mapping) 
-                    obj_start_, obj_end_ = align_char_span_text_b((obj_start,obj_end), offset_mapping)
-                    so_ids[0][sub_start_][sub_end_-1] = 1
-                    so_ids[1][obj_start_][obj_end_-1] = 1
-                    head_ids[0][sub_start_][obj_start_] = 1
-                    tail_ids[0][sub_end_-1][obj_end_-1] = 1
-                except Exception as e:
-                    log.warning(e)
-                    log.warning(f'sub char offset {(sub_start, sub_end)} or obj char offset {(obj_start, obj_end)} align to token offset failed \n text: {text} \n mapping: {offset_mapping}')
+            # offset为左闭右开的字符下标, (主体开始, 主体结束, 客体开始, 客体结束)
+            char_index = np.reshape([[t['subject']['offset'][0], t['subject']['offset'][1]-1, t['object']['offset'][0], t['object']['offset'][1]-1] for t in triples], (-1, 4))
+            token_index, aligned = table.align('triple', i, char_index)
+            for (sub_start, sub_end, obj_start, obj_end), ok in zip(token_index.tolist(), aligned):
+                if not ok:
                     continue
+                so_ids[0][sub_start][sub_end] = 1
+                so_ids[1][obj_start][obj_end] = 1
+                head_ids[0][sub_start][obj_start] = 1
+                tail_ids[0][sub_end][obj_end] = 1
             batch_inputs['so_ids'].append(so_ids)
             batch_inputs['head_ids'].append(head_ids)
             batch_inputs['tail_ids'].append(tail_ids)
@@ -1,5 +1,6 @@
-from ..utils.make_datamodule import char_idx_to_token, PLMBaseDataModule
+from ..utils.make_datamodule import PLMBaseDataModule
 import torch
+import numpy as np
 
 
 class PromptSpanExtractionDataModule(PLMBaseDataModule):
@@ -13,6 +14,8 @@ class PromptSpanExtractionDataModule(PLMBaseDataModule):
     其中offset 为左闭右开的字符级别下标
     """
     
+    text_columns = ['prompt', 'text']
+    
     def __init__(self,
                  dataset: str,
                  plm: str,
@@ -46,41 +49,24 @@ class PromptSpanExtractionDataModule(PLMBaseDataModule):
         batch_prompt = example['prompt']
         max_length = self.hparams.max_length
         batch = {'inputs': [], 'span_ids': []}
+        batch_inputs = self.tokenizer(
+            batch_prompt, 
+            batch_text, 
+            padding='max_length',  
+            max_length=max_length,
+            truncation=True,
+            return_offsets_mapping=True)
+        # 文本为第二个句子,直接对齐文本内的字符下标
+        table = self.get_char_to_token_table(batch_inputs, batch_text, sequence_index=1)
+        del batch_inputs['offset_mapping']
         for i, text in enumerate(batch_text):
-            # tokens = fine_grade_tokenize(text, self.tokenizer)
-            prompt = batch_prompt[i]
-            inputs = self.tokenizer(
-                prompt, 
-                text, 
-                padding='max_length',  
-                max_length=max_length,
-                truncation=True,
-                return_offsets_mapping=True)
-            offset_mapping = [list(x) for x in inputs["offset_mapping"]]
-            bias = 0
-            for index in range(len(offset_mapping)):
-                if index == 0:
-                    continue
-                mapping = offset_mapping[index]
-                if mapping[0] == 0 and mapping[1] == 0 and bias == 0:
-                    bias = index
-                if mapping[0] == 0 and mapping[1] == 0:
-                    continue
-                offset_mapping[index][0] += bias
-                offset_mapping[index][1] += bias
             spans = batch_spans[i]
             span_ids = torch.zeros(1, max_length, max_length)
-            for span in spans:
-                start = char_idx_to_token(span['offset'][0]+bias, offset_mapping)
-                end = char_idx_to_token(span['offset'][1]-1+bias, offset_mapping)
-                # 如果超出边界，则跳过
-                try:
-                    span_ids[0, start, end] = 1.0
-                except Exception:
-                    self.log.warning(f'set span {(start, end)} out of boudry')
-                    pass 
-            del inputs['offset_mapping']
-            inputs = dict(zip(inputs.keys(), map(torch.tensor, inputs.values())))
+            char_index = np.reshape([[span['offset'][0], span['offset'][1]-1] for span in spans], (-1, 2))
+            token_index, aligned = table.align('span', i, char_index)
+            token_index = torch.from_numpy(token_index[aligned])
+            span_ids[0, token_index[:, 0], token_index[:, 1]] = 1.0
+            inputs = {k: torch.tensor(v[i]) for k, v in batch_inputs.items()}
             batch['inputs'].append(inputs)
             batch['span_ids'].append(span_ids)
         return batch
\ No newline at end of file
@@ -1,10 +1,13 @@
 from ..utils.make_datamodule import PLMBaseDataModule, sequence_padding
 import torch
+import numpy as np
 
 
 class QuestionAnsweringDataModule(PLMBaseDataModule):
     """span分类的数据模块 数据集必须有text, spans两个字段
     """
+    text_columns = ['question', 'text']
+    
     def __init__(self,
                 dataset: str,
                 batch_size: int,
@@ -16,23 +19,18 @@ class QuestionAnsweringDataModule(PLMBaseDataModule):
         batch_text = examples['text']
         batch_question = examples['question']
         batch_spans = examples['spans']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
         batch_span_ids = []
-        batch_inputs = self.tokenizer(batch_question,
-                                      batch_text, 
-                                      padding=True,  
-                                      truncation=True,
-                                      max_length=max_length,
-                                      return_tensors='pt')
+        batch_inputs = self.tokenize_batch(batch_question, batch_text, truncation='only_second', return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text, sequence_index=1)
+        batch_inputs.pop('offset_mapping')
+        max_length = batch_inputs['input_ids'].shape[1]
         for i, text in enumerate(batch_text):
             spans = batch_spans[i]
             span_ids = torch.zeros(1, max_length, max_length)
-            for span in spans :
-                start = span['indices'][0]
-                _start = batch_inputs.char_to_token(i, start, 1)
-                end = span['indices'][-1] 
-                _end = batch_inputs.char_to_token(i, end, 1)
-                span_ids[0, _start, _end] = 1
+            char_index = np.reshape([[span['indices'][0], span['indices'][-1]] if len(span['indices']) > 0 else [-1, -1] for span in spans], (-1, 2))
+            token_index, aligned = table.align('span', i, char_index)
+            token_index = torch.from_numpy(token_index[aligned])
+            span_ids[0, token_index[:, 0], token_index[:, 1]] = 1
             batch_span_ids.append(span_ids)
         batch_span_ids = torch.stack(batch_span_ids, dim=0)
         batch_inputs['span_tags'] = batch_span_ids
@@ -42,21 +40,18 @@ class QuestionAnsweringDataModule(PLMBaseDataModule):
         batch_text = examples['text']
         batch_question = examples['question']
         batch_spans = examples['spans']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
         batch_tags = []
-        batch_inputs = self.tokenizer(batch_question,
-                                      batch_text, 
-                                      padding=True,  
-                                      truncation=True,
-                                      max_length=max_length,
-                                      return_tensors='pt')
+        batch_inputs = self.tokenize_batch(batch_question, batch_text, truncation='only_second', return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text, sequence_index=1)
+        batch_inputs.pop('offset_mapping')
+        max_length = batch_inputs['input_ids'].shape[1]
         for i, text in enumerate(batch_text):
             spans = batch_spans[i]
             tags = torch.zeros(max_length, dtype=torch.long)
-            for span in spans :
-                for idx in span['indices']: 
-                    token_idx = batch_inputs.char_to_token(i, idx, 1)
-                    tags[token_idx] = 1
+            # 所有片段的每个字符一次对齐
+            char_index = np.array([idx for span in spans for idx in span['indices']], dtype='int64').reshape(-1, 1)
+            token_index, aligned = table.align('span char', i, char_index)
+            tags[torch.from_numpy(token_index[aligned, 0])] = 1
             batch_tags.append(tags)
         batch_tags = torch.stack(batch_tags)
         batch_inputs['tags'] = batch_tags
@@ -66,30 +61,26 @@ class QuestionAnsweringDataModule(PLMBaseDataModule):
         batch_text = examples['text']
         batch_question = examples['question']
         batch_spans = examples['spans']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
         batch_start_tags = []
         batch_end_tags = []
-        batch_inputs = self.tokenizer(batch_question,
-                                      batch_text, 
-                                      padding=True,  
-                                      truncation=True,
-                                      max_length=max_length,
-                                      return_tensors='pt')
+        batch_inputs = self.tokenize_batch(batch_question, batch_text, truncation='only_second', return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text, sequence_index=1)
+        batch_inputs.pop('offset_mapping')
+        max_length = batch_inputs['input_ids'].shape[1]
         for i, text in enumerate(batch_text):
             spans = batch_spans[i]
             start_tags = torch.zeros(max_length, dtype=torch.long)
             end_tags = torch.zeros(max_length, dtype=torch.long)
+            aligned = []
             for span in spans :
-                for idx in span['indices'][0:]:
-                    _start = batch_inputs.char_to_token(batch_or_char_index=i, char_index=idx, sequence_index=1)
-                    if _start is not None:
-                        break
-                for idx in span['indices'][::-1]:
-                    _end = batch_inputs.char_to_token(batch_or_char_index=i, char_index=idx, sequence_index=1)
-                    if _end is not None:
-                        break
-                start_tags[_start] = 1
-                end_tags[_end] = 1
+                # 开始为第一个能对齐的字符,结束为最后一个能对齐的字符
+                tokens = table.gather(i, span['indices'])
+                tokens = tokens[tokens >= 0]
+                aligned.append(len(tokens) > 0)
+                if len(tokens) > 0:
+                    start_tags[tokens[0]] = 1
+                    end_tags[tokens[-1]] = 1
+            self.align_counter.update('span', np.array(aligned, dtype=bool))
             batch_start_tags.append(start_tags)
             batch_end_tags.append(end_tags)
         batch_start_tags = torch.stack(batch_start_tags)
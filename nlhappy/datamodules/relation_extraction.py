@@ -1,9 +1,9 @@
 from functools import lru_cache
-from ..utils.make_datamodule import char_idx_to_token, get_logger, PLMBaseDataModule, sequence_padding
+from ..utils.make_datamodule import get_logger, PLMBaseDataModule, CharToTokenTable, sequence_padding, sparse_span_padding
 import torch
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Tuple
 import numpy as np
-import pandas as pd
+from ..data.label import get_unique_labels
 import random
 
 
@@ -27,7 +27,7 @@ class RelationExtractionDataModule(PLMBaseDataModule):
         Args:
             dataset (str): 数据集名称
             plm (str): 预训练模型名称
-            auto_length (str, int): 自动设置最大长度的策略, 可以为'max', 'mean'或者>0的数,超过512的设置为512
+            auto_length (str, int): 自动设置最大长度的策略, 可以为'max', 'mean', 'p95'等百分位数(p50, p90, p95, p99)或者>0的数,由训练集缓存的token长度统计得到,超过plm_max_length的设置为plm_max_length
             batch_size (int): 训练,验证,测试数据集的批次大小,
             num_workers (int): 多进程数
             pin_memory (bool): 是否应用锁页内存,
@@ -35,6 +35,7 @@ class RelationExtractionDataModule(PLMBaseDataModule):
             plm_dir (str): 预训练模型默认路径
         """
         super().__init__()
+        self.register_encoded_transform(self.sparse_triple_transform, encode=self.sparse_triple_encode, collate=self.sparse_triple_collate)
 
 
     def setup(self, stage: str = 'fit') -> None:
@@ -49,11 +50,9 @@ class RelationExtractionDataModule(PLMBaseDataModule):
     def combined_labels(self) -> List:
         """将主体客体与其实体标签结合起来, (主体, 地点)
         """
-        def get_labels(e):
-            return ['主体'+'-'+e['s']['label'], '客体'+'-'+ e['o']['label']]
-        labels = set(np.concatenate(pd.Series(np.concatenate(self.train_df.rels)).apply(get_labels)))
-        ls = [tuple(l.split('-')) for l in labels]
-        return ls
+        def get_labels(dataset):
+            return sorted([('主体', l) for l in get_unique_labels(dataset, 'rels.s.label')] + [('客体', l) for l in get_unique_labels(dataset, 'rels.o.label')])
+        return self.get_label_vocab('combined_labels', get_labels)
     
     @property
     @lru_cache()
@@ -67,9 +66,9 @@ class RelationExtractionDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def ent_labels(self) -> List:
-        def get_labels(e):
-            return [e['s']['label'], e['o']['label']]
-        return list(set(np.concatenate(pd.Series(np.concatenate(self.train_df.rels)).apply(get_labels))))
+        def get_labels(dataset):
+            return sorted(set(get_unique_labels(dataset, 'rels.s.label') + get_unique_labels(dataset, 'rels.o.label')))
+        return self.get_label_vocab('ent_labels', get_labels)
     
     @property
     def ent2id(self) -> Dict:
@@ -83,8 +82,7 @@ class RelationExtractionDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def rel_labels(self) -> List:
-        labels = set(pd.Series(np.concatenate(self.train_df.rels.values)).apply(lambda x: x['p']))
-        return list(labels)
+        return self.get_label_vocab('rel_labels', lambda dataset: sorted(get_unique_labels(dataset, 'rels.p')))
 
     @property
     def rel2id(self) -> Dict:
@@ -103,65 +101,63 @@ class RelationExtractionDataModule(PLMBaseDataModule):
     def id2onerel(self) -> Dict:
         return {i:l for l,i in self.onerel2id.items()}
     
-    def sparse_triple_transform(self, examples):
+    def align_triples(self, table: CharToTokenTable, i: int, triples: List[Dict]) -> Tuple[List[List[int]], np.ndarray]:
+        """一次对齐一个样本所有三元组的主体和客体
+
+        Returns:
+            Tuple[List[List[int]], np.ndarray]: [num_triples, 4]的token下标(主体开始, 主体结束, 客体开始, 客体结束)和每个三元组是否对齐成功
+        """
+        def boundary(span: Dict) -> List[int]:
+            # 空的字符下标为-1,对齐失败
+            return [span['indices'][0], span['indices'][-1]] if len(span['indices']) > 0 else [-1, -1]
+        char_index = np.reshape([boundary(triple['s']) + boundary(triple['o']) for triple in triples], (-1, 4))
+        token_index, aligned = table.align('triple', i, char_index)
+        return token_index.tolist(), aligned
+
+
+    def sparse_triple_encode(self, examples) -> Dict:
+        """编码文本并将三元组对齐为稀疏坐标,so_tags为(0主体/1客体, 开始, 结束),head_tags和tail_tags为(关系, 主体, 客体)
+        """
         batch_text = examples['text']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      padding=True,
-                                      truncation=True,
-                                      max_length=max_length,
-                                      return_tensors='pt',
-                                      return_token_type_ids=False)
+        batch_inputs = self.encode_text(batch_text)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
         batch_so_tags = []
         batch_head_tags = []
         batch_tail_tags = []
         batch_triples = examples['rels']
         for i, text in enumerate(batch_text):
             triples = batch_triples[i]
-            so_tags = [set() for _ in range(2)]
-            head_tags = [set() for _ in range(len(self.rel_labels))]
-            tail_tags = [set() for _ in range(len(self.rel_labels))]
-            for triple in triples:
-                try:
-                    sub_head = triple['s']['indices'][0]
-                    _sub_head = batch_inputs.char_to_token(i, sub_head)
-                    sub_tail = triple['s']['indices'][-1]
-                    _sub_tail = batch_inputs.char_to_token(i, sub_tail)
-                    sub_label = triple['s']['label']
-                    assert _sub_head is not None and _sub_tail is not None
-                except:
-                    log.warning(f'subject {(sub_head, sub_tail)} align fail in \n {text}')
+            so_tags = []
+            head_tags = []
+            tail_tags = []
+            token_index, aligned = self.align_triples(table, i, triples)
+            for triple, (_sub_head, _sub_tail, _obj_head, _obj_tail), ok in zip(triples, token_index, aligned):
+                if not ok:
                     continue
-                
-                try:
-                    obj_head = triple['o']['indices'][0]
-                    obj_tail = triple['o']['indices'][-1]
-                    obj_label = triple['o']['label']
-                    _obj_head = batch_inputs.char_to_token(i, obj_head)
-                    _obj_tail = batch_inputs.char_to_token(i, obj_tail)
-                    assert _obj_head is not None and _obj_tail is not None
-                except:
-                    log.warning(f'object {(obj_head, obj_tail)} align fail in \n {text}')
-                    continue
-                
-                so_tags[0].add((_sub_head, _sub_tail))
-                so_tags[1].add((_obj_head, _obj_tail))
-                head_tags[self.rel2id[triple['p']]].add((_sub_head, _obj_head))
-                tail_tags[self.rel2id[triple['p']]].add((_sub_tail, _obj_tail))
-            for tag in so_tags + head_tags + tail_tags:
-                if not tag:
-                    tag.add((0,0))
-            so_tags = sequence_padding([list(l) for l in so_tags])
-            head_tags = sequence_padding([list(l) for l in head_tags])
-            tail_tags = sequence_padding([list(l) for l in tail_tags])
+                so_tags.append([0, _sub_head, _sub_tail])
+                so_tags.append([1, _obj_head, _obj_tail])
+                head_tags.append([self.rel2id[triple['p']], _sub_head, _obj_head])
+                tail_tags.append([self.rel2id[triple['p']], _sub_tail, _obj_tail])
             batch_so_tags.append(so_tags)
             batch_head_tags.append(head_tags)
             batch_tail_tags.append(tail_tags)
-        batch_inputs['so_tags'] = torch.tensor(sequence_padding(batch_so_tags, seq_dims=2), dtype=torch.long)
-        batch_inputs['head_tags'] = torch.tensor(sequence_padding(batch_head_tags, seq_dims=2), dtype=torch.long)
-        batch_inputs['tail_tags'] = torch.tensor(sequence_padding(batch_tail_tags, seq_dims=2), dtype=torch.long)
+        return {'input_ids': batch_inputs['input_ids'],
+                'offset_mapping': batch_inputs['offset_mapping'],
+                'so_tags': batch_so_tags,
+                'head_tags': batch_head_tags,
+                'tail_tags': batch_tail_tags}
+        
+        
+    def sparse_triple_collate(self, examples) -> Dict:
+        batch_inputs = self.pad_inputs(examples['input_ids'])
+        for key, num_labels in [('so_tags', 2), ('head_tags', len(self.rel_labels)), ('tail_tags', len(self.rel_labels))]:
+            batch_inputs[key] = torch.tensor(sparse_span_padding(examples[key], num_labels=num_labels), dtype=torch.long)
         return batch_inputs
     
+    
+    def sparse_triple_transform(self, examples):
+        return self.sparse_triple_collate(self.sparse_triple_encode(examples))
+    
         
     def triple_transform(self, example) -> Dict:
         batch_text = example['text']
@@ -169,35 +165,23 @@ class RelationExtractionDataModule(PLMBaseDataModule):
         batch_so_ids = []
         batch_head_ids = []
         batch_tail_ids = []
-        max_length = self.get_batch_max_length(batch_text)
-        batch_inputs = self.tokenizer(batch_text, 
-                                      max_length=max_length,
-                                      padding=True,
-                                      truncation=True,
-                                      return_token_type_ids=False,
-                                      return_tensors='pt')
+        batch_inputs = self.tokenize_batch(batch_text, return_token_type_ids=False, return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
+        max_length = batch_inputs['input_ids'].shape[1]
         for i, text in enumerate(batch_text):
             triples = batch_triples[i]
             so_ids = torch.zeros(2, max_length, max_length, dtype=torch.long)
             head_ids = torch.zeros(len(self.rel_labels), max_length, max_length, dtype=torch.long)
             tail_ids = torch.zeros(len(self.rel_labels), max_length, max_length, dtype=torch.long)
-            for triple in triples:
-                try:
-                    sub_start = triple['s']['indices'][0]
-                    sub_end = triple['s']['indices'][-1]
-                    _sub_start = batch_inputs.char_to_token(i, sub_start)
-                    _sub_end = batch_inputs.char_to_token(i, sub_end)
-                    obj_start = triple['o']['indices'][0]
-                    obj_end = triple['o']['indices'][-1]
-                    _obj_start = batch_inputs.char_to_token(i, obj_start)
-                    _obj_end = batch_inputs.char_to_token(i, obj_end)
-                    so_ids[0][_sub_start][_sub_end] = 1
-                    so_ids[1][_obj_start][_obj_end] = 1
-                    head_ids[self.rel2id[triple['p']]][_sub_start][_obj_start] = 1
-                    tail_ids[self.rel2id[triple['p']]][_sub_end][_obj_end] = 1
-                except:
-                    log.warning(f'sub char offset {(sub_start, sub_end)} or obj char offset {(obj_start, obj_end)} align to token offset failed in \n{text}')
-                    pass
+            token_index, aligned = self.align_triples(table, i, triples)
+            for triple, (_sub_start, _sub_end, _obj_start, _obj_end), ok in zip(triples, token_index, aligned):
+                if not ok:
+                    continue
+                so_ids[0][_sub_start][_sub_end] = 1
+                so_ids[1][_obj_start][_obj_end] = 1
+                head_ids[self.rel2id[triple['p']]][_sub_start][_obj_start] = 1
+                tail_ids[self.rel2id[triple['p']]][_sub_end][_obj_end] = 1
             batch_so_ids.append(so_ids)
             batch_head_ids.append(head_ids)
             batch_tail_ids.append(tail_ids)
@@ -210,56 +194,41 @@ class RelationExtractionDataModule(PLMBaseDataModule):
     def onerel_transform(self, example):
         texts = example['text']
         batch_triples = example['rels']
-        batch_inputs = {'input_ids': [], 'attention_mask': [], 'token_type_ids': []}
         batch_tag_ids = []
         batch_loss_mask = []
         max_length = self.hparams.max_length
+        batch_inputs = self.tokenizer(texts, 
+                                      padding='max_length',  
+                                      max_length=max_length,
+                                      truncation=True,
+                                      return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, texts)
         for i, text in enumerate(texts):
-            inputs = self.tokenizer(text, 
-                                    padding='max_length',  
-                                    max_length=max_length,
-                                    truncation=True,
-                                    return_offsets_mapping=True)
-            batch_inputs['input_ids'].append(inputs['input_ids'])
-            batch_inputs['attention_mask'].append(inputs['attention_mask'])
-            batch_inputs['token_type_ids'].append(inputs['token_type_ids'])
-            offset_mapping = inputs['offset_mapping']
             triples = batch_triples[i]
-            tag_ids = torch.zeros(len(self.label2id), max_length, max_length, dtype=torch.long)
+            tag_ids = torch.zeros(len(self.rel2id), max_length, max_length, dtype=torch.long)
             loss_mask = torch.ones(1, max_length, max_length, dtype=torch.long)
-            att_mask = torch.tensor(inputs['attention_mask'])
+            att_mask = torch.tensor(batch_inputs['attention_mask'][i])
             loss_mask = loss_mask * att_mask.unsqueeze(0) * att_mask.unsqueeze(0).T
-            for triple in triples:
-                try:
-                    rel = triple['p']
-                    rel_id = self.label2id[rel]
-                    sub_start = triple['s']['indices'][0]
-                    sub_end = triple['s']['indices'][-1]
-                    sub_start = char_idx_to_token(sub_start, offset_mapping=offset_mapping)
-                    sub_end = char_idx_to_token(sub_end, offset_mapping=offset_mapping)
-                    obj_start = triple['o']['indices'][0]
-                    obj_end = triple['o']['indices'][-1]
-                    obj_start = char_idx_to_token(obj_start, offset_mapping=offset_mapping)
-                    obj_end = char_idx_to_token(obj_end, offset_mapping=offset_mapping)
-                    if sub_start != sub_end and obj_start != obj_end:
-                        tag_ids[rel_id][sub_start][obj_start] = self.onerel_tag2id['HB-TB']
-                        tag_ids[rel_id][sub_start][obj_end] = self.onerel_tag2id['HB-TE']
-                        tag_ids[rel_id][sub_end][obj_end] = self.onerel_tag2id['HE-TE']
-                    if sub_start == sub_end and obj_start != obj_end:
-                        tag_ids[rel_id][sub_start][obj_start] = self.onerel_tag2id['HB-TB']
-                        tag_ids[rel_id][sub_end][obj_end] = self.onerel_tag2id['HE-TE']
-                    if sub_start != sub_end and obj_start == obj_end:
-                        tag_ids[rel_id][sub_start][obj_start] = self.onerel_tag2id['HB-TB']
-                        tag_ids[rel_id][sub_end][obj_end] = self.onerel_tag2id['HE-TE']
-                    if sub_start == sub_end and obj_start == obj_end:
-                        tag_ids[rel_id][sub_start][obj_start] = self.onerel_tag2id['HB-TB']
-                except Exception as e:
-                    log.exception(e)
-                    log.warning(f'sub char offset {(sub_start, sub_end)} or obj char offset {(obj_start, obj_end)} align to token offset failed in \n{text}')
-                    pass
+            token_index, aligned = self.align_triples(table, i, triples)
+            for triple, (sub_start, sub_end, obj_start, obj_end), ok in zip(triples, token_index, aligned):
+                if not ok:
+                    continue
+                rel_id = self.rel2id[triple['p']]
+                if sub_start != sub_end and obj_start != obj_end:
+                    tag_ids[rel_id][sub_start][obj_start] = self.onerel2id['HB-TB']
+                    tag_ids[rel_id][sub_start][obj_end] = self.onerel2id['HB-TE']
+                    tag_ids[rel_id][sub_end][obj_end] = self.onerel2id['HE-TE']
+                if sub_start == sub_end and obj_start != obj_end:
+                    tag_ids[rel_id][sub_start][obj_start] = self.onerel2id['HB-TB']
+                    tag_ids[rel_id][sub_end][obj_end] = self.onerel2id['HE-TE']
+                if sub_start != sub_end and obj_start == obj_end:
+                    tag_ids[rel_id][sub_start][obj_start] = self.onerel2id['HB-TB']
+                    tag_ids[rel_id][sub_end][obj_end] = self.onerel2id['HE-TE']
+                if sub_start == sub_end and obj_start == obj_end:
+                    tag_ids[rel_id][sub_start][obj_start] = self.onerel2id['HB-TB']
             batch_tag_ids.append(tag_ids)
             batch_loss_mask.append(loss_mask)
-        batch = dict(zip(batch_inputs.keys(), map(torch.tensor, batch_inputs.values())))
+        batch = {k: torch.tensor(batch_inputs[k]) for k in ['input_ids', 'attention_mask', 'token_type_ids']}
         batch['tag_ids'] = torch.stack(batch_tag_ids, dim=0)
         batch['loss_mask'] = torch.stack(batch_loss_mask, dim=0)
         return batch
@@ -276,24 +245,19 @@ class RelationExtractionDataModule(PLMBaseDataModule):
         batch_sub = []
                         
         max_length = self.hparams.max_length
+        batch_encodings = self.tokenizer(texts, 
+                                         padding='max_length',  
+                                         max_length=max_length,
+                                         truncation=True,
+                                         return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_encodings, texts)
         for i, text in enumerate(texts):
-            inputs = self.tokenizer(text, 
-                                    padding='max_length',  
-                                    max_length=max_length,
-                                    truncation=True,
-                                    return_offsets_mapping=True)
-            offset_mapping = inputs['offset_mapping']
             triples = batch_triples[i]
             s2ro_map = {}
-            for triple in triples:
-                sub_start = triple['s']['indices'][0]
-                sub_end = triple['s']['indices'][-1]
-                sub_start = char_idx_to_token(sub_start, offset_mapping=offset_mapping)
-                sub_end = char_idx_to_token(sub_end, offset_mapping=offset_mapping)
-                obj_start = triple['o']['indices'][0]
-                obj_end = triple['o']['indices'][-1]
-                obj_start = char_idx_to_token(obj_start, offset_mapping=offset_mapping)
-                obj_end = char_idx_to_token(obj_end, offset_mapping=offset_mapping)
+            token_index, aligned = self.align_triples(table, i, triples)
+            for triple, (sub_start, sub_end, obj_start, obj_end), ok in zip(triples, token_index, aligned):
+                if not ok:
+                    continue
                 rel_id = self.hparams.label2id[triple['p']]
                 if (sub_start, sub_end) not in s2ro_map:
                     s2ro_map[(sub_start, sub_end)] = [] 
@@ -314,9 +278,9 @@ class RelationExtractionDataModule(PLMBaseDataModule):
                 batch_subs.append(subs)
                 batch_objs.append(objs)
                 batch_sub.append(sub)
-                batch_inputs['input_ids'].append(inputs['input_ids'])
-                batch_inputs['attention_mask'].append(inputs['attention_mask'])
-                batch_inputs['token_type_ids'].append(inputs['token_type_ids'])
+                batch_inputs['input_ids'].append(batch_encodings['input_ids'][i])
+                batch_inputs['attention_mask'].append(batch_encodings['attention_mask'][i])
+                batch_inputs['token_type_ids'].append(batch_encodings['token_type_ids'][i])
         batch = dict(zip(batch_inputs.keys(), map(torch.tensor, batch_inputs.values())))
         batch['subs'] = torch.stack(batch_subs, dim=0)
         batch['sub'] = torch.stack(batch_sub, dim=0)
@@ -326,13 +290,9 @@ class RelationExtractionDataModule(PLMBaseDataModule):
 
     def sparse_combined_transform(self, examples):
         batch_text = examples['text']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      padding=True,
-                                      truncation=True,
-                                      max_length=max_length,
-                                      return_tensors='pt',
-                                      return_token_type_ids=False)
+        batch_inputs = self.tokenize_batch(batch_text, return_token_type_ids=False, return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
         batch_combined_tags = []
         batch_head_tags = []
         batch_tail_tags = []
@@ -342,29 +302,12 @@ class RelationExtractionDataModule(PLMBaseDataModule):
             combined_tags = [set() for _ in range(len(self.combined_labels))]
             head_tags = [set() for _ in range(len(self.rel_labels))]
             tail_tags = [set() for _ in range(len(self.rel_labels))]
-            for triple in triples:
-                try:
-                    sub_head = triple['s']['indices'][0]
-                    _sub_head = batch_inputs.char_to_token(i, sub_head)
-                    sub_tail = triple['s']['indices'][-1]
-                    _sub_tail = batch_inputs.char_to_token(i, sub_tail)
-                    sub_label = triple['s']['label']
-                    assert _sub_head is not None and _sub_tail is not None
-                except:
-                    log.warning(f'subject {(sub_head, sub_tail)} align fail in \n {text}')
-                    continue
-                
-                try:
-                    obj_head = triple['o']['indices'][0]
-                    obj_tail = triple['o']['indices'][-1]
-                    obj_label = triple['o']['label']
-                    _obj_head = batch_inputs.char_to_token(i, obj_head)
-                    _obj_tail = batch_inputs.char_to_token(i, obj_tail)
-                    assert _obj_head is not None and _obj_tail is not None
-                except:
-                    log.warning(f'object {(obj_head, obj_tail)} align fail in \n {text}')
+            token_index, aligned = self.align_triples(table, i, triples)
+            for triple, (_sub_head, _sub_tail, _obj_head, _obj_tail), ok in zip(triples, token_index, aligned):
+                if not ok:
                     continue
-                
+                sub_label = triple['s']['label']
+                obj_label = triple['o']['label']
                 combined_tags[self.combined2id[('主体', sub_label)]].add((_sub_head, _sub_tail))
                 combined_tags[self.combined2id[('客体', obj_label)]].add((_obj_head, _obj_tail))
                 head_tags[self.rel2id[triple['p']]].add((_sub_head, _obj_head))
@@ -386,13 +329,10 @@ class RelationExtractionDataModule(PLMBaseDataModule):
     
     def combined_transform(self, examples):
         batch_text = examples['text']
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      padding=True,
-                                      truncation=True,
-                                      max_length=max_length,
-                                      return_tensors='pt',
-                                      return_token_type_ids=False)
+        batch_inputs = self.tokenize_batch(batch_text, return_token_type_ids=False, return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
+        batch_inputs.pop('offset_mapping')
+        max_length = batch_inputs['input_ids'].shape[1]
         batch_combined_tags = []
         batch_head_tags = []
         batch_tail_tags = []
@@ -402,26 +342,12 @@ class RelationExtractionDataModule(PLMBaseDataModule):
             combined_tags = torch.zeros(len(self.combined_labels), max_length, max_length, dtype=torch.long)
             head_tags = torch.zeros(len(self.rel_labels), max_length, max_length, dtype=torch.long)
             tail_tags = torch.zeros(len(self.rel_labels), max_length, max_length, dtype=torch.long)
-            for triple in triples:
-                sub_head = triple['s']['indices'][0]
-                _sub_head = batch_inputs.char_to_token(i, sub_head)
-                sub_tail = triple['s']['indices'][-1]
-                _sub_tail = batch_inputs.char_to_token(i, sub_tail)
+            token_index, aligned = self.align_triples(table, i, triples)
+            for triple, (_sub_head, _sub_tail, _obj_head, _obj_tail), ok in zip(triples, token_index, aligned):
+                if not ok:
+                    continue
                 sub_label = triple['s']['label']
-                
-                obj_head = triple['o']['indices'][0]
-                obj_tail = triple['o']['indices'][-1]
                 obj_label = triple['o']['label']
-                _obj_head = batch_inputs.char_to_token(i, obj_head)
-                _obj_tail = batch_inputs.char_to_token(i, obj_tail)
-                
-                if _sub_head is None or _sub_tail is None :
-                    log.warning(f'subject {(sub_head, sub_tail)} align fail in \n {text}')
-                    continue
-                if _obj_head is None or _obj_tail is None:
-                    log.warning(f'object {(obj_head, obj_tail)} align fail in \n {text}')
-                    continue
-                
                 combined_tags[self.combined2id[('主体', sub_label)], _sub_head, _sub_tail] = 1
                 combined_tags[self.combined2id[('客体', obj_label)], _obj_head, _obj_tail] = 1
                 head_tags[self.rel2id[triple['p']], _sub_head, _obj_head] = 1
@@ -1,5 +1,7 @@
-from ..utils.make_datamodule import PLMBaseDataModule, char_idx_to_token
+from ..utils.make_datamodule import PLMBaseDataModule
+from ..data.label import get_unique_labels
 import torch
+import numpy as np
 from functools import lru_cache
 
 
@@ -19,7 +21,7 @@ class SpanExtractionDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def label2id(self):
-        set_labels = sorted(set([span['label'] for spans in self.dataset['train']['spans'] for span in spans]))
+        set_labels = self.get_label_vocab('labels', lambda dataset: sorted(get_unique_labels(dataset, 'spans.label')))
         label2id = {label: i for i, label in enumerate(set_labels)}
         return label2id
 
@@ -28,31 +30,25 @@ class SpanExtractionDataModule(PLMBaseDataModule):
         batch_text = example['text']
         batch_spans = example['spans']
         max_length = self.hparams.max_length
-        batch_inputs = {'input_ids':[],'token_type_ids':[],'attention_mask':[]}
+        batch_inputs = self.tokenizer(batch_text, 
+                                      padding='max_length',  
+                                      max_length=max_length,
+                                      truncation=True,
+                                      return_offsets_mapping=True)
+        table = self.get_char_to_token_table(batch_inputs, batch_text)
         batch_span_ids = []
         for i, text in enumerate(batch_text):
-            inputs = self.tokenizer(text, 
-                                    padding='max_length',  
-                                    max_length=max_length,
-                                    truncation=True,
-                                    return_offsets_mapping=True)
             spans = batch_spans[i]
-            mapping = inputs['offset_mapping']
             span_ids = torch.zeros(len(self.hparams.label2id), max_length, max_length)
-            for span in spans :
-                # +1 是因为添加了 [CLS]
-                start = span['offset'][0]
-                start = char_idx_to_token(start, mapping)
-                end = span['offset'][1] 
-                end = char_idx_to_token(end, mapping)
-                label_id = self.hparams.label2id[span['label']]
-                span_ids[label_id,  start, end] = 1
-            batch_inputs['input_ids'].append(inputs['input_ids'])
-            batch_inputs['token_type_ids'].append(inputs['token_type_ids'])
-            batch_inputs['attention_mask'].append(inputs['attention_mask'])
+            # offset为左闭右开的字符下标
+            char_index = np.reshape([[span['offset'][0], span['offset'][1] - 1] for span in spans], (-1, 2))
+            token_index, aligned = table.align('span', i, char_index)
+            for span, (start, end), ok in zip(spans, token_index.tolist(), aligned):
+                if ok:
+                    span_ids[self.hparams.label2id[span['label']], start, end] = 1
             batch_span_ids.append(span_ids)
         batch_span_ids = torch.stack(batch_span_ids, dim=0)
-        batch = dict(zip(batch_inputs.keys(), map(torch.tensor, batch_inputs.values())))
+        batch = {k: torch.tensor(batch_inputs[k]) for k in ['input_ids', 'token_type_ids', 'attention_mask']}
         batch['span_ids'] = batch_span_ids
         return batch
 
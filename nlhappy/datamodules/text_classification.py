@@ -1,6 +1,7 @@
 from functools import lru_cache
 from typing import Tuple, List, Dict
 from ..utils.make_datamodule import PLMBaseDataModule
+from ..data.label import get_unique_labels
 from ..utils import utils
 import torch
 
@@ -27,31 +28,33 @@ class TextClassificationDataModule(PLMBaseDataModule):
                 plm: str = 'hfl/chinese-roberta-wwm-ext',
                 **kwargs):
         super().__init__()       
+        self.register_encoded_transform(self.bert_transform, encode=self.bert_encode, collate=self.bert_collate)
         
     def setup(self, stage: str) -> None:
         self.hparams.id2label = self.id2label
 
     
-    def bert_transform(self, examples) -> Dict:
-        batch_text = examples['text']
-        batch_label_ids = []
-        max_length = self.get_batch_max_length(batch_text=batch_text)
-        batch_inputs = self.tokenizer(batch_text,
-                                      padding=True,
-                                      max_length=max_length,
-                                      truncation=True,
-                                      return_tensors='pt')
-        for i, text in enumerate(batch_text):
-            label_id = self.label2id[examples['label'][i]]
-            batch_label_ids.append(label_id)
-        batch_inputs['label_ids'] = torch.LongTensor(batch_label_ids)        
+    def bert_encode(self, examples) -> Dict:
+        batch_inputs = self.encode_text(examples['text'])
+        return {'input_ids': batch_inputs['input_ids'],
+                'offset_mapping': batch_inputs['offset_mapping'],
+                'label_ids': [self.label2id[label] for label in examples['label']]}
+    
+    
+    def bert_collate(self, examples) -> Dict:
+        batch_inputs = self.pad_inputs(examples['input_ids'], return_token_type_ids=True)
+        batch_inputs['label_ids'] = torch.LongTensor(examples['label_ids'])
         return batch_inputs
     
     
+    def bert_transform(self, examples) -> Dict:
+        return self.bert_collate(self.bert_encode(examples))
+    
+    
     @property
     @lru_cache()
     def labels(self):
-        return sorted(set(self.train_df.label.values))
+        return self.get_label_vocab('labels', lambda dataset: sorted(get_unique_labels(dataset, 'label')))
 
 
     @property
@@ -1,6 +1,7 @@
 from functools import lru_cache
 from typing import Optional,  Tuple, List, Union
 from ..utils.make_datamodule import PLMBaseDataModule
+from ..data.label import get_unique_labels
 import torch
 
 
@@ -9,6 +10,8 @@ class TextPairClassificationDataModule(PLMBaseDataModule):
     dataset_example:
         {'text_a': '肺结核','text_b': '关节炎','label': 不是一种病}
     '''
+    text_columns = ['text_a', 'text_b']
+    
     def __init__(self,
                 dataset: str,
                 batch_size: int,
@@ -26,7 +29,7 @@ class TextPairClassificationDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def label2id(self):
-        set_labels = sorted(set([label for label in self.dataset['train']['label']]))
+        set_labels = self.get_label_vocab('labels', lambda dataset: sorted(get_unique_labels(dataset, 'label')))
         return {label: i for i, label in enumerate(set_labels)}
     
     @property
@@ -43,16 +46,7 @@ class TextPairClassificationDataModule(PLMBaseDataModule):
         batch_text_a = examples['text_a']
         batch_text_b = examples['text_b']
         batch_labels = examples['label']
-        a_max_length = self.get_batch_max_length(batch_text=batch_text_a)
-        b_max_length = self.get_batch_max_length(batch_text=batch_text_b)
-        max_length = a_max_length + b_max_length 
-        max_length = min(max_length, 512)
-        batch_inputs = self.tokenizer(batch_text_a,
-                                      batch_text_b, 
-                                      padding=True, 
-                                      max_length=max_length, 
-                                      truncation=True,
-                                      return_tensors='pt')
+        batch_inputs = self.tokenize_batch(batch_text_a, batch_text_b)
         batch_label_ids = []
         for i in range(len(batch_text_a)):
             batch_label_ids.append(self.hparams['label2id'][batch_labels[i]])
@@ -10,6 +10,8 @@ class TextPairRegressionDataModule(PLMBaseDataModule):
     dataset_exmaple:
         {'text_a': '左膝退变伴游离体','text_b': '单侧膝关节骨性关节病','similarity': 0}
     '''
+    text_columns = ['text_a', 'text_b']
+    
     def __init__(self,
                 dataset: str,
                 plm: str,
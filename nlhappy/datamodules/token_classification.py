@@ -1,6 +1,7 @@
 from functools import lru_cache
 import torch
 from ..utils.make_datamodule import PLMBaseDataModule
+from ..data.label import get_unique_labels
 
 
 class TokenClassificationDataModule(PLMBaseDataModule):
@@ -51,7 +52,7 @@ class TokenClassificationDataModule(PLMBaseDataModule):
     @property
     @lru_cache()
     def label2id(self):
-        set_labels = sorted(set([t['label'] for t_list in self.dataset['train']['tokens'] for t in t_list]))
+        set_labels = self.get_label_vocab('labels', lambda dataset: sorted(get_unique_labels(dataset, 'tokens.label')))
         label2id = {label: i for i, label in enumerate(set_labels)}
         return label2id
 
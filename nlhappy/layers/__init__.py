@@ -1,6 +1,6 @@
 from .normalization import LayerNorm
 from .loss import MultiLabelCategoricalCrossEntropy, SparseMultiLabelCrossEntropy
-from .classifier import GlobalPointer, EfficientGlobalPointer, CRF, SimpleDense, Biaffine, BiaffineSpanClassifier, EfficientBiaffineSpanClassifier
+from .classifier import GlobalPointer, EfficientGlobalPointer, extract_spans, select_spans, dense_to_banded, CRF, get_bio_constraints, SimpleDense, Biaffine, BiaffineSpanClassifier, EfficientBiaffineSpanClassifier
 from .embedding import SinusoidalPositionEmbedding
 from .activation import GELU, SWISH, GELU_Approximate
 from .bert import Bert, BertEmbeddings, BertAttention, BertAddNorm, BertEncoder, BertPooler
@@ -1,5 +1,5 @@
-from .global_pointer import GlobalPointer, EfficientGlobalPointer
+from .global_pointer import GlobalPointer, EfficientGlobalPointer, extract_spans, select_spans, dense_to_banded
 from .simple_dense import SimpleDense
-from .crf import CRF
+from .crf import CRF, get_bio_constraints
 from .biaffine import Biaffine, BiaffineSpanClassifier, EfficientBiaffineSpanClassifier
 from .onerel import OneRelSpanClassifier
\ No newline at end of file
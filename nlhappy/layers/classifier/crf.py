@@ -83,12 +83,41 @@ import torch.nn.functional as F
 #         return out if keepdim else out.squeeze(dim)
 
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import torch
 import torch.nn as nn
 
 
+def get_bio_constraints(labels: List[str]) -> Tuple[torch.BoolTensor, torch.BoolTensor, torch.BoolTensor]:
+    """Allowed transitions of the BIO tagging scheme.
+
+    ``I-X`` may only follow ``B-X`` or ``I-X``, so it can neither start a sequence nor
+    follow any other tag. All the other transitions are allowed.
+
+    Args:
+        labels: Tag names ordered by tag id, e.g. the datamodule's ``bio_labels``.
+
+    Returns:
+        Allowed start tags ``(num_tags,)``, allowed transitions ``(num_tags, num_tags)``
+        where entry ``[i, j]`` is whether tag ``j`` may follow tag ``i``, and allowed end
+        tags ``(num_tags,)``.
+    """
+    num_tags = len(labels)
+    start = torch.ones(num_tags, dtype=torch.bool)
+    transitions = torch.ones(num_tags, num_tags, dtype=torch.bool)
+    end = torch.ones(num_tags, dtype=torch.bool)
+    for j, label in enumerate(labels):
+        if not label.startswith('I-'):
+            continue
+        start[j] = False
+        transitions[:, j] = False
+        for i, prev in enumerate(labels):
+            if prev in (f'B-{label[2:]}', label):
+                transitions[i, j] = True
+    return start, transitions, end
+
+
 class CRF(nn.Module):
     """Conditional random field.
 
@@ -100,6 +129,10 @@ class CRF(nn.Module):
     Args:
         num_tags: Number of tags.
         batch_first: Whether the first dimension corresponds to the size of a minibatch.
+        parallel_scan: Whether to compute the partition function with a log-space parallel
+            scan over timesteps (``O(log seq_length)`` sequential steps, but
+            ``O(seq_length * num_tags^3)`` work and memory) instead of the sequential
+            forward algorithm. Useful on GPU for long sequences with few tags.
 
     Attributes:
         start_transitions (`~torch.nn.Parameter`): Start transition score tensor of size
@@ -116,17 +149,27 @@ class CRF(nn.Module):
        Learning*. Morgan Kaufmann. pp. 282–289.
 
     .. _Viterbi algorithm: https://en.wikipedia.org/wiki/Viterbi_algorithm
+
+    Decoding can be restricted to valid tag sequences with `~CRF.set_constraints`, e.g.
+    ``crf.set_constraints(*get_bio_constraints(bio_labels))``; disallowed transitions get
+    a score of ``-inf`` inside the Viterbi recursion. `~CRF.decode_topk` returns the k best
+    tag sequences with their scores.
     """
 
-    def __init__(self, num_tags: int, batch_first: bool = True) -> None:
+    def __init__(self, num_tags: int, batch_first: bool = True, parallel_scan: bool = False) -> None:
         if num_tags <= 0:
             raise ValueError(f'invalid number of tags: {num_tags}')
         super().__init__()
         self.num_tags = num_tags
         self.batch_first = batch_first
+        self.parallel_scan = parallel_scan
         self.start_transitions = nn.Parameter(torch.empty(num_tags))
         self.end_transitions = nn.Parameter(torch.empty(num_tags))
         self.transitions = nn.Parameter(torch.empty(num_tags, num_tags))
+        # Allowed transitions used only when decoding; not saved in the state dict
+        self.register_buffer('allowed_start', None, persistent=False)
+        self.register_buffer('allowed_transitions', None, persistent=False)
+        self.register_buffer('allowed_end', None, persistent=False)
 
         self.reset_parameters()
 
@@ -141,6 +184,33 @@ class CRF(nn.Module):
         nn.init.uniform_(self.transitions, -0.1, 0.1)
 
 
+    def set_constraints(self,
+                        allowed_start: Optional[torch.BoolTensor] = None,
+                        allowed_transitions: Optional[torch.BoolTensor] = None,
+                        allowed_end: Optional[torch.BoolTensor] = None) -> None:
+        """Restrict Viterbi decoding to tag sequences made of allowed transitions.
+
+        Args:
+            allowed_start: Whether each tag may start a sequence, of size ``(num_tags,)``.
+            allowed_transitions: Whether tag ``j`` may follow tag ``i``, of size
+                ``(num_tags, num_tags)``.
+            allowed_end: Whether each tag may end a sequence, of size ``(num_tags,)``.
+        """
+        device = self.transitions.device
+        for name, allowed, shape in [('allowed_start', allowed_start, (self.num_tags,)),
+                                     ('allowed_transitions', allowed_transitions, (self.num_tags, self.num_tags)),
+                                     ('allowed_end', allowed_end, (self.num_tags,))]:
+            if allowed is not None:
+                allowed = torch.as_tensor(allowed, dtype=torch.bool, device=device)
+                if allowed.shape != shape:
+                    raise ValueError(f'{name} must have size {shape}, got {tuple(allowed.shape)}')
+            setattr(self, name, allowed)
+
+    def _constrained(self, scores: torch.Tensor, allowed: Optional[torch.BoolTensor]) -> torch.Tensor:
+        if allowed is None:
+            return scores
+        return scores.masked_fill(~allowed, float('-inf'))
+
     def __repr__(self) -> str:
         return f'{self.__class__.__name__}(num_tags={self.num_tags})'
 
@@ -185,7 +255,10 @@ class CRF(nn.Module):
         # shape: (batch_size,)
         numerator = self._compute_score(emissions, tags, mask)
         # shape: (batch_size,)
-        denominator = self._compute_normalizer(emissions, mask)
+        if self.parallel_scan:
+            denominator = self._compute_normalizer_parallel(emissions, mask)
+        else:
+            denominator = self._compute_normalizer(emissions, mask)
         # shape: (batch_size,)
         llh = numerator - denominator
 
@@ -213,6 +286,35 @@ class CRF(nn.Module):
         Returns:
             List of list containing the best tag sequence for each batch.
         """
+        if mask is None:
+            mask = emissions.new_ones(emissions.shape[:2], dtype=torch.uint8)
+        best_tags = self.batch_decode(emissions, mask=mask)
+        seq_lengths = mask.long().sum(dim=1 if self.batch_first else 0)
+        if not self.batch_first:
+            best_tags = best_tags.transpose(0, 1)
+        # a single device to host copy for the whole batch
+        return [tags[:length] for tags, length in zip(best_tags.tolist(), seq_lengths.tolist())]
+
+
+    def batch_decode(self, emissions: torch.Tensor,
+                     mask: Optional[torch.ByteTensor] = None,
+                     pad_tag: int = 0) -> torch.LongTensor:
+        """Find the most likely tag sequence using Viterbi algorithm, keeping the result on device.
+
+        The backtrace runs for the whole batch with tensor gathers, so there is no
+        device synchronization per sample or per timestep.
+
+        Args:
+            emissions (`~torch.Tensor`): Emission score tensor of size
+                ``(seq_length, batch_size, num_tags)`` if ``batch_first`` is ``False``,
+                ``(batch_size, seq_length, num_tags)`` otherwise.
+            mask (`~torch.ByteTensor`): Mask tensor of size ``(seq_length, batch_size)``
+                if ``batch_first`` is ``False``, ``(batch_size, seq_length)`` otherwise.
+            pad_tag: Tag filled in at masked positions.
+
+        Returns:
+            `~torch.LongTensor`: The best tag sequences of the same size as ``mask``.
+        """
         self._validate(emissions, mask=mask)
         if mask is None:
             mask = emissions.new_ones(emissions.shape[:2], dtype=torch.uint8)
@@ -221,7 +323,53 @@ class CRF(nn.Module):
             emissions = emissions.transpose(0, 1)
             mask = mask.transpose(0, 1)
 
-        return self._viterbi_decode(emissions, mask)
+        best_tags = self._viterbi_decode_batch(emissions, mask, pad_tag=pad_tag)
+        if self.batch_first:
+            best_tags = best_tags.transpose(0, 1)
+        return best_tags
+
+
+    def decode_topk(self, emissions: torch.Tensor,
+                    mask: Optional[torch.ByteTensor] = None,
+                    k: int = 5,
+                    pad_tag: int = 0,
+                    normalize: bool = False) -> Tuple[torch.LongTensor, torch.Tensor]:
+        """Find the k most likely tag sequences with a batched k-best Viterbi algorithm.
+
+        Args:
+            emissions (`~torch.Tensor`): Emission score tensor of size
+                ``(seq_length, batch_size, num_tags)`` if ``batch_first`` is ``False``,
+                ``(batch_size, seq_length, num_tags)`` otherwise.
+            mask (`~torch.ByteTensor`): Mask tensor of size ``(seq_length, batch_size)``
+                if ``batch_first`` is ``False``, ``(batch_size, seq_length)`` otherwise.
+            k: Number of tag sequences to return for each sample.
+            pad_tag: Tag filled in at masked positions.
+            normalize: Whether to return log probabilities (scores minus the log partition
+                function) instead of unnormalized path scores.
+
+        Returns:
+            Tag sequences of size ``(batch_size, k, seq_length)`` if ``batch_first`` is ``True``,
+            ``(seq_length, batch_size, k)`` otherwise, ordered from best to worst, and their
+            scores of size ``(batch_size, k)``. When a sample has fewer than k valid paths the
+            remaining scores are ``-inf``.
+        """
+        if k <= 0:
+            raise ValueError(f'invalid k: {k}')
+        self._validate(emissions, mask=mask)
+        if mask is None:
+            mask = emissions.new_ones(emissions.shape[:2], dtype=torch.uint8)
+
+        if self.batch_first:
+            emissions = emissions.transpose(0, 1)
+            mask = mask.transpose(0, 1)
+
+        # best_tags: (seq_length, batch_size, k), scores: (batch_size, k)
+        best_tags, scores = self._viterbi_decode_topk(emissions, mask, k=k, pad_tag=pad_tag)
+        if normalize:
+            scores = scores - self._compute_normalizer(emissions, mask).unsqueeze(1)
+        if self.batch_first:
+            best_tags = best_tags.permute(1, 2, 0)
+        return best_tags, scores
 
 
     def _validate(
@@ -265,21 +413,19 @@ class CRF(nn.Module):
         assert mask[0].all()
 
         seq_length, batch_size = tags.shape
-        mask = mask.float()
+        mask = mask.to(emissions.dtype)
 
-        # Start transition score and first emission
-        # shape: (batch_size,)
-        score = self.start_transitions[tags[0]]
-        score += emissions[0, torch.arange(batch_size), tags[0]]
+        # Emission score of every timestep, only added if the timestep is valid (mask == 1)
+        # shape: (seq_length, batch_size)
+        emission_scores = emissions.gather(2, tags.unsqueeze(2)).squeeze(2) * mask
 
-        for i in range(1, seq_length):
-            # Transition score to next tag, only added if next timestep is valid (mask == 1)
-            # shape: (batch_size,)
-            score += self.transitions[tags[i - 1], tags[i]] * mask[i]
+        # Transition score to every next tag, only added if next timestep is valid (mask == 1)
+        # shape: (seq_length - 1, batch_size)
+        transition_scores = self.transitions[tags[:-1], tags[1:]] * mask[1:]
 
-            # Emission score for next tag, only added if next timestep is valid (mask == 1)
-            # shape: (batch_size,)
-            score += emissions[i, torch.arange(batch_size), tags[i]] * mask[i]
+        # Start transition score plus all emission and transition scores
+        # shape: (batch_size,)
+        score = self.start_transitions[tags[0]] + emission_scores.sum(dim=0) + transition_scores.sum(dim=0)
 
         # End transition score
         # shape: (batch_size,)
@@ -332,7 +478,7 @@ class CRF(nn.Module):
 
             # Set score to the next score if this timestep is valid (mask == 1)
             # shape: (batch_size, num_tags)
-            score = torch.where(mask[i].unsqueeze(1), next_score, score)
+            score = torch.where(mask[i].unsqueeze(1).bool(), next_score, score)
 
         # End transition score
         # shape: (batch_size, num_tags)
@@ -342,6 +488,153 @@ class CRF(nn.Module):
         # shape: (batch_size,)
         return torch.logsumexp(score, dim=1)
 
+    def _compute_normalizer_parallel(
+            self, emissions: torch.Tensor, mask: torch.ByteTensor) -> torch.Tensor:
+        # emissions: (seq_length, batch_size, num_tags)
+        # mask: (seq_length, batch_size)
+        assert emissions.dim() == 3 and mask.dim() == 2
+        assert emissions.shape[:2] == mask.shape
+        assert emissions.size(2) == self.num_tags
+        assert mask[0].all()
+
+        # Every timestep i > 0 is a matrix in log space whose entry at row j and column k
+        # is the score of transitioning from tag j to tag k and emitting k. Masked
+        # timesteps become the log-space identity, so the product of all the matrices
+        # is the same as running the forward algorithm up to each sequence end.
+        # A large finite value is used instead of -inf to keep the gradients finite.
+        # shape: (seq_length - 1, batch_size, num_tags, num_tags)
+        steps = self.transitions + emissions[1:].unsqueeze(2)
+        identity = torch.full_like(self.transitions, -10000.0).fill_diagonal_(0.0)
+        steps = torch.where(mask[1:, :, None, None].bool(), steps, identity)
+
+        # Multiply adjacent matrices pairwise (log-sum-exp over the shared tag) until
+        # a single matrix is left: O(log seq_length) sequential steps
+        while steps.size(0) > 1:
+            if steps.size(0) % 2 == 1:
+                steps = torch.cat([steps, identity.expand(1, *steps.shape[1:])], dim=0)
+            steps = torch.logsumexp(steps[0::2].unsqueeze(4) + steps[1::2].unsqueeze(2), dim=3)
+
+        # shape: (batch_size, num_tags)
+        score = self.start_transitions + emissions[0]
+        if steps.size(0) == 1:
+            score = torch.logsumexp(score.unsqueeze(2) + steps[0], dim=1)
+
+        # End transition score
+        # shape: (batch_size, num_tags)
+        score = score + self.end_transitions
+
+        # Sum (log-sum-exp) over all possible tags
+        # shape: (batch_size,)
+        return torch.logsumexp(score, dim=1)
+
+    def _viterbi_decode_batch(self, emissions: torch.FloatTensor,
+                              mask: torch.ByteTensor,
+                              pad_tag: int = 0) -> torch.LongTensor:
+        # emissions: (seq_length, batch_size, num_tags)
+        # mask: (seq_length, batch_size)
+        assert emissions.dim() == 3 and mask.dim() == 2
+        assert emissions.shape[:2] == mask.shape
+        assert emissions.size(2) == self.num_tags
+        assert mask[0].all()
+
+        seq_length, batch_size = mask.shape
+        mask = mask.bool()
+        start_transitions = self._constrained(self.start_transitions, self.allowed_start)
+        transitions = self._constrained(self.transitions, self.allowed_transitions)
+        end_transitions = self._constrained(self.end_transitions, self.allowed_end)
+
+        # shape: (batch_size, num_tags)
+        score = start_transitions + emissions[0]
+        # history[i - 1] stores for every next tag the best current tag at timestep i;
+        # masked timesteps point every tag to itself, so the backtrace walks through
+        # the padding unchanged and all sequences can start from the last timestep
+        # shape: (num_tags,)
+        keep = torch.arange(self.num_tags, device=emissions.device)
+        history = []
+
+        for i in range(1, seq_length):
+            # shape: (batch_size, num_tags, num_tags)
+            next_score = score.unsqueeze(2) + transitions + emissions[i].unsqueeze(1)
+            # shape: (batch_size, num_tags)
+            next_score, indices = next_score.max(dim=1)
+            score = torch.where(mask[i].unsqueeze(1), next_score, score)
+            history.append(torch.where(mask[i].unsqueeze(1), indices, keep))
+
+        # End transition score
+        # shape: (batch_size, num_tags)
+        score = score + end_transitions
+
+        # shape: (batch_size, 1)
+        best_last_tag = score.argmax(dim=1, keepdim=True)
+        best_tags = [best_last_tag]
+        for hist in reversed(history):
+            best_last_tag = hist.gather(1, best_last_tag)
+            best_tags.append(best_last_tag)
+        best_tags.reverse()
+
+        # shape: (seq_length, batch_size)
+        best_tags = torch.cat(best_tags, dim=1).transpose(0, 1)
+        return best_tags.masked_fill(~mask, pad_tag)
+
+    def _viterbi_decode_topk(self, emissions: torch.FloatTensor,
+                             mask: torch.ByteTensor,
+                             k: int,
+                             pad_tag: int = 0) -> Tuple[torch.LongTensor, torch.Tensor]:
+        # emissions: (seq_length, batch_size, num_tags)
+        # mask: (seq_length, batch_size)
+        assert emissions.dim() == 3 and mask.dim() == 2
+        assert emissions.shape[:2] == mask.shape
+        assert emissions.size(2) == self.num_tags
+        assert mask[0].all()
+
+        seq_length, batch_size = mask.shape
+        num_tags = self.num_tags
+        mask = mask.bool()
+        start_transitions = self._constrained(self.start_transitions, self.allowed_start)
+        transitions = self._constrained(self.transitions, self.allowed_transitions)
+        end_transitions = self._constrained(self.end_transitions, self.allowed_end)
+
+        # score[b, j, r] is the score of the r-th best tag sequence so far ending with tag j;
+        # at the first timestep there is only one sequence per tag
+        # shape: (batch_size, num_tags, k)
+        score = emissions.new_full((batch_size, num_tags, k), float('-inf'))
+        score[:, :, 0] = start_transitions + emissions[0]
+        # history[i - 1][b, r, j] stores where the r-th best sequence ending with tag j at
+        # timestep i comes from, as the flat index (previous tag * k + previous rank);
+        # masked timesteps point every sequence to itself
+        # shape: (k, num_tags)
+        keep = torch.arange(num_tags * k, device=emissions.device).view(num_tags, k).t()
+        history = []
+
+        for i in range(1, seq_length):
+            # Score of extending every (previous tag, rank) with every next tag
+            # shape: (batch_size, num_tags * k, num_tags)
+            next_score = (score.unsqueeze(3) + transitions.unsqueeze(1)).reshape(batch_size, num_tags * k, num_tags)
+            next_score = next_score + emissions[i].unsqueeze(1)
+            # shape: (batch_size, k, num_tags)
+            next_score, indices = next_score.topk(k, dim=1)
+            score = torch.where(mask[i, :, None, None], next_score.transpose(1, 2), score)
+            history.append(torch.where(mask[i, :, None, None], indices, keep))
+
+        # End transition score, then the k best sequences over all last tags
+        # shape: (batch_size, num_tags * k)
+        score = (score + end_transitions.unsqueeze(1)).reshape(batch_size, num_tags * k)
+        # shape: (batch_size, k)
+        best_scores, best_last = score.topk(k, dim=1)
+
+        # Trace back every sequence through the flat (tag, rank) indices
+        # history entries are indexed as (rank, tag), so convert flat (tag * k + rank) indices
+        best_tags = [best_last // k]
+        for hist in reversed(history):
+            tag, rank = best_last // k, best_last % k
+            best_last = hist.reshape(batch_size, k * num_tags).gather(1, rank * num_tags + tag)
+            best_tags.append(best_last // k)
+        best_tags.reverse()
+
+        # shape: (seq_length, batch_size, k)
+        best_tags = torch.stack(best_tags, dim=0)
+        return best_tags.masked_fill(~mask.unsqueeze(2), pad_tag), best_scores
+
     def _viterbi_decode(self, emissions: torch.FloatTensor,
                         mask: torch.ByteTensor) -> List[List[int]]:
         # emissions: (seq_length, batch_size, num_tags)
@@ -388,7 +681,7 @@ class CRF(nn.Module):
             # Set score to the next score if this timestep is valid (mask == 1)
             # and save the index that produces the next score
             # shape: (batch_size, num_tags)
-            score = torch.where(mask[i].unsqueeze(1), next_score, score)
+            score = torch.where(mask[i].unsqueeze(1).bool(), next_score, score)
             history.append(indices)
 
         # End transition score
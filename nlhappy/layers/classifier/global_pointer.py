@@ -1,6 +1,7 @@
 import torch
 from torch import nn
 from torch.nn import Module
+from typing import Optional, Tuple
 from ..embedding import SinusoidalPositionEmbedding, RoPEPositionEncoding
 
 
@@ -131,6 +132,12 @@ class EfficientGlobalPointer(Module):
     """全局指针模块
     将序列的每个(start, end)作为整体来进行判断
     https://kexue.fm/archives/8877
+
+    带状模式:
+    - max_span_width不为None时只计算end - start < max_span_width的span,输出为[batch_size, output_size, seq_len, width],
+      其中logits[b, c, i, w]为span(i, i + w)的分数,width = min(seq_len, max_span_width),内存和计算量从O(L^2)降为O(L*W)
+    - 超出序列和padding的位置为-1e12,不需要遮掩下三角
+    - 标签可以用dense_to_banded转换,解码用extract_spans(banded=True)
     """
     def __init__(self, 
                  input_size: int, 
@@ -139,13 +146,16 @@ class EfficientGlobalPointer(Module):
                  add_rope: bool =True,
                  tril_mask: bool =True,
                  use_bias: bool = True,
-                 max_length: int = 512):
+                 max_length: int = 512,
+                 max_span_width: Optional[int] = None):
         super(EfficientGlobalPointer, self).__init__()
+        assert max_span_width is None or max_span_width > 0, f'max_span_width must > 0, but found {max_span_width}'
         self.output_size = output_size
         self.hidden_size = hidden_size
         self.add_rope = add_rope
         self.tril_mask = tril_mask
         self.input_size = input_size
+        self.max_span_width = max_span_width
         self.linear_1 = nn.Linear(input_size, hidden_size * 2, bias=use_bias)
         self.linear_2 = nn.Linear(hidden_size * 2, output_size * 2, bias=use_bias)
         if self.add_rope:
@@ -158,6 +168,8 @@ class EfficientGlobalPointer(Module):
         if self.add_rope:
             qw = self.pe(qw)
             kw = self.pe(kw)
+        if self.max_span_width is not None:
+            return self.forward_banded(inputs, qw, kw, mask=mask)
         logits = torch.einsum('bmd , bnd -> bmn', qw, kw) / self.hidden_size ** 0.5
         # bias = self.linear_2(inputs)
         # bias = torch.stack(torch.chunk(bias, self.output_size, dim=-1), dim=-2).transpose(1,2) #[btz, heads, seq_len, 2]
@@ -177,4 +189,112 @@ class EfficientGlobalPointer(Module):
             t_mask = torch.tril(torch.ones_like(logits), -1) 
             logits = logits - t_mask * 1e12
 
-        return logits
\ No newline at end of file
+        return logits
+
+    def forward_banded(self, inputs, qw, kw, mask=None):
+        """只计算每个start之后width个end的分数,输出[batch_size, output_size, seq_len, width]"""
+        seq_len = qw.shape[1]
+        width = min(seq_len, self.max_span_width)
+        # [batch_size, seq_len, hidden_size, width], band[:, i, :, w]为第i + w个词符
+        kw_band = to_band(kw.transpose(1, 2), width).permute(0, 2, 1, 3)
+        logits = torch.einsum('bmd , bmdw -> bmw', qw, kw_band) / self.hidden_size ** 0.5
+        bias = self.linear_2(inputs).transpose(1, 2) / 2
+        logits = logits[:, None] + bias[:, 1::2, :, None] + to_band(bias[:, ::2], width)
+        # 超出序列的end以及padding的end
+        if mask is None:
+            mask = torch.ones_like(qw[..., 0])
+        band_mask = to_band(mask.to(logits.dtype), width)[:, None]
+        logits = logits * band_mask - (1 - band_mask) * 1e12
+        return logits
+
+
+def to_band(x: torch.Tensor, width: int) -> torch.Tensor:
+    """将最后一维的序列[..., seq_len]展开为带状[..., seq_len, width],band[..., i, w] = x[..., i + w],超出序列的位置为0"""
+    x = torch.nn.functional.pad(x, (0, width - 1))
+    return x.unfold(-1, width, 1)
+
+
+def dense_to_banded(x: torch.Tensor, width: int) -> torch.Tensor:
+    """将span矩阵[..., seq_len, seq_len]转换为带状的[..., seq_len, width],超出序列以及end - start >= width的span被丢弃"""
+    seq_len = x.shape[-1]
+    ends = torch.arange(seq_len, device=x.device)[:, None] + torch.arange(width, device=x.device)
+    valid = ends < seq_len
+    banded = x.gather(-1, ends.clamp(max=seq_len - 1).expand(*x.shape[:-1], width))
+    return banded * valid
+
+
+def get_span_indices(seq_len: int, max_span_width: Optional[int] = None, device: Optional[torch.device] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """上三角(start <= end)中所有span的起始和结束下标,按照先start后end的顺序排列
+
+    Args:
+        seq_len (int): 序列长度
+        max_span_width (Optional[int], optional): span的最大词符数量,即end - start < max_span_width. Defaults to None.
+        device (Optional[torch.device], optional): 设备. Defaults to None.
+    """
+    if max_span_width is None:
+        starts, ends = torch.triu_indices(seq_len, seq_len, device=device)
+        return starts, ends
+    # 直接生成带状的下标,不需要L^2大小的中间张量
+    width = min(seq_len, max_span_width)
+    starts = torch.arange(seq_len, device=device)[:, None].expand(seq_len, width)
+    ends = starts + torch.arange(width, device=device)
+    keep = ends < seq_len
+    return starts[keep], ends[keep]
+
+
+def select_spans(scores: torch.Tensor, 
+                 starts: torch.Tensor, 
+                 ends: torch.Tensor, 
+                 threshold: float = 0.0, 
+                 top_k: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """从候选span的分数中选出分数大于阈值的span,可以限制每个样本的每个标签最多top_k个
+
+    Args:
+        scores (torch.Tensor): 候选span的分数[batch_size, num_labels, num_candidates]
+        starts (torch.Tensor): 候选span的起始下标,形状为[num_candidates]或者与scores相同
+        ends (torch.Tensor): 候选span的结束下标,形状为[num_candidates]或者与scores相同
+        threshold (float, optional): 阈值. Defaults to 0.0.
+        top_k (Optional[int], optional): 每个样本的每个标签最多保留的span数量. Defaults to None.
+
+    Returns:
+        spans (torch.LongTensor): [num_spans, 4],每一行为(batch, label, start, end)
+        scores (torch.Tensor): [num_spans]
+    """
+    starts, ends = starts.expand_as(scores), ends.expand_as(scores)
+    if top_k is not None and top_k < scores.shape[-1]:
+        scores, candidates = scores.topk(top_k, dim=-1)
+        starts, ends = starts.gather(-1, candidates), ends.gather(-1, candidates)
+    batch, label, index = torch.nonzero(scores > threshold, as_tuple=True)
+    spans = torch.stack([batch, label, starts[batch, label, index], ends[batch, label, index]], dim=-1)
+    return spans, scores[batch, label, index]
+
+
+def extract_spans(logits: torch.Tensor, 
+                  threshold: float = 0.0, 
+                  max_span_width: Optional[int] = None, 
+                  top_k: Optional[int] = None,
+                  banded: bool = False) -> Tuple[torch.Tensor, torch.Tensor]:
+    """在logits所在的设备上从globalpointer的输出中解码span,只计算上三角并且宽度不超过max_span_width的span,不会生成与logits相同大小的中间张量
+
+    Args:
+        logits (torch.Tensor): globalpointer的输出[batch_size, num_labels, seq_len, seq_len],也可以是0/1的标签
+        threshold (float, optional): 分数大于阈值的span为预测结果. Defaults to 0.0.
+        max_span_width (Optional[int], optional): span的最大词符数量. Defaults to None.
+        top_k (Optional[int], optional): 每个样本的每个标签最多保留分数最高的top_k个span. Defaults to None.
+        banded (bool, optional): logits是否为带状的[batch_size, num_labels, seq_len, width],见EfficientGlobalPointer. Defaults to False.
+
+    Returns:
+        spans (torch.LongTensor): [num_spans, 4],每一行为(batch, label, start, end),end为包含在span中的最后一个词符
+        scores (torch.Tensor): [num_spans],每个span的分数
+    """
+    if banded:
+        seq_len, width = logits.shape[-2:]
+        if max_span_width is not None:
+            width = min(width, max_span_width)
+        starts, ends = get_span_indices(seq_len, max_span_width=width, device=logits.device)
+        # [batch_size, num_labels, num_candidates]
+        scores = logits[..., starts, ends - starts]
+    else:
+        starts, ends = get_span_indices(logits.shape[-1], max_span_width=max_span_width, device=logits.device)
+        scores = logits[..., starts, ends]
+    return select_spans(scores, starts, ends, threshold=threshold, top_k=top_k)
@@ -1,6 +1,47 @@
 import torch
 from torch import Tensor
 import numpy as np
+from typing import Optional
+
+
+class MultiLabelCategoricalCrossEntropyFunction(torch.autograd.Function):
+    """MultiLabelCategoricalCrossEntropy每一行的损失,按行分块计算负类和正类的logsumexp,不生成整个输入大小的掩码副本
+    - 前向只保存输入以及每一行负类和正类的logsumexp
+    - 反向分块计算梯度并直接写入梯度张量,负类的梯度为softmax(s_neg),正类的梯度为-softmax(-s_pos)
+    - 每个分块的临时张量大小为chunk_size * num_classes
+    """
+    @staticmethod
+    def forward(ctx, y_pred: Tensor, y_true: Tensor, chunk_size: int) -> Tensor:
+        y_pred_2d = y_pred.reshape(-1, y_pred.shape[-1])
+        y_true_2d = y_true.reshape(-1, y_true.shape[-1])
+        neg_lse = y_pred_2d.new_empty(y_pred_2d.shape[0])
+        pos_lse = y_pred_2d.new_empty(y_pred_2d.shape[0])
+        zero = y_pred_2d.new_zeros(())
+        for start in range(0, y_pred_2d.shape[0], chunk_size):
+            end = start + chunk_size
+            pred = y_pred_2d[start: end]
+            is_pos = y_true_2d[start: end].bool()
+            # 与0做logaddexp相当于原实现在最后拼接一个0
+            neg_lse[start: end] = torch.logaddexp(torch.logsumexp(pred.masked_fill(is_pos, float('-inf')), dim=-1), zero)
+            pos_lse[start: end] = torch.logaddexp(torch.logsumexp(pred.neg().masked_fill_(~is_pos, float('-inf')), dim=-1), zero)
+        ctx.save_for_backward(y_pred_2d, y_true_2d, neg_lse, pos_lse)
+        ctx.chunk_size = chunk_size
+        ctx.shape = y_pred.shape
+        return (neg_lse + pos_lse).reshape(y_pred.shape[:-1])
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor):
+        y_pred_2d, y_true_2d, neg_lse, pos_lse = ctx.saved_tensors
+        grad_output = grad_output.reshape(-1, 1)
+        grad = torch.empty_like(y_pred_2d)
+        for start in range(0, y_pred_2d.shape[0], ctx.chunk_size):
+            end = start + ctx.chunk_size
+            pred = y_pred_2d[start: end]
+            is_pos = y_true_2d[start: end].bool()
+            logits = torch.where(is_pos, -pred - pos_lse[start: end, None], pred - neg_lse[start: end, None])
+            torch.exp(logits, out=grad[start: end])
+            grad[start: end].mul_(torch.where(is_pos, -grad_output[start: end], grad_output[start: end]))
+        return grad.reshape(ctx.shape), None, None
 
 
 class MultiLabelCategoricalCrossEntropy(torch.nn.Module):
@@ -10,18 +51,40 @@ class MultiLabelCategoricalCrossEntropy(torch.nn.Module):
     - y_true和y_pred的shape一致,y_true的元素非0即1,1表示对应的类为目标类,0表示对应的类为非目标类;
     - 请保证y_pred的值域是全体实数;换言之一般情况下y_pred不用加激活函数,尤其是不能加sigmoid或者softmax;
     - 预测阶段则输出y_pred大于0的类;
+    - fused为True时用MultiLabelCategoricalCrossEntropyFunction按行分块计算,不会生成多个与y_pred大小相同的中间张量,
+      GlobalPointer在长文本上训练时可以大幅降低显存峰值,结果和梯度与原实现一致
     参考:
     - https://kexue.fm/archives/7359 
     - https://github.com/bojone/bert4keras/blob/4dcda150b54ded71420c44d25ff282ed30f3ea42/bert4keras/backend.py#L250
     '''
-    def __init__(self):
+    def __init__(self, fused: bool = True, chunk_size: Optional[int] = None):
+        """
+        Args:
+            fused (bool, optional): 是否使用分块计算的实现. Defaults to True.
+            chunk_size (Optional[int], optional): 每个分块的行数,为None时每个分块约2^22个元素. Defaults to None.
+        """
         super().__init__()
+        self.fused = fused
+        self.chunk_size = chunk_size
 
     def forward(self, y_pred, y_true):
         """
             y_pred : [batch_size * num_classes, seq_len * seq_len]
             y_true : [batch_size * num_classes, seq_len * seq_len]
         """
+        if self.fused:
+            chunk_size = self.chunk_size or max(1, 2 ** 22 // y_pred.shape[-1])
+            loss = MultiLabelCategoricalCrossEntropyFunction.apply(y_pred, y_true, chunk_size)
+        else:
+            loss = self.unfused_loss(y_pred, y_true)
+        if len(loss.shape) == 3:
+            loss = loss.sum(dim=1).mean()
+        else:
+            loss = loss.mean()
+        return loss
+
+    def unfused_loss(self, y_pred, y_true):
+        """原实现,每一行的损失"""
         y_pred = (1 - 2 * y_true) * y_pred  # -1 -> pos classes, 1 -> neg classes
         y_pred_neg = y_pred - y_true * 1e7  # mask the pred outputs of pos classes
         y_pred_pos =  y_pred - (1 - y_true) * 1e7  # mask the pred outputs of neg classes
@@ -32,12 +95,7 @@ class MultiLabelCategoricalCrossEntropy(torch.nn.Module):
         y_pred_pos = torch.cat([y_pred_pos, zeros], dim=-1)
         neg_loss = torch.logsumexp(y_pred_neg, dim=-1)
         pos_loss = torch.logsumexp(y_pred_pos, dim=-1)
-        loss = neg_loss + pos_loss
-        if len(loss.shape) == 3:
-            loss = loss.sum(dim=1).mean()
-        else:
-            loss = loss.mean()
-        return loss
+        return neg_loss + pos_loss
 
 class SparseMultiLabelCrossEntropy(torch.nn.Module):
     """token-pair稀疏版多标签分类的交叉熵, y_true只传正例
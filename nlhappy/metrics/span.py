@@ -5,7 +5,10 @@ from typing import List, Set, Optional
 
 
 class SpanF1(Metric):
-    """计算span矩阵的F1"""
+    """计算span矩阵的F1
+    - 输入可以是0/1的span矩阵,例如[batch_size, num_labels, seq_len, seq_len]
+    - 也可以是extract_spans得到的稀疏span[num_spans, 4],每一行为(batch, label, start, end),不需要构造稠密的矩阵
+    """
 
     full_state_update: Optional[bool] = False
 
@@ -17,14 +20,26 @@ class SpanF1(Metric):
         self.add_state('all_true', default=torch.tensor(0.0), dist_reduce_fx='sum')
 
     def update(self, pred: Tensor, true: Tensor):
+        if pred.dim() == 2 and not pred.is_floating_point():
+            self.update_sparse(pred, true)
+            return
         self.correct += torch.sum(pred[true==1])
         self.all_pred += torch.sum(pred == 1)
         self.all_true += torch.sum(true == 1)
 
+    def update_sparse(self, pred: Tensor, true: Tensor):
+        """pred和true为不重复的稀疏span[num_spans, 4]"""
+        self.all_pred += pred.shape[0]
+        self.all_true += true.shape[0]
+        if pred.shape[0] > 0 and true.shape[0] > 0:
+            # 相同的span得到相同的编号
+            _, inverse = torch.unique(torch.cat([pred, true]), dim=0, return_inverse=True)
+            self.correct += torch.isin(inverse[:pred.shape[0]], inverse[pred.shape[0]:]).sum()
+
     def compute(self):
         return 2 * self.correct / (self.all_pred + self.all_true)
-    
-    
+
+
 class SpanTokenF1(Metric):
     """以预测的span中的token正确为评判指标
     - 输入的形式为[0,0,0,1,1,1]
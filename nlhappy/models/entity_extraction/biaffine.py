@@ -4,6 +4,7 @@ from ...layers.classifier.biaffine import EfficientBiaffineSpanClassifier
 from ...layers.dropout import MultiDropout
 from ...layers.loss import MultiLabelCategoricalCrossEntropy
 from ...metrics.span import SpanF1
+from ...data.sampler import pair_cost
 import torch
 from typing import List
 
@@ -39,7 +40,11 @@ class BiaffineForEntityExtraction(PLMBaseModel):
         
         
     def setup(self, stage: str) -> None:
-        self.trainer.datamodule.dataset.set_transform(self.trainer.datamodule.tp_transform)
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.tp_transform)
+
+
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.id2ent))
 
 
     def forward(self, input_ids, attention_mask):
@@ -1,4 +1,4 @@
-from ...layers import CRF, SimpleDense
+from ...layers import CRF, SimpleDense, get_bio_constraints
 from ...metrics.chunk import ChunkF1, get_entities
 from ...data.doc import Entity
 from ...utils.make_model import PLMBaseModel
@@ -22,6 +22,8 @@ class CRFForEntityExtraction(PLMBaseModel):
                                       output_size=len(self.hparams.id2bio))
 
         self.crf = CRF(len(self.hparams.id2bio))
+        # 解码时禁止O后面接I-X等不合法的BIO序列
+        self.crf.set_constraints(*get_bio_constraints([self.hparams.id2bio[i] for i in range(len(self.hparams.id2bio))]))
 
         self.train_f1 = ChunkF1()
         self.val_f1 = ChunkF1()
@@ -29,7 +31,7 @@ class CRFForEntityExtraction(PLMBaseModel):
         
         
     def setup(self, stage: str):
-        self.trainer.datamodule.dataset.set_transform(self.trainer.datamodule.bio_transform)
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.bio_transform)
 
 
     def forward(self, input_ids, attention_mask, label_ids=None):
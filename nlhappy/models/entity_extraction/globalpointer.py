@@ -1,9 +1,10 @@
 import torch
 from ...metrics.span import SpanF1
-from ...utils.make_model import PLMBaseModel
-from ...layers import MultiLabelCategoricalCrossEntropy, EfficientGlobalPointer, MultiDropout
+from ...utils.make_model import PLMBaseModel, align_token_spans
+from ...layers import MultiLabelCategoricalCrossEntropy, SparseMultiLabelCrossEntropy, EfficientGlobalPointer, MultiDropout, extract_spans, dense_to_banded
 from ...tricks.adversarial_training import adversical_tricks
 from ...data.doc import Entity
+from ...data.sampler import pair_cost
 from typing import Optional
 
 
@@ -21,6 +22,9 @@ class GlobalPointerForEntityExtraction(PLMBaseModel):
         - adv Optinal[str]: 对抗训练方式, fgm, pgd之一
         - threshold (float): 阈值
         - add_rope (bool): 是否添加RoPE位置矩阵
+        - sparse (bool): 是否使用稀疏标签和SparseMultiLabelCrossEntropy,标签数量多或者文本较长时可以大幅减少内存
+        - max_span_width (Optional[int]): 实体的最大词符数量,不为None时globalpointer只计算带状的[batch_size, ent_type_size, seq_len, max_span_width]分数,更长的实体不参与训练也不会被预测. None为不限制
+        - top_k (Optional[int]): 解码时每个样本的每个实体类型最多保留分数最高的top_k个实体,None为不限制
         - **kwargs datamodule的hparams
     """
     def __init__(self,
@@ -30,6 +34,9 @@ class GlobalPointerForEntityExtraction(PLMBaseModel):
                  weight_decay: float =0.01,
                  adv: Optional[str] = None,
                  threshold: float = 0.0,
+                 sparse: bool = False,
+                 max_span_width: Optional[int] = None,
+                 top_k: Optional[int] = None,
                  **kwargs) : 
         super().__init__()
         ## 手动optimizer 可参考https://pytorch-lightning.readthedocs.io/en/stable/common/optimizers.html#manual-optimization
@@ -41,17 +48,28 @@ class GlobalPointerForEntityExtraction(PLMBaseModel):
         self.classifier = EfficientGlobalPointer(input_size=self.plm.config.hidden_size, 
                                                 hidden_size=hidden_size,
                                                 output_size=len(self.hparams.id2ent),
-                                                add_rope=True)
+                                                add_rope=True,
+                                                max_span_width=max_span_width)
 
         self.dropout = MultiDropout()
-        self.criterion = MultiLabelCategoricalCrossEntropy()
+        if self.hparams.sparse:
+            self.criterion = SparseMultiLabelCrossEntropy()
+        else:
+            self.criterion = MultiLabelCategoricalCrossEntropy()
 
         self.train_metric = SpanF1()
         self.val_metric = SpanF1()
         self.test_metric = SpanF1()
         
     def setup(self, stage: Optional[str] = None) -> None:
-        self.trainer.datamodule.dataset.set_transform(self.trainer.datamodule.tp_transform)
+        if self.hparams.sparse:
+            self.trainer.datamodule.set_transform(self.trainer.datamodule.sparse_tp_transform)
+        else:
+            self.trainer.datamodule.set_transform(self.trainer.datamodule.tp_transform)
+
+
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.id2ent), max_span_width=self.hparams.max_span_width)
 
 
     def forward(self, input_ids, attention_mask=None):
@@ -69,12 +87,51 @@ class GlobalPointerForEntityExtraction(PLMBaseModel):
     def shared_step(self, batch):
         span_ids = batch['tag_ids']
         logits = self(input_ids=batch['input_ids'], attention_mask=batch['attention_mask'])
-        pred = logits.ge(self.hparams.threshold).float()
-        batch_size, ent_type_size = logits.shape[:2]
-        y_true = span_ids.reshape(batch_size*ent_type_size, -1)
-        y_pred = logits.reshape(batch_size*ent_type_size, -1)
-        loss = self.criterion(y_pred, y_true)
-        return loss, pred, span_ids
+        batch_size, ent_type_size, seq_len, width = logits.shape
+        banded = self.hparams.max_span_width is not None
+        if self.hparams.sparse:
+            # span_ids: [batch_size, ent_type_size, max_spans, 2] -> 展平后的下标 start * seq_len + end
+            if banded:
+                # 带状分数中的下标为start * width + (end - start),超出宽度的实体下标为0,与补齐的一样被忽略
+                span_width = span_ids[..., 1] - span_ids[..., 0]
+                y_true = torch.where(span_width < width, span_ids[..., 0] * width + span_width, 0)
+            else:
+                y_true = span_ids[..., 0] * seq_len + span_ids[..., 1]
+            y_pred = logits.reshape(batch_size, ent_type_size, -1)
+            loss = self.criterion(y_pred, y_true)
+        else:
+            y_true = dense_to_banded(span_ids, width) if banded else span_ids
+            y_true = y_true.reshape(batch_size*ent_type_size, -1)
+            y_pred = logits.reshape(batch_size*ent_type_size, -1)
+            loss = self.criterion(y_pred, y_true)
+        pred = self.extract_spans(logits.detach())[0]
+        true = self.get_true_spans(span_ids)
+        return loss, pred, true
+
+
+    def extract_spans(self, logits: torch.Tensor, threshold: Optional[float] = None):
+        """按照模型的阈值,max_span_width和top_k解码实体,返回[num_spans, 4]的(batch, label, start, end)和[num_spans]的分数"""
+        if threshold is None:
+            threshold = self.hparams.threshold
+        return extract_spans(logits, 
+                             threshold=threshold, 
+                             max_span_width=self.hparams.max_span_width, 
+                             top_k=self.hparams.top_k, 
+                             banded=self.hparams.max_span_width is not None)
+
+
+    def get_true_spans(self, span_ids: torch.Tensor) -> torch.Tensor:
+        """将稠密或者稀疏的标签转换为[num_spans, 4]的(batch, label, start, end),用于计算指标
+        
+        参数:
+        - span_ids: 稠密标签[batch_size, ent_type_size, seq_len, seq_len]或者稀疏标签[batch_size, ent_type_size, max_spans, 2]
+        """
+        if self.hparams.sparse:
+            # 补齐的span为(0, 0),[CLS]不会是实体
+            batch, label, index = torch.nonzero(span_ids.ne(0).any(dim=-1), as_tuple=True)
+            spans = torch.cat([torch.stack([batch, label], dim=-1), span_ids[batch, label, index]], dim=-1)
+            return torch.unique(spans, dim=0)
+        return torch.nonzero(span_ids > 0)
 
 
     def training_step(self, batch, batch_idx):
@@ -140,26 +197,24 @@ class GlobalPointerForEntityExtraction(PLMBaseModel):
         return [optimizer], [scheduler_config]
 
 
-    def predict(self, text: str, device: str='cpu'):
-        threshold = self.hparams.threshold
+    def predict(self, text: str, device: str='cpu', threshold: Optional[float] = None):
         inputs = self.tokenizer(text,
                                 max_length=self.hparams.plm_max_length,
                                 truncation=True,
                                 return_token_type_ids=False,
+                                return_offsets_mapping=True,
                                 return_tensors='pt')
+        offset_mapping = inputs.pop('offset_mapping')
         inputs.to(device)
         logits = self(**inputs)
-        spans_ls = torch.nonzero(logits>threshold).tolist()
+        spans, scores = self.extract_spans(logits, threshold=threshold)
+        char_spans = align_token_spans(spans, offset_mapping).tolist()
         ents = []
-        for span in spans_ls :
-            start_token = span[2]
-            start_offset = inputs.token_to_chars(start_token)
-            start = start_offset[0]
-            end_token = span[3]
-            end_offset = inputs.token_to_chars(end_token)
-            end = end_offset[-1]
-            span_text = text[start:end]
-            label = self.hparams.id2ent[span[1]]
-            ent = Entity(text=span_text, indices=[i for i in range(start, end)], label=label)
+        for (start, end), label_id, score in zip(char_spans, spans[:, 1].tolist(), scores.tolist()):
+            # 特殊词符的字符下标为(0, 0)
+            if end <= start:
+                continue
+            label = self.hparams.id2ent[label_id]
+            ent = Entity(text=text[start:end], indices=[i for i in range(start, end)], label=label, score=score)
             ents.append(ent)
         return ents
\ No newline at end of file
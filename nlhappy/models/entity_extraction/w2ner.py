@@ -1,6 +1,7 @@
 from ...utils.make_model import PLMBaseModel
 from ...layers import LayerNorm, Biaffine
 from ...metrics.entity import Entity, EntityF1
+from ...data.sampler import pair_cost
 import torch.nn as nn
 import torch.nn.functional as F
 import torch
@@ -168,6 +169,10 @@ class W2ForEntityExtraction(PLMBaseModel):
         self.val_metric = EntityF1()
 
 
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.label2id))
+
+
     def forward(self, input_ids, token_type_ids, attention_mask, grid_mask, distance_ids):
         # 将bert的输出取后四层的平均 -> b, l, h
         hiddens = self.plm(input_ids, token_type_ids, attention_mask, output_hidden_states=True).hidden_states
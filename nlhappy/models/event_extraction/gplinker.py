@@ -4,6 +4,7 @@ from ...layers.loss import SparseMultiLabelCrossEntropy
 from ...layers.dropout import MultiDropout
 from ...metrics.event import EventF1, Event, Entity
 from ...metrics.span import SpanF1
+from ...data.sampler import pair_cost
 import torch
 from itertools import groupby
 from typing import Any, Union, Optional, List, Tuple
@@ -91,10 +92,14 @@ class GPLinkerForEventExtraction(PLMBaseModel):
         
         
     def setup(self, stage: str) -> None:
-        self.trainer.datamodule.dataset['train'].set_transform(self.trainer.datamodule.sparse_combined_transform)
-        self.trainer.datamodule.dataset['validation'].set_transform(self.trainer.datamodule.combined_transform)
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.sparse_combined_transform, split='train')
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.combined_transform, split='validation')
         
         
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.id2combined) + 2) # 事件角色标签,头对齐和尾对齐各1个标签
+
+
     def forward(self, input_ids, attention_mask):
         x = self.plm(input_ids=input_ids,attention_mask=attention_mask).last_hidden_state
         x = self.dropout(x)
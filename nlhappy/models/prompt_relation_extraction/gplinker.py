@@ -1,7 +1,8 @@
-from ...layers import EfficientGlobalPointer, MultiDropout
+from ...layers import EfficientGlobalPointer, MultiDropout, extract_spans
 from ...layers.loss import MultiLabelCategoricalCrossEntropy
 from ...metrics.triple import TripleF1, Triple
-from ...utils.make_model import align_token_span, PLMBaseModel
+from ...utils.make_model import align_token_spans, PLMBaseModel
+from ...data.sampler import pair_cost
 import torch
 from torch import Tensor
 from typing import List, Set
@@ -30,9 +31,9 @@ class GPLinkerForPromptRelationExtraction(PLMBaseModel):
         # 主语 宾语分类器
         self.so_classifier = EfficientGlobalPointer(self.plm.config.hidden_size, hidden_size, 2)
         # 主语 宾语 头对齐
-        self.head_classifier = EfficientGlobalPointer(self.plm.config.hidden_size, hidden_size, 1, RoPE=False, tril_mask=False)
+        self.head_classifier = EfficientGlobalPointer(self.plm.config.hidden_size, hidden_size, 1, add_rope=False, tril_mask=False)
         # 主语 宾语 尾对齐
-        self.tail_classifier = EfficientGlobalPointer(self.plm.config.hidden_size, hidden_size, 1, RoPE=False, tril_mask=False)
+        self.tail_classifier = EfficientGlobalPointer(self.plm.config.hidden_size, hidden_size, 1, add_rope=False, tril_mask=False)
 
         self.so_criterion = MultiLabelCategoricalCrossEntropy()
         self.head_criterion = MultiLabelCategoricalCrossEntropy()
@@ -44,6 +45,10 @@ class GPLinkerForPromptRelationExtraction(PLMBaseModel):
 
     
 
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=4) # 主语宾语2个标签,头对齐和尾对齐各1个标签
+
+
     def forward(self, input_ids, token_type_ids=None, attention_mask=None):
         hidden_state = self.plm(input_ids=input_ids, token_type_ids=token_type_ids, attention_mask=attention_mask).last_hidden_state
         hidden_state = self.dropout(hidden_state)
@@ -128,6 +133,34 @@ class GPLinkerForPromptRelationExtraction(PLMBaseModel):
         return [optimizer], [scheduler_config]
 
 
+    def decode_triples(
+        self,
+        so_logits: Tensor,
+        head_logits: Tensor,
+        tail_logits: Tensor,
+        threshold: float
+        ) -> Tensor:
+        """在设备上解码整个批次的三元组,主语和宾语用extract_spans解码,同一个样本中所有主语和宾语的组合一次性判断头尾对齐
+        参数:
+        - so_logits: [batch_size, 2, seq_len, seq_len]
+        - head_logits: [batch_size, 1, seq_len, seq_len]
+        - tail_logits: [batch_size, 1, seq_len, seq_len]
+        返回:
+        - [num_triples, 5],每一行为(batch, sub_start, sub_end, obj_start, obj_end),end为包含在span中的最后一个词符
+        """
+        subjects, _ = extract_spans(so_logits[:, :1], threshold=threshold)
+        objects, _ = extract_spans(so_logits[:, 1:], threshold=threshold)
+        # 同一个样本中的主语和宾语组合
+        sub_index, obj_index = torch.nonzero(subjects[:, None, 0] == objects[None, :, 0], as_tuple=True)
+        subjects, objects = subjects[sub_index], objects[obj_index]
+        batch = subjects[:, 0]
+        heads = head_logits[batch, :, subjects[:, 2], objects[:, 2]] > threshold
+        tails = tail_logits[batch, :, subjects[:, 3], objects[:, 3]] > threshold
+        keep = (heads & tails).any(dim=-1)
+        triples = torch.stack([batch, subjects[:, 2], subjects[:, 3], objects[:, 2], objects[:, 3]], dim=-1)
+        return triples[keep]
+
+
     def extract_triple(
         self, 
         so_logits: Tensor,
@@ -144,30 +177,10 @@ class GPLinkerForPromptRelationExtraction(PLMBaseModel):
         返回:
         - batch_size大小的列表，每个元素是一个集合，集合中的元素是三元组
         """
-
-        so_logits = so_logits.chunk(so_logits.shape[0])
-        head_logits = head_logits.chunk(head_logits.shape[0])
-        tail_logtis = tail_logtis.chunk(tail_logtis.shape[0])
-        assert len(head_logits) == len(tail_logtis) == len(so_logits)
-        batch_triples = []
-        for i in range(len(so_logits)):
-            subjects, objects = set(), set()
-            for l, h, t in zip(*torch.where(so_logits[i].squeeze(0) > threshold)):
-                if  l == 0:
-                    subjects.add((h, t))
-                else:
-                    objects.add((h, t))
-            
-            triples = set()
-            for sh, st in subjects:
-                for oh, ot in objects:
-                    p1s = torch.where(head_logits[i].squeeze(0)[:, sh, oh] > threshold)[0].tolist()
-                    p2s = torch.where(tail_logtis[i].squeeze(0)[:, st, ot] > threshold)[0].tolist()
-                    ps = set(p1s) & set(p2s)
-                    if len(ps) > 0:
-                        for p in ps:
-                            triples.add(Triple(triple=(sh.item(), st.item(), '', oh.item(), ot.item())))
-            batch_triples.append(triples)
+        triples = self.decode_triples(so_logits, head_logits, tail_logtis, threshold=threshold)
+        batch_triples = [set() for _ in range(so_logits.shape[0])]
+        for i, sh, st, oh, ot in triples.tolist():
+            batch_triples[i].add(Triple(triple=(sh, st, '', oh, ot)))
         return batch_triples
 
 
@@ -201,13 +214,13 @@ class GPLinkerForPromptRelationExtraction(PLMBaseModel):
         so_logits, head_logits, tail_logits = self(**inputs)
         if threshold is None:
             threshold = self.hparams.threshold
-        batch_triples = self.extract_triple(so_logits, head_logits, tail_logits, threshold=threshold)
+        triples = self.decode_triples(so_logits, head_logits, tail_logits, threshold=threshold)
+        # 去掉重复的三元组,与集合的结果一致
+        triples = torch.unique(triples, dim=0)
+        batch = triples[:, :1]
+        subs = align_token_spans(torch.cat([batch, batch, triples[:, 1:3]], dim=-1), mapping).tolist()
+        objs = align_token_spans(torch.cat([batch, batch, triples[:, 3:5]], dim=-1), mapping).tolist()
         rels = []
-        if len(batch_triples) >0:
-            for i, triples_type in enumerate(batch_triples):
-                triples = [(triple[0], triple[1], prompts[i], triple[3], triple[4])  for triple in triples_type]
-                for triple in triples:
-                    sub = align_token_span((triple[0], triple[1]+1), mapping[i])
-                    obj = align_token_span((triple[3], triple[4]+1), mapping[i])
-                    rels.append((sub[0],sub[1],prompts[i],obj[0],obj[1]))
+        for i, sub, obj in zip(batch.squeeze(-1).tolist(), subs, objs):
+            rels.append((sub[0], sub[1], prompts[i], obj[0], obj[1]))
         return rels
\ No newline at end of file
@@ -1,10 +1,10 @@
 import torch
 import torch.nn as nn
 from ...metrics.span import SpanIndexF1
-from ...utils.make_model import PLMBaseModel
-from ...layers import MultiLabelCategoricalCrossEntropy
+from ...utils.make_model import PLMBaseModel, align_token_spans
+from ...layers import MultiLabelCategoricalCrossEntropy, select_spans
 from ...data.doc import Doc
-from typing import List, Set, Tuple
+from typing import List, Set, Tuple, Optional
 
 class PointerForQuestionAnswering(PLMBaseModel):
     def __init__(self,
@@ -12,6 +12,8 @@ class PointerForQuestionAnswering(PLMBaseModel):
                  scheduler: str = 'linear_warmup',
                  weight_decay: float = 0.01,
                  threshold: float = 0.0,
+                 max_span_width: Optional[int] = None,
+                 top_k: Optional[int] = None,
                  **kwargs) : 
         super().__init__()
 
@@ -26,7 +28,7 @@ class PointerForQuestionAnswering(PLMBaseModel):
         
         
     def setup(self, stage: str) -> None:
-        self.trainer.datamodule.dataset.set_transform(self.trainer.datamodule.pointer_transform)
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.pointer_transform)
 
 
     def forward(self, input_ids, token_type_ids, attention_mask=None) -> torch.Tensor:
@@ -44,33 +46,51 @@ class PointerForQuestionAnswering(PLMBaseModel):
         start_loss = self.criterion(start_logits, start_tags)
         end_loss = self.criterion(end_logits, end_tags)
         loss = (start_loss + end_loss) / 2
-        pred, _ = self.extract_spans(start_logits=start_logits, end_logits=end_logits, threshold=self.hparams.threshold)
+        pred, _ = self.extract_spans(start_logits=start_logits.detach(), 
+                                     end_logits=end_logits.detach(), 
+                                     threshold=self.hparams.threshold, 
+                                     max_span_width=self.hparams.max_span_width, 
+                                     top_k=self.hparams.top_k)
         true, _ = self.extract_spans(start_logits=start_tags, end_logits=end_tags, threshold=self.hparams.threshold)
         return loss, pred, true
-    
-    def extract_spans(self, start_logits: torch.Tensor, end_logits: torch.Tensor, threshold: float) -> Tuple[List[Set], List[List[Tuple]]]:
-        start_logits = start_logits.chunk(start_logits.shape[0])
-        end_logits = end_logits.chunk(end_logits.shape[0])
-        spans = []
-        batch_spans = []
-        batch_indices = []
-        for i in range(len(start_logits)):
-            starts = torch.where(start_logits[i].squeeze(0) > threshold)[0].tolist()
-            ends = torch.where(end_logits[i].squeeze(0) > threshold)[0].tolist()
-            length = min(len(starts), len(ends))
-            starts = starts[:length]
-            ends = ends[:length]
-            indices = set()
-            spans = []
-            for i in range(len(starts)):
-                start = starts[i]
-                end = ends[i]
-                if end >= start:
-                    spans.append((start, end+1))
-                    for j in range(start, end+1):
-                        indices.add(j)
-            batch_indices.append(indices)
-            batch_spans.append(spans)
+
+
+    def decode_spans(self, 
+                     start_logits: torch.Tensor, 
+                     end_logits: torch.Tensor, 
+                     threshold: float, 
+                     max_span_width: Optional[int] = None, 
+                     top_k: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """在设备上解码span: 每个大于阈值的起始位置与其后(包括自己)最近的大于阈值的结束位置组成span,分数为起始和结束分数之和
+        返回:
+        - spans: [num_spans, 4],每一行为(batch, 0, start, end),end为包含在span中的最后一个词符
+        - scores: [num_spans]
+        """
+        seq_len = start_logits.shape[-1]
+        positions = torch.arange(seq_len, device=start_logits.device)
+        end_positions = torch.where(end_logits > threshold, positions, seq_len)
+        # 从右往左的累积最小值即为每个位置之后最近的结束位置
+        ends = end_positions.flip(-1).cummin(dim=-1).values.flip(-1)
+        valid = (start_logits > threshold) & (ends < seq_len)
+        if max_span_width is not None:
+            valid = valid & (ends - positions < max_span_width)
+        scores = (start_logits + end_logits).float().masked_fill(~valid, float('-inf'))
+        return select_spans(scores.unsqueeze(1), positions, ends.unsqueeze(1), threshold=float('-inf'), top_k=top_k)
+
+
+    def extract_spans(self, 
+                      start_logits: torch.Tensor, 
+                      end_logits: torch.Tensor, 
+                      threshold: float, 
+                      max_span_width: Optional[int] = None, 
+                      top_k: Optional[int] = None) -> Tuple[List[Set], List[List[Tuple]]]:
+        """解码每个样本的span,返回每个样本span覆盖的词符下标集合以及左闭右开的span列表"""
+        spans, _ = self.decode_spans(start_logits, end_logits, threshold=threshold, max_span_width=max_span_width, top_k=top_k)
+        batch_indices = [set() for _ in range(start_logits.shape[0])]
+        batch_spans = [[] for _ in range(start_logits.shape[0])]
+        for i, _, start, end in spans.tolist():
+            batch_spans[i].append((start, end+1))
+            batch_indices[i].update(range(start, end+1))
         return batch_indices, batch_spans
             
             
@@ -120,21 +140,22 @@ class PointerForQuestionAnswering(PLMBaseModel):
                                 max_length=512,
                                 padding=True,
                                 truncation=True,
+                                return_offsets_mapping=True,
                                 return_tensors='pt')
+        offset_mapping = inputs.pop('offset_mapping')
         inputs.to(device)
         start_logits, end_logits = self(**inputs)
-        _, batch_spans = self.extract_spans(start_logits=start_logits, end_logits=end_logits, threshold=self.hparams.threshold)
-        align_batch_spans = []
-        for spans in batch_spans:
-            align_spans = []
-            for span in spans:
-                start = span[0]
-                end = span[-1] - 1
-                start_char_span= inputs.token_to_chars(start)
-                end_char_span = inputs.token_to_chars(end)
-                if start_char_span is not None and end_char_span is not None:
-                    align_spans.append((start_char_span.start, end_char_span.end))
-            align_batch_spans.append(align_spans)
+        spans, _ = self.decode_spans(start_logits=start_logits, 
+                                     end_logits=end_logits, 
+                                     threshold=self.hparams.threshold, 
+                                     max_span_width=self.hparams.max_span_width, 
+                                     top_k=self.hparams.top_k)
+        char_spans = align_token_spans(spans, offset_mapping).tolist()
+        align_batch_spans = [[] for _ in batch_text]
+        for i, (start, end) in zip(spans[:, 0].tolist(), char_spans):
+            # 特殊词符的字符下标为(0, 0)
+            if end > start:
+                align_batch_spans[i].append((start, end))
         return align_batch_spans
     
     
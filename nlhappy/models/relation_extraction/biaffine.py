@@ -6,6 +6,7 @@ import torch
 from torch import Tensor
 from typing import List, Set
 from ...utils.make_model import align_token_span, PLMBaseModel
+from ...data.sampler import pair_cost
 from typing import Optional
 
 
@@ -42,8 +43,12 @@ class BLinkerForEntityRelationExtraction(PLMBaseModel):
         
         
     def setup(self, stage: str) -> None:
-        self.trainer.datamodule.dataset['train'].set_transform(self.trainer.datamodule.sparse_combined_transform)
-        self.trainer.datamodule.dataset['validation'].set_transform(self.trainer.datamodule.combined_transform)
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.sparse_combined_transform, split='train')
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.combined_transform, split='validation')
+
+
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.id2combined) + 2 * len(self.hparams.id2rel)) # 实体标签,头对齐和尾对齐各len(id2rel)个标签
 
 
     def forward(self, input_ids, attention_mask=None):
@@ -6,6 +6,7 @@ import torch
 from torch import Tensor
 from typing import List, Set
 from ...utils.make_model import PLMBaseModel
+from ...data.sampler import pair_cost
 
 
 class GPLinkerForRelationExtraction(PLMBaseModel):
@@ -45,10 +46,14 @@ class GPLinkerForRelationExtraction(PLMBaseModel):
         
     def setup(self, stage: str = 'fit') -> None:
         if stage == 'fit':
-            self.trainer.datamodule.dataset['train'].set_transform(self.trainer.datamodule.sparse_triple_transform)
-            self.trainer.datamodule.dataset['validation'].set_transform(self.trainer.datamodule.triple_transform)
+            self.trainer.datamodule.set_transform(self.trainer.datamodule.sparse_triple_transform, split='train')
+            self.trainer.datamodule.set_transform(self.trainer.datamodule.triple_transform, split='validation')
     
 
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=2 + 2 * len(self.hparams.id2rel)) # 主语宾语2个标签,头对齐和尾对齐各len(id2rel)个标签
+
+
     def forward(self, input_ids, attention_mask=None):
         hidden_state = self.bert(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
         hidden_state = self.dropout(hidden_state)
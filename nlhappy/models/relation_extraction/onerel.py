@@ -1,6 +1,7 @@
 from ...utils.make_model import PLMBaseModel, align_token_span
 from ...layers.dropout import MultiDropout
 from ...metrics.triple import TripleF1, Triple
+from ...data.sampler import pair_cost
 import torch.nn as nn
 import torch
 
@@ -66,6 +67,10 @@ class OneRelForRelationExtraction(PLMBaseModel):
         self.test_metric = TripleF1()
 
         
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.label2id) * len(self.hparams.tag2id))
+
+
     def forward(self, input_ids, token_type_ids, attention_mask):
         x = self.plm(input_ids=input_ids, 
                      token_type_ids=token_type_ids, 
@@ -1,9 +1,11 @@
 import torch.nn as nn
 import torch
 from ...metrics.span import SpanF1
-from ...utils.make_model import PLMBaseModel
-from ...layers import MultiLabelCategoricalCrossEntropy, EfficientGlobalPointer, MultiDropout
+from ...utils.make_model import PLMBaseModel, align_token_spans
+from ...layers import MultiLabelCategoricalCrossEntropy, EfficientGlobalPointer, MultiDropout, extract_spans, dense_to_banded
 from ...tricks.adversarial_training import adversical_tricks
+from ...data.sampler import pair_cost
+from typing import Optional
 
 
 
@@ -16,6 +18,8 @@ class GlobalPointer(PLMBaseModel):
                  dropout: float=0.2,
                  threshold: float = 0.5,
                  adv: str =None,
+                 max_span_width: Optional[int] = None,
+                 top_k: Optional[int] = None,
                  **kwargs) : 
         super().__init__()
         ## 手动optimizer 可参考https://pytorch-lightning.readthedocs.io/en/stable/common/optimizers.html#manual-optimization
@@ -25,7 +29,8 @@ class GlobalPointer(PLMBaseModel):
         self.bert = self.get_plm_architecture()
         self.classifier = EfficientGlobalPointer(input_size=self.bert.config.hidden_size, 
                                                  hidden_size=hidden_size,
-                                                 output_size=len(self.hparams.label2id))
+                                                 output_size=len(self.hparams.label2id),
+                                                 max_span_width=max_span_width)
 
         self.dropout = MultiDropout()
         self.criterion = MultiLabelCategoricalCrossEntropy()
@@ -34,6 +39,10 @@ class GlobalPointer(PLMBaseModel):
         self.val_metric = SpanF1()
         self.test_metric = SpanF1()
 
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        return pair_cost(batch_size, max_length, num_labels=len(self.hparams.label2id), max_span_width=self.hparams.max_span_width)
+
+
     def forward(self, input_ids, token_type_ids, attention_mask=None):
         x = self.bert(input_ids=input_ids, token_type_ids=token_type_ids, attention_mask=attention_mask).last_hidden_state
         x = self.dropout(x)
@@ -49,12 +58,26 @@ class GlobalPointer(PLMBaseModel):
     def shared_step(self, batch):
         span_ids = batch['label_ids']
         logits = self(input_ids=batch['input_ids'], token_type_ids=batch['token_type_ids'], attention_mask=batch['attention_mask'])
-        pred = logits.ge(self.hparams.threshold).float()
         batch_size, ent_type_size = logits.shape[:2]
-        y_true = span_ids.reshape(batch_size*ent_type_size, -1)
+        # 带状的分数只计算宽度小于max_span_width的span
+        y_true = span_ids if self.hparams.max_span_width is None else dense_to_banded(span_ids, logits.shape[-1])
+        y_true = y_true.reshape(batch_size*ent_type_size, -1)
         y_pred = logits.reshape(batch_size*ent_type_size, -1)
         loss = self.criterion(y_pred, y_true)
-        return loss, pred, span_ids
+        pred = self.extract_spans(logits.detach())[0]
+        true = torch.nonzero(span_ids > 0)
+        return loss, pred, true
+
+
+    def extract_spans(self, logits: torch.Tensor, threshold: Optional[float] = None):
+        """按照模型的阈值,max_span_width和top_k解码span,返回[num_spans, 4]的(batch, label, start, end)和[num_spans]的分数"""
+        if threshold is None:
+            threshold = self.hparams.threshold
+        return extract_spans(logits, 
+                             threshold=threshold, 
+                             max_span_width=self.hparams.max_span_width, 
+                             top_k=self.hparams.top_k, 
+                             banded=self.hparams.max_span_width is not None)
 
 
     def training_step(self, batch, batch_idx):
@@ -124,25 +147,22 @@ class GlobalPointer(PLMBaseModel):
 
 
     def predict(self, text: str, device: str='cpu', threshold = None):
-        if threshold is None:
-            threshold = self.hparams.threshold
         inputs = self.tokenizer(
             text,
             add_special_tokens=True,
             max_length=self.hparams.max_length,
             truncation=True,
+            return_offsets_mapping=True,
             return_tensors='pt')
-        mapping = self.tokenizer(text,
-                                 add_special_tokens=True,
-                                 max_length=self.hparams.max_length,
-                                 truncation=True,)
+        offset_mapping = inputs.pop('offset_mapping')
         inputs.to(device)
         logits = self(**inputs)
-        spans_ls = torch.nonzero(logits>threshold).tolist()
+        span_ids, _ = self.extract_spans(logits, threshold=threshold)
+        char_spans = align_token_spans(span_ids, offset_mapping).tolist()
+        id2label = {i: label for label, i in self.hparams.label2id.items()}
         spans = []
-        for span in spans_ls :
-            start = span[2]
-            end = span[3]
-            span_text = text[start-1:end]
-            spans.append([start-1, end, self.hparams.id2label[span[1]], span_text])
+        for (start, end), label_id in zip(char_spans, span_ids[:, 1].tolist()):
+            if end <= start:
+                continue
+            spans.append([start, end, id2label[label_id], text[start:end]])
         return spans
\ No newline at end of file
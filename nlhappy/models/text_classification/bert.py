@@ -33,7 +33,7 @@ class BertForTextClassification(PLMBaseModel):
         self.test_f1 = F1Score(num_classes=len(self.hparams.id2label), average='macro', task='multiclass')
         
     def setup(self, stage: str):
-        self.trainer.datamodule.dataset.set_transform(self.trainer.datamodule.bert_transform)
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.bert_transform)
 
 
     def forward(self, input_ids, token_type_ids, attention_mask):
@@ -34,7 +34,7 @@ class BERTCrossEncoder(PLMBaseModel):
         return AutoModelForSequenceClassification.from_config(self.trf_config)
             
     def setup(self, stage: str) -> None:
-        self.trainer.datamodule.dataset.set_transform(self.trainer.datamodule.cross_transform)     
+        self.trainer.datamodule.set_transform(self.trainer.datamodule.cross_transform)
 
     def forward(self, input_ids, token_type_ids, attention_mask):
         x = self.plm(input_ids=input_ids, token_type_ids=token_type_ids, attention_mask=attention_mask)
@@ -1,5 +1,5 @@
 import pytorch_lightning as pl
-from ...layers import CRF, SimpleDense
+from ...layers import CRF, SimpleDense, get_bio_constraints
 from ...metrics.chunk import ChunkF1, get_entities
 from transformers import BertModel
 import torch.nn as nn
@@ -26,6 +26,8 @@ class BertCRF(pl.LightningModule):
             output_size=len(self.label2id))
 
         self.crf = CRF(len(self.label2id))
+        # 解码时禁止O后面接I-X等不合法的BIO序列
+        self.crf.set_constraints(*get_bio_constraints([self.id2label[i] for i in range(len(self.id2label))]))
 
         self.train_f1 = ChunkF1()
         self.val_f1 = ChunkF1()
@@ -1,12 +1,20 @@
 import os
+import shutil
+import tempfile
 from .utils import get_logger
-from typing import Union, List
-from torch.utils.data import DataLoader, BatchSampler, RandomSampler
-from datasets import load_from_disk, load_dataset, DatasetDict
+from typing import Union, List, Dict, Callable, Optional, Tuple
+from collections import Counter
+import torch
+from torch.utils.data import DataLoader
+from datasets import load_from_disk, load_dataset, DatasetDict, Dataset, IterableDatasetDict
+from datasets.fingerprint import Hasher
+from ..data.sampler import get_batch_sampler, get_token_lengths, token_cost, count_tokens, get_length_stats
+from ..data.stream import StreamingDataset, StreamingDataLoader, get_shard_files, SHARD_SUFFIXES
 from transformers import AutoConfig, AutoTokenizer, AutoModel, PreTrainedTokenizerFast
 from functools import lru_cache
 from pathlib import Path
 import numpy as np
+import srsly
 from lightning.pytorch import LightningDataModule
 from huggingface_hub import snapshot_download
 
@@ -14,6 +22,11 @@ from huggingface_hub import snapshot_download
 log = get_logger()
 
 
+# 预编码缓存的版本,修改encode函数调用的公共逻辑(encode_text, get_char_to_token_table, CharToTokenTable.align等)时需要加1,
+# 这些函数的改动不会反映在encode函数自身的代码中
+ENCODE_CACHE_VERSION = '1'
+
+
 def sequence_padding(inputs, length=None, value=0, seq_dims=1, mode='post'):
     """Numpy函数，将序列padding到同一长度
     """
@@ -41,6 +54,28 @@ def sequence_padding(inputs, length=None, value=0, seq_dims=1, mode='post'):
     return np.array(outputs)
 
 
+def sparse_span_padding(batch_coords: List[List[List[int]]], num_labels: int) -> np.ndarray:
+    """将每个样本的(标签, 开始, 结束)坐标列表转换为SparseMultiLabelCrossEntropy使用的稀疏标签
+    
+    参数:
+    - batch_coords: 每个样本的坐标列表
+    - num_labels: 标签数量
+    
+    返回:
+    - np.ndarray: [batch_size, num_labels, max_spans, 2], 每个标签的(开始, 结束)去重后升序排列,不足的部分用(0, 0)补齐
+    """
+    batch_tags = []
+    for coords in batch_coords:
+        tags = [set() for _ in range(num_labels)]
+        for label_id, start, end in coords:
+            tags[label_id].add((start, end))
+        for tag in tags:
+            if not tag:
+                tag.add((0,0))
+        batch_tags.append(sequence_padding([sorted(tag) for tag in tags]))
+    return sequence_padding(batch_tags, seq_dims=2)
+
+
 def char_idx_to_token(char_idx, offset_mapping):
     """
     将char级别的idx 转换为token级别的idx
@@ -55,6 +90,106 @@ def char_idx_to_token(char_idx, offset_mapping):
     return -1
         
         
+def get_char_to_token(offset_mapping, num_chars: int) -> np.ndarray:
+    """根据offset_mapping一次性生成字符下标到token下标的查找数组,没有对应token的字符(空格,截断的部分等)为-1
+    
+    例如:
+    offset_mapping = [(0, 0), (0, 1), (1, 2), (2, 4), (4, 5)]
+    返回 [1, 2, 3, 3, 4]
+    """
+    offsets = np.asarray(offset_mapping, dtype='int64').reshape(-1, 2)
+    offsets = np.minimum(offsets, num_chars)
+    span_lengths = np.maximum(offsets[:, 1] - offsets[:, 0], 0)
+    token_ids = np.repeat(np.arange(len(offsets)), span_lengths)
+    # 每个字符在所属token内的偏移
+    inner = np.arange(len(token_ids)) - np.repeat(np.cumsum(span_lengths) - span_lengths, span_lengths)
+    char_to_token = np.full(num_chars, -1, dtype='int64')
+    char_to_token[np.repeat(offsets[:, 0], span_lengths) + inner] = token_ids
+    return char_to_token
+
+
+class AlignCounter():
+    """按照名称统计字符下标对齐为token下标的总数和失败数量,代替逐条打印的日志
+    
+    说明:
+    - 每个名称第一次出现对齐失败时打印一次警告,之后只计数
+    - 多进程加载数据时每个进程分别计数
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.total = Counter()
+        self.failed = Counter()
+        
+    def update(self, name: str, aligned: np.ndarray) -> None:
+        num_failed = int(np.sum(~aligned))
+        if num_failed > 0 and self.failed[name] == 0:
+            log.warning(f'{name} align to token offset failed, the number of failures is counted in datamodule.align_counter')
+        self.total[name] += int(np.size(aligned))
+        self.failed[name] += num_failed
+        
+    def __repr__(self) -> str:
+        return ', '.join([f'{name}: {self.failed[name]}/{total} failed' for name, total in self.total.items()])
+    
+    def __str__(self) -> str:
+        return self.__repr__()
+        
+
+class CharToTokenTable():
+    """一个批次的字符下标到token下标的查找表,由offset_mapping一次性生成,所有标签坐标通过向量化的gather对齐
+    
+    参数:
+    - batch_offset_mapping: 每个样本的offset_mapping
+    - batch_num_chars (List[int]): 每个样本的字符数量
+    - batch_sequence_ids (Optional[List[List[Optional[int]]]]): 文本对时每个token所属的文本,即BatchEncoding.sequence_ids(i). 默认None
+    - sequence_index (int): 文本对时对齐第几个文本的字符下标. 默认0
+    - counter (Optional[AlignCounter]): 对齐失败的计数器. 默认None
+    
+    说明:
+    - table的shape为[batch_size, max_num_chars],没有对应token的字符(空格,截断的部分等)为-1
+    """
+    def __init__(self,
+                 batch_offset_mapping,
+                 batch_num_chars: List[int],
+                 batch_sequence_ids: Optional[List[List[Optional[int]]]] = None,
+                 sequence_index: int = 0,
+                 counter: Optional[AlignCounter] = None) -> None:
+        super().__init__()
+        self.counter = counter
+        tables = []
+        for i, num_chars in enumerate(batch_num_chars):
+            offsets = np.asarray(batch_offset_mapping[i], dtype='int64').reshape(-1, 2)
+            if batch_sequence_ids is not None:
+                # 不属于需要对齐文本的token不对应任何字符
+                in_sequence = np.asarray([s == sequence_index for s in batch_sequence_ids[i]])
+                offsets = np.where(in_sequence[:, None], offsets[:len(in_sequence)], 0)
+            tables.append(get_char_to_token(offsets, num_chars=num_chars))
+        self.table = sequence_padding(tables, length=max(max(batch_num_chars, default=0), 1), value=-1)
+        
+    def gather(self, batch_index, char_index) -> np.ndarray:
+        """获取字符对应的token下标,batch_index和char_index可以是整数或者可以广播的数组,越界的字符为-1"""
+        batch_index, char_index = np.broadcast_arrays(np.asarray(batch_index, dtype='int64'), np.asarray(char_index, dtype='int64'))
+        valid = (char_index >= 0) & (char_index < self.table.shape[1])
+        return np.where(valid, self.table[batch_index, np.where(valid, char_index, 0)], -1)
+    
+    def align(self, name: str, batch_index, char_index) -> Tuple[np.ndarray, np.ndarray]:
+        """对齐并统计失败数量
+        
+        参数:
+        - name: 计数的名称,例如entity, subject
+        - batch_index: 样本下标
+        - char_index: [..., k]字符下标,最后一维的k个字符全部对齐才算成功,例如(开始, 结束)
+        
+        返回:
+        - token_index: 与char_index形状一致的token下标
+        - aligned: [...]是否对齐成功
+        """
+        token_index = self.gather(batch_index, char_index)
+        aligned = (token_index >= 0).all(axis=-1)
+        if self.counter is not None:
+            self.counter.update(name, aligned)
+        return token_index, aligned
+
+
 def align_char_span(char_span_offset: tuple, 
                     token_offset_mapping, 
                     special_offset=(0,0),
@@ -187,12 +322,26 @@ class PLMBaseDataModule(LightningDataModule):
     """数据模块的基类,子类需要完成setup方法,子类初始化的时候至少包含dataset,plm,batch_size参数,
     内置功能:
     - 自动保存超参数
-    - 不同策略自动获取最大文本长度,超过512则取512
+    - 不同策略自动获取最大文本长度,超过plm_max_length则取plm_max_length
+    - token长度: 第一次使用时用num_proc个进程批量分词,每个样本的token数量作为length字段缓存到dataset_dir/.cache,
+      auto_length(max,mean,p95等),按长度分桶和token_budget的代价计算都读取这个字段,不需要重新分词,
+      token数量为text_columns中所有输入模型的文本字段之和,问题,提示和文本对等数据模块需要在子类中声明
     - 下载数据集和预训练模型
     - 自动读取tokenizer
     - 自动读取数据集
     - 自动设置dataloader,数据集需要切分为train,validation,test
+    - 预编码: pre_encode为True时,通过register_encoded_transform登记的transform会在第一次使用时
+      用num_proc个进程将整个数据集编码(input_ids,offset_mapping,稀疏标签坐标)并缓存到dataset_dir/.cache,
+      之后每个批次只需要补齐,相同tokenizer,数据集,encode函数和标签的后续训练直接读取缓存
+    - 批次采样: sampler为'random'时随机组成批次,为'bucket'时按照token长度分桶,长度相近的样本组成一个批次,
+      bucket_size为每个桶的批次数量,为'token_budget'时每个批次的计算代价不超过max_cost,代价函数由模型的get_batch_cost声明
+    - 流式读取: streaming为True时dataset_dir/dataset/{train,validation,test}下的arrow,parquet或者jsonl分片按顺序流式读取,
+      数据集不需要放到本地的arrow缓存或者内存中,分片在多卡的rank和dataloader的worker之间确定性地切分,
+      训练集用大小为shuffle_buffer_size的缓冲区打乱,同样支持bucket和token_budget采样,见nlhappy.data.stream.StreamingDataset
     """
+    # 输入模型的文本字段,用于计算token长度
+    text_columns: List[str] = ['text']
+    
     def __init__(self,
                  auto_length: Union[str, int] = 'max',
                  plm_dir: str = 'plms',
@@ -202,10 +351,28 @@ class PLMBaseDataModule(LightningDataModule):
                  pin_memory: bool = False,
                  shuffle_train: bool = False,
                  shuffle_val: bool = False,
-                 shuffle_test: bool = False):
+                 shuffle_test: bool = False,
+                 pre_encode: bool = False,
+                 num_proc: Optional[int] = None,
+                 sampler: str = 'random',
+                 bucket_size: int = 100,
+                 max_cost: Optional[int] = None,
+                 streaming: bool = False,
+                 shuffle_buffer_size: int = 10000):
         super().__init__()
         self.save_hyperparameters()
         self.transforms = {}
+        self.encoded_transforms = {}
+        self.encoded_datasets = {}
+        self.stream_transforms = {}
+        self.align_counter = AlignCounter()
+
+
+    def __getstate__(self) -> Dict:
+        # 多进程编码时会序列化encode函数所在的datamodule,不需要序列化trainer
+        state = self.__dict__.copy()
+        state['trainer'] = None
+        return state
     
     
     def prepare_data(self) -> None:
@@ -216,8 +383,12 @@ class PLMBaseDataModule(LightningDataModule):
     
     @property
     @lru_cache()
-    def dataset(self) -> DatasetDict:
+    def dataset(self) -> Union[DatasetDict, IterableDatasetDict]:
         dataset_path = Path(self.hparams.dataset_dir, self.hparams.dataset)
+        if self.hparams.streaming:
+            data_files = {split: self.get_shard_files(split) for split in ['train', 'validation', 'test'] if Path(dataset_path, split).exists()}
+            builder = SHARD_SUFFIXES[Path(data_files['train'][0]).suffix]
+            return load_dataset(builder, data_files=data_files, streaming=True)
         if dataset_path.exists():  
             dsd = load_from_disk(str(dataset_path))
         else:
@@ -247,27 +418,254 @@ class PLMBaseDataModule(LightningDataModule):
     def get_available_transforms(self):
         return self.transforms.keys()
     
+    
+    def register_encoded_transform(self, transform: Callable, encode: Callable, collate: Callable) -> None:
+        """登记可以预编码的transform,要求transform(examples)与collate(encode(examples))等价
+
+        Args:
+            transform (Callable): 数据集的transform,例如self.tp_transform
+            encode (Callable): 批量编码函数,返回的每一列都是可以存储为arrow的列表,例如input_ids,offset_mapping,稀疏的标签坐标
+            collate (Callable): 将一个批次的编码结果补齐并转换为tensor
+        """
+        self.encoded_transforms[transform.__name__] = (encode, collate)
+        
+        
+    def set_transform(self, transform: Callable, split: Optional[str] = None) -> None:
+        """为数据集设置transform,开启pre_encode并且transform已经登记时使用预编码的数据集
+
+        Args:
+            transform (Callable): 数据集的transform
+            split (Optional[str], optional): 数据集切分,为None时设置所有切分. Defaults to None.
+        """
+        splits = [split] if split is not None else list(self.dataset.keys())
+        for split in splits:
+            if self.hparams.streaming:
+                self.stream_transforms[split] = transform
+            elif self.hparams.pre_encode and transform.__name__ in self.encoded_transforms:
+                encode, collate = self.encoded_transforms[transform.__name__]
+                encoded = self.encode_dataset(split=split, encode=encode)
+                encoded.set_transform(collate)
+                self.encoded_datasets[split] = encoded
+            else:
+                self.encoded_datasets.pop(split, None)
+                self.dataset[split].set_transform(transform)
+                
+                
+    def get_split_dataset(self, split: str) -> Dataset:
+        """获取用于dataloader的数据集,有预编码的数据集时优先使用预编码的数据集
+        """
+        if split in self.encoded_datasets:
+            return self.encoded_datasets[split]
+        return self.dataset[split]
+    
+    
+    def get_cache_dir(self) -> Path:
+        return Path(self.hparams.dataset_dir, '.cache', self.hparams.dataset)
+    
+    
+    def get_shard_files(self, split: str) -> List[str]:
+        """流式读取时数据集切分的所有分片文件"""
+        return get_shard_files(Path(self.hparams.dataset_dir, self.hparams.dataset, split))
+    
+    
+    def get_dataset_fingerprint(self, split: str) -> str:
+        """数据集切分的指纹,流式读取时由分片文件的路径,大小和修改时间决定"""
+        if self.hparams.streaming:
+            return Hasher.hash([(f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in self.get_shard_files(split)])
+        return self.dataset[split]._fingerprint
+    
+    
+    def get_encode_fingerprint(self, split: str, encode: Callable) -> str:
+        """预编码缓存的指纹,由以下内容共同决定
+        - ENCODE_CACHE_VERSION,encode函数调用的公共逻辑改变时加1
+        - tokenizer的名称,词表和配置
+        - 数据集
+        - encode函数的代码
+        - 最大长度(plm_max_length和max_length)
+        - 标签词表(hparams中的id2*和*2id)
+        """
+        func = getattr(encode, '__func__', encode)
+        label_maps = {k: v for k, v in self.hparams.items() if k.startswith('id2') or k.endswith('2id')}
+        vocab = sorted(self.tokenizer.get_vocab().items(), key=lambda item: item[1])
+        return Hasher.hash([ENCODE_CACHE_VERSION,
+                            self.hparams.plm,
+                            Hasher.hash(vocab),
+                            Hasher.hash(self.tokenizer),
+                            self.get_dataset_fingerprint(split),
+                            func.__qualname__,
+                            func.__code__.co_code,
+                            func.__code__.co_consts,
+                            self.hparams.plm_max_length,
+                            self.hparams.get('max_length'),
+                            label_maps])
+    
+    
+    def map_to_cache(self, dataset: Dataset, function: Callable, cache_path: Path, fingerprint: str, desc: str, **map_kwargs) -> Dataset:
+        """用num_proc个进程对数据集批量map,结果只保留function返回的字段,保存到cache_path,缓存存在时直接读取
+        """
+        if not cache_path.exists():
+            log.info(f'{desc} into {cache_path}')
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            dataset = dataset.with_format(None)
+            tmp_path = cache_path.with_name(f'{cache_path.name}.tmp{os.getpid()}')
+            with tempfile.TemporaryDirectory(dir=cache_path.parent) as tmp_dir:
+                mapped = dataset.map(function,
+                                     batched=True,
+                                     num_proc=self.hparams.num_proc,
+                                     remove_columns=dataset.column_names,
+                                     cache_file_name=os.path.join(tmp_dir, 'mapped.arrow'),
+                                     new_fingerprint=fingerprint,
+                                     desc=desc,
+                                     **map_kwargs)
+                mapped.save_to_disk(str(tmp_path))
+            try:
+                os.rename(tmp_path, cache_path)
+            except OSError:
+                # 其他进程已经写入了相同的缓存
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return load_from_disk(str(cache_path))
+    
+    
+    def encode_dataset(self, split: str, encode: Callable) -> Dataset:
+        """用num_proc个进程编码数据集并保存到缓存目录,缓存存在时直接读取
+
+        Args:
+            split (str): 数据集切分
+            encode (Callable): 批量编码函数
+
+        Returns:
+            Dataset: 预编码的数据集
+        """
+        fingerprint = self.get_encode_fingerprint(split=split, encode=encode)
+        cache_path = Path(self.get_cache_dir(), 'encoded', f'{split}-{encode.__name__}-{fingerprint}')
+        return self.map_to_cache(self.dataset[split], encode, cache_path=cache_path, fingerprint=fingerprint, desc=f'encode {split}')
+    
+    
+    def get_length_dataset(self, split: str) -> Dataset:
+        """数据集每个样本的token数量(不含特殊token,不截断),为text_columns中所有文本字段的token数量之和,
+        保存为只有length字段的数据集,与原数据集按下标对齐,
+        用fast tokenizer批量分词并用num_proc个进程计算,相同tokenizer和数据集直接读取缓存
+
+        Args:
+            split (str): 数据集切分
+        """
+        assert not self.hparams.streaming, 'length column is not cached in streaming mode'
+        dataset = self.dataset[split]
+        if 'length' in dataset.column_names:
+            return dataset.select_columns(['length'])
+        for column in self.text_columns:
+            assert column in dataset.column_names, f'dataset has no {column} or length column'
+        fingerprint = Hasher.hash([Hasher.hash(self.tokenizer), dataset._fingerprint, self.text_columns])
+        cache_path = Path(self.get_cache_dir(), 'lengths', f'{split}-{"-".join(self.text_columns)}-{fingerprint}')
+        return self.map_to_cache(dataset,
+                                 count_tokens,
+                                 cache_path=cache_path,
+                                 fingerprint=fingerprint,
+                                 desc=f'count tokens of {split}',
+                                 input_columns=self.text_columns,
+                                 fn_kwargs={'tokenizer': self.tokenizer})
+    
+    
+    @lru_cache()
+    def get_length_stats(self, split: str = 'train', num_stream_examples: int = 10000) -> Dict[str, float]:
+        """数据集token数量(不含特殊token)的统计信息: num_examples, max, mean, p50, p90, p95, p99,
+        流式读取时由前num_stream_examples个样本估计
+        """
+        if self.hparams.streaming:
+            examples = list(self.dataset[split].select_columns(self.text_columns).take(num_stream_examples))
+            lengths = count_tokens(*[[e[column] for e in examples] for column in self.text_columns], tokenizer=self.tokenizer)['length']
+        else:
+            lengths = self.get_length_dataset(split).with_format('numpy')[:]['length']
+        stats = get_length_stats(lengths)
+        log.info(f'{split} token length stats: {stats}')
+        return stats
+    
+    
+    def get_label_vocab(self, name: str, compute: Callable[[Dataset], List], split: str = 'train') -> List:
+        """获取标签词表,结果以json保存在数据集缓存目录中,数据集不变时直接读取,不需要重新遍历数据集
+
+        Args:
+            name (str): 词表名称,例如ent_labels
+            compute (Callable[[Dataset], List]): 根据数据集计算词表的函数,一般基于nlhappy.data.label中的流式统计函数
+            split (str, optional): 数据集切分. Defaults to 'train'.
+
+        Returns:
+            List: 标签词表,元组形式的标签保存为json列表后会还原为元组
+        """
+        dataset = self.dataset[split]
+        fingerprint = Hasher.hash([self.get_dataset_fingerprint(split), compute.__qualname__])
+        cache_path = Path(self.get_cache_dir(), 'labels', f'{split}-{name}-{fingerprint}.json')
+        if cache_path.exists():
+            return [tuple(label) if isinstance(label, list) else label for label in srsly.read_json(cache_path)]
+        labels = compute(dataset)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f'{cache_path.name}.tmp{os.getpid()}')
+        srsly.write_json(tmp_path, labels)
+        os.replace(tmp_path, cache_path)
+        return labels
+    
+    
+    def encode_text(self, batch_text: List[str]):
+        """批量编码文本,不补齐,超过预训练模型最大长度的部分截断,一般用于encode函数中
+        """
+        return self.tokenizer(batch_text,
+                              truncation=True,
+                              max_length=self.hparams.plm_max_length,
+                              return_token_type_ids=False,
+                              return_offsets_mapping=True)
+    
+    
+    def get_char_to_token_table(self, batch_inputs, batch_text: List[str], sequence_index: Optional[int] = None) -> CharToTokenTable:
+        """根据批量编码的结果生成字符下标到token下标的查找表,对齐失败的数量记录在self.align_counter中
+
+        Args:
+            batch_inputs (BatchEncoding): 带有offset_mapping的批量编码结果
+            batch_text (List[str]): 需要对齐的文本
+            sequence_index (Optional[int], optional): 文本对时对齐第几个文本,例如问答中的文本为1. Defaults to None.
+        """
+        batch_sequence_ids = None
+        if sequence_index is not None:
+            batch_sequence_ids = [batch_inputs.sequence_ids(i) for i in range(len(batch_text))]
+        return CharToTokenTable(batch_offset_mapping=batch_inputs['offset_mapping'],
+                                batch_num_chars=[len(text) for text in batch_text],
+                                batch_sequence_ids=batch_sequence_ids,
+                                sequence_index=sequence_index or 0,
+                                counter=self.align_counter)
+    
+    
+    def pad_inputs(self, batch_input_ids: List[List[int]], return_token_type_ids: bool = False) -> Dict[str, torch.Tensor]:
+        """将一个批次的input_ids补齐到最大长度并生成attention_mask,一般用于collate函数中
+        """
+        input_ids = sequence_padding([np.array(ids, dtype='int64') for ids in batch_input_ids], value=self.tokenizer.pad_token_id)
+        attention_mask = sequence_padding([np.ones(len(ids), dtype='int64') for ids in batch_input_ids])
+        inputs = {'input_ids': torch.from_numpy(input_ids), 'attention_mask': torch.from_numpy(attention_mask)}
+        if return_token_type_ids:
+            inputs['token_type_ids'] = torch.zeros_like(inputs['input_ids'])
+        return inputs
+    
         
     @lru_cache()
     def get_max_length(self):
-        """根据auto_length参数自动获取最大token的长度
+        """根据auto_length参数自动获取最大token的长度(不含特殊token),由训练集的length统计得到,不会大于预训练模型的最大输入长度
+        - 'max': 最大长度
+        - 'mean': 平均长度
+        - 'p95'等: 百分位数,可选p50, p90, p95, p99
+        - 大于0的整数: 直接使用
         
         Returns:
             int: 最大token长度
         """
-        length = self.train_df.text.map(lambda x: len(self.tokenizer.tokenize(x)))
-        if self.hparams.auto_length == 'max':
-            max_length = length.max()
-        if self.hparams.auto_length == 'mean':
-            max_length = int(length.mean())
         if type(self.hparams.auto_length) == int:
             assert self.hparams.auto_length >0, 'max_length length  must > 0'
-            max_length = self.hparams.auto_length
-        return max_length
+            return self.hparams.auto_length
+        stats = self.get_length_stats('train')
+        assert self.hparams.auto_length in stats and self.hparams.auto_length != 'num_examples', f'auto_length must be int or one of max, mean, p50, p90, p95, p99, but found {self.hparams.auto_length}'
+        max_length = int(stats[self.hparams.auto_length])
+        return min(max_length, self.hparams.plm_max_length)
     
     
     def get_batch_max_length(self, batch_text: List[str]) -> int:
-        """获取一个batch的最大token长度,不会大于预训练模型的最大输入长度,一般用于dataset的transform中
+        """获取一个batch的最大token长度,不会大于预训练模型的最大输入长度
 
         Args:
             batch_text (List[str]): 一个批次的文本
@@ -275,11 +673,31 @@ class PLMBaseDataModule(LightningDataModule):
         Returns:
             int: 最大文本长度
         """
-        max_length = max([len(self.tokenizer.encode(t)) for t in batch_text]) # 获取最大token序列的长度
+        batch_input_ids = self.tokenizer(batch_text, return_attention_mask=False, return_token_type_ids=False)['input_ids'] # 一次批量获取所有token序列
+        max_length = max([len(ids) for ids in batch_input_ids])
         max_length = min([self.hparams.plm_max_length, max_length])
         return max_length
     
     
+    def tokenize_batch(self, batch_text: List[str], batch_text_pair: Optional[List[str]] = None, truncation: Union[bool, str] = True, **kwargs):
+        """一个批次只用fast tokenizer批量编码一次,超过预训练模型最大输入长度的部分截断,再补齐到批次内的最大长度,
+        批次最大长度即为input_ids.shape[1],一般用于dataset的transform中
+
+        Args:
+            batch_text (List[str]): 一个批次的文本
+            batch_text_pair (Optional[List[str]], optional): 文本对的第二个文本. Defaults to None.
+            truncation (Union[bool, str], optional): 截断策略,文本对可以用'only_second'只截断第二个文本. Defaults to True.
+            **kwargs: tokenizer的其他参数,例如return_offsets_mapping, return_token_type_ids
+        """
+        return self.tokenizer(batch_text,
+                              batch_text_pair,
+                              padding=True,
+                              truncation=truncation,
+                              max_length=self.hparams.plm_max_length,
+                              return_tensors='pt',
+                              **kwargs)
+    
+    
     @property
     @lru_cache()
     def train_df(self):
@@ -295,29 +713,87 @@ class PLMBaseDataModule(LightningDataModule):
     def test_df(self):
         return self.dataset['test'].to_pandas()
     
+    def get_lengths(self, split: str) -> np.ndarray:
+        """每个样本截断后的token数量(含特殊token),用于按照长度分桶和计算批次代价,
+        预编码的数据集直接使用input_ids的长度,否则读取缓存的length字段,不需要重新分词
+        """
+        dataset = self.get_split_dataset(split)
+        if 'input_ids' in dataset.column_names:
+            return get_token_lengths(dataset, tokenizer=self.tokenizer, max_length=self.hparams.plm_max_length)
+        lengths = self.get_length_dataset(split).with_format('numpy')[:]['length'].astype('int64')
+        num_special_tokens = self.tokenizer.num_special_tokens_to_add(pair=len(self.text_columns) > 1)
+        return np.minimum(lengths + num_special_tokens, self.hparams.plm_max_length)
+    
+    def get_batch_cost_fn(self) -> Callable[[int, int], int]:
+        """token_budget采样的代价函数,由模型的get_batch_cost声明,没有模型时按照token数量计算
+        """
+        model = self.trainer.lightning_module if self.trainer is not None else None
+        return getattr(model, 'get_batch_cost', token_cost)
+    
+    def get_streaming_dataloader(self, split: str, shuffle: bool = True) -> StreamingDataLoader:
+        """流式读取的dataloader,需要先通过set_transform设置这个切分的transform
+        """
+        assert split in self.stream_transforms, f'streaming {split} dataset needs a transform, call set_transform first'
+        trainer = self.trainer
+        dataset = StreamingDataset(files=self.get_shard_files(split),
+                                   transform=self.stream_transforms[split],
+                                   batch_size=self.hparams.batch_size,
+                                   sampler=self.hparams.sampler,
+                                   shuffle=shuffle,
+                                   shuffle_buffer_size=self.hparams.shuffle_buffer_size,
+                                   bucket_size=self.hparams.bucket_size,
+                                   max_cost=self.hparams.max_cost,
+                                   cost_fn=self.get_batch_cost_fn(),
+                                   tokenizer=self.tokenizer,
+                                   text_column=self.text_columns,
+                                   max_length=self.hparams.plm_max_length,
+                                   rank=trainer.global_rank if trainer is not None else None,
+                                   world_size=trainer.world_size if trainer is not None else None)
+        return StreamingDataLoader(dataset=dataset,
+                                   num_workers=self.hparams.num_workers,
+                                   pin_memory=self.hparams.pin_memory)
+    
+    def get_batch_sampler(self, split: str, shuffle: bool = True):
+        lengths = self.get_lengths(split) if self.hparams.sampler in ['bucket', 'token_budget'] else None
+        return get_batch_sampler(self.get_split_dataset(split),
+                                 batch_size=self.hparams.batch_size,
+                                 sampler=self.hparams.sampler,
+                                 lengths=lengths,
+                                 shuffle=shuffle,
+                                 drop_last=False,
+                                 bucket_size=self.hparams.bucket_size,
+                                 max_cost=self.hparams.max_cost,
+                                 cost_fn=self.get_batch_cost_fn())
+    
     def train_dataloader(self):
-        return DataLoader(dataset= self.dataset['train'], 
+        if self.hparams.streaming:
+            return self.get_streaming_dataloader('train')
+        return DataLoader(dataset= self.get_split_dataset('train'), 
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_train,
                           batch_size=None,
-                          sampler=BatchSampler(RandomSampler(self.dataset['train']), batch_size=self.hparams.batch_size, drop_last=False))
+                          sampler=self.get_batch_sampler('train'))
     
     def val_dataloader(self):
-        return DataLoader(dataset=self.dataset['validation'], 
+        if self.hparams.streaming:
+            return self.get_streaming_dataloader('validation', shuffle=False)
+        return DataLoader(dataset=self.get_split_dataset('validation'), 
                           batch_size=None, 
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_val,
-                          sampler=BatchSampler(RandomSampler(self.dataset['validation']), batch_size=self.hparams.batch_size, drop_last=False))
+                          sampler=self.get_batch_sampler('validation', shuffle=False))
 
     def test_dataloader(self):
-        return DataLoader(dataset=self.dataset['test'], 
+        if self.hparams.streaming:
+            return self.get_streaming_dataloader('test', shuffle=False)
+        return DataLoader(dataset=self.get_split_dataset('test'), 
                           batch_size=None, 
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_test,
-                          sampler=BatchSampler(RandomSampler(self.dataset['test']), batch_size=self.hparams.batch_size, drop_last=False))
+                          sampler=self.get_batch_sampler('test', shuffle=False))
 
 
 class BaseDataModule(LightningDataModule):
@@ -327,7 +803,10 @@ class BaseDataModule(LightningDataModule):
                  shuffle_train: bool = False,
                  shuffle_val: bool = False,
                  shuffle_test: bool = False,
-                 drop_last: bool = False):
+                 drop_last: bool = False,
+                 sampler: str = 'random',
+                 bucket_size: int = 100,
+                 max_cost: Optional[int] = None):
         super().__init__()
         self.save_hyperparameters()
         assert 'batch_size' in self.hparams and 'dataset_path' in self.hparams and 'tokenizer_path' in self.hparams, '子类至少需要传入dataset_path, tokenizer_path, batch_size参数'
@@ -361,13 +840,28 @@ class BaseDataModule(LightningDataModule):
     def test_df(self):
         return self.dataset['test'].to_pandas()
     
+    def get_batch_sampler(self, split: str, shuffle: bool = True):
+        """sampler为'bucket'或者'token_budget'时需要每个样本的token长度,数据集有length字段时直接使用
+        """
+        lengths = get_token_lengths(self.dataset[split], tokenizer=self.tokenizer) if self.hparams.sampler in ['bucket', 'token_budget'] else None
+        model = self.trainer.lightning_module if self.trainer is not None else None
+        return get_batch_sampler(self.dataset[split],
+                                 batch_size=self.hparams.batch_size,
+                                 sampler=self.hparams.sampler,
+                                 lengths=lengths,
+                                 shuffle=shuffle,
+                                 drop_last=self.hparams.drop_last,
+                                 bucket_size=self.hparams.bucket_size,
+                                 max_cost=self.hparams.max_cost,
+                                 cost_fn=getattr(model, 'get_batch_cost', token_cost))
+    
     def train_dataloader(self):
         return DataLoader(dataset= self.dataset['train'], 
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_train,
                           batch_size=None,
-                          sampler=BatchSampler(RandomSampler(self.dataset['train']), batch_size=self.hparams.batch_size, drop_last=self.hparams.drop_last))
+                          sampler=self.get_batch_sampler('train'))
     
     def val_dataloader(self):
         return DataLoader(dataset=self.dataset['validation'], 
@@ -375,7 +869,7 @@ class BaseDataModule(LightningDataModule):
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_val,
-                          sampler=BatchSampler(RandomSampler(self.dataset['validation']), batch_size=self.hparams.batch_size, drop_last=self.hparams.drop_last))
+                          sampler=self.get_batch_sampler('validation', shuffle=False))
 
     def test_dataloader(self):
         return DataLoader(dataset=self.dataset['test'], 
@@ -383,4 +877,4 @@ class BaseDataModule(LightningDataModule):
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_test,
-                          sampler=BatchSampler(RandomSampler(self.dataset['test']), batch_size=self.hparams.batch_size, drop_last=self.hparams.drop_last))
\ No newline at end of file
+                          sampler=self.get_batch_sampler('test', shuffle=False))
\ No newline at end of file
@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import Dict, Tuple, Union, List
+from typing import Dict, Tuple, Union, List, Optional
 import os
 from transformers import AutoTokenizer, AutoConfig, AutoModel, BertModel, BertConfig
 from transformers.optimization import get_linear_schedule_with_warmup, get_cosine_schedule_with_warmup
@@ -9,8 +9,9 @@ import tempfile
 import json
 from omegaconf import OmegaConf, DictConfig
 from pathlib import Path
-from torch.utils.data import DataLoader, BatchSampler, RandomSampler
+from torch.utils.data import DataLoader
 from datasets import load_from_disk, load_dataset
+from ..data.sampler import get_batch_sampler, get_token_lengths, token_cost
 from torch.optim.lr_scheduler import CyclicLR
 
 
@@ -66,12 +67,32 @@ def align_token_span(token_span_offset: Tuple, token_offset_mapping: List[Tuple]
         end = token_offset_mapping[token_span_offset[1]-1][1]
         char_span_offset = (start, end)
         return char_span_offset
-    
+
+
+def align_token_spans(spans: torch.Tensor, offset_mapping: torch.Tensor) -> torch.Tensor:
+    '''一次性将批次中所有词符级别的span对齐为字符级别的下标
+    参数
+    - spans: [num_spans, 4],每一行为(batch, label, start, end),start和end都是包含在span中的词符下标,即extract_spans的输出
+    - offset_mapping: [batch_size, seq_len, 2],分词器返回的每个词符对应的字符下标
+    返回
+    char_spans: [num_spans, 2],左闭右开的字符下标
+    '''
+    offset_mapping = torch.as_tensor(offset_mapping, device=spans.device)
+    start = offset_mapping[spans[:, 0], spans[:, 2], 0]
+    end = offset_mapping[spans[:, 0], spans[:, 3], 1]
+    return torch.stack([start, end], dim=-1)
+
 class BaseModel(LightningModule):
     """最基础的模型类,配置了
     """
     scheduler_names = ['linear_warmup', 'cosine_warmup', 'harmonic', 'cycle']
     
+    def get_batch_cost(self, batch_size: int, max_length: int) -> int:
+        """一个批次的计算代价,用于token_budget批次采样,默认为补齐后的token数量,
+        对所有token对打分的模型需要重写为pair_cost
+        """
+        return token_cost(batch_size, max_length)
+    
     def get_linear_warmup_step_scheduler_config(self, optimizer) -> Dict:
         total_steps = self.get_total_steps()
         warmup_steps = self.get_one_epoch_steps() // 3
@@ -128,12 +149,13 @@ class BaseModel(LightningModule):
     
     
     
-class PLMBaseModel(LightningModule):
+class PLMBaseModel(BaseModel):
     """基于预训练语言模型的基类,在继承类的时候需要传入plm和plm_dir
     
     - 内置了scheduler,可以通过cls.scheduler_names查看所有的scheduler,通过self.get_scheduler_config方法得到pl的scheduler config
     - 通过self.tokenizer直接调用tokenizer
     - 通过self.get_plm_architecture可以得到没有加载参数的预训练模型的架构
+    - 继承BaseModel的get_batch_cost,对所有token对打分的模型重写为pair_cost,用于token_budget批次采样
     """
     
     scheduler_names = ['linear_warmup', 'cosine_warmup', 'harmonic', 'cycle']
@@ -266,7 +288,10 @@ class HFPretrainedModel(BaseModel):
                  drop_last_batch: bool = False,
                  shuffle_train: bool = False,
                  shuffle_val: bool = False,
-                 shuffle_test: bool = False):
+                 shuffle_test: bool = False,
+                 sampler: str = 'random',
+                 bucket_size: int = 100,
+                 max_cost: Optional[int] = None):
         super().__init__()
         # 保存所有参数
         self.save_hyperparameters()
@@ -363,13 +388,27 @@ class HFPretrainedModel(BaseModel):
     def test_df(self):
         return self.dataset['test'].to_pandas()
     
+    def get_batch_sampler(self, split: str, shuffle: bool = True):
+        """sampler为'bucket'或者'token_budget'时需要每个样本的token长度,数据集有length字段时直接使用
+        """
+        lengths = get_token_lengths(self.dataset[split], tokenizer=self.tokenizer, max_length=self.hparams.plm_max_length) if self.hparams.sampler in ['bucket', 'token_budget'] else None
+        return get_batch_sampler(self.dataset[split],
+                                 batch_size=self.hparams.batch_size,
+                                 sampler=self.hparams.sampler,
+                                 lengths=lengths,
+                                 shuffle=shuffle,
+                                 drop_last=self.hparams.drop_last_batch,
+                                 bucket_size=self.hparams.bucket_size,
+                                 max_cost=self.hparams.max_cost,
+                                 cost_fn=self.get_batch_cost)
+    
     def train_dataloader(self):
         return DataLoader(dataset= self.dataset['train'], 
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_train,
                           batch_size=None,
-                          sampler=BatchSampler(RandomSampler(self.dataset['train']), batch_size=self.hparams.batch_size, drop_last=self.hparams.drop_last_batch))
+                          sampler=self.get_batch_sampler('train'))
     
     def val_dataloader(self):
         return DataLoader(dataset=self.dataset['validation'], 
@@ -377,7 +416,7 @@ class HFPretrainedModel(BaseModel):
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_val,
-                          sampler=BatchSampler(RandomSampler(self.dataset['validation']), batch_size=self.hparams.batch_size, drop_last=self.hparams.drop_last_batch))
+                          sampler=self.get_batch_sampler('validation', shuffle=False))
 
     def test_dataloader(self):
         return DataLoader(dataset=self.dataset['test'], 
@@ -385,7 +424,7 @@ class HFPretrainedModel(BaseModel):
                           num_workers=self.hparams.num_workers, 
                           pin_memory=self.hparams.pin_memory,
                           shuffle=self.hparams.shuffle_test,
-                          sampler=BatchSampler(RandomSampler(self.dataset['test']), batch_size=self.hparams.batch_size, drop_last=self.hparams.drop_last_batch))
+                          sampler=self.get_batch_sampler('test', shuffle=False))
 
 
 
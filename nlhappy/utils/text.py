@@ -1,5 +1,5 @@
 import torch
-from typing import List
+from typing import List, Tuple
 import numpy as np
 import unicodedata
 from torch.nn.utils.rnn import pad_sequence
@@ -225,4 +225,42 @@ def split_sentence(text: str, best: bool =True):
             continue
         for sentence in sents:
             sentence = _replace_with_separator(sentence.group(), r" ", [_UNDO_AB_SENIOR, _UNDO_AB_ACRONYM])
-            yield sentence
\ No newline at end of file
+            yield sentence
+
+_RE_SENTENCE_END = re.compile(r'[。！？?]+[”’](?=[^，。！？?])|[。！？?]+(?=[^”’])|\.{6,}(?=[^”’])|…{2,}(?=[^”’])|\n')
+
+
+def split_sentence_offsets(text: str) -> List[Tuple[int, int]]:
+    """单次扫描将文本切分为句子,返回每个句子在原文中的(start, end)下标,end不包含在内
+
+    说明:
+    - 句末标点,引号和换行的规则参考split_sentence(best=False),在常规文本上结果相同,但是有以下不同:
+      - 连续的句末标点(例如"？！","。。")视为一个句末,split_sentence会在其中切分,
+        并且由于re.sub的匹配不重叠,切分位置与标点的个数有关(例如"。？。"被切分为"。"和"？。")
+      - 6个及以上的"."或者2个及以上的"…"整体视为一个句末,split_sentence只匹配恰好6个或者2个,更长的省略号会被切开
+      - 句子首尾的空白字符会被去除,空白句子会被跳过,split_sentence(best=False)保留原样
+    - 换行符作为句子边界且不属于任何句子
+
+    Args:
+        text (str): 原始文本
+
+    Returns:
+        List[Tuple[int, int]]: 句子下标列表
+    """
+    offsets = []
+    start = 0
+    for m in _RE_SENTENCE_END.finditer(text):
+        end = m.start() if m.group() == '\n' else m.end()
+        _append_stripped_offset(text, start, end, offsets)
+        start = m.end()
+    _append_stripped_offset(text, start, len(text), offsets)
+    return offsets
+
+
+def _append_stripped_offset(text: str, start: int, end: int, offsets: List[Tuple[int, int]]) -> None:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        offsets.append((start, end))